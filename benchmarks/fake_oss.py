@@ -0,0 +1,221 @@
+"""
+本地模拟 OSS 服务（内存存储），支持 oss2 用到的对象接口：
+PUT/GET(Range)/HEAD/DELETE 对象、分片上传（初始化/上传分片/列举分片/完成）、列举对象与 Bucket ACL。
+
+可通过 latency / bandwidth 模拟网络往返延迟与单连接带宽，用于传输类基准测试：
+
+    server = FakeOSSServer(latency=0.02, bandwidth=20 * 1024 * 1024).start()
+    bucket = oss2.Bucket(oss2.Auth('ak', 'sk'), server.endpoint, 'bucket')
+"""
+import hashlib
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+from xml.etree import ElementTree
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def oss(self):
+        return self.server.oss
+
+    def _parse(self):
+        self.oss.requests += 1
+        if self.oss.latency or self.oss.jitter:
+            time.sleep(self.oss.latency + (random.expovariate(1 / self.oss.jitter) if self.oss.jitter else 0))
+        parts = urlsplit(self.path)
+        bucket, _, key = parts.path.lstrip('/').partition('/')
+        query = {k: v[0] for k, v in parse_qs(parts.query, keep_blank_values=True).items()}
+        return bucket, unquote(key), query
+
+    def _read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        self.oss.throttle(len(body))
+        return body
+
+    def _send(self, status, body=b'', headers=None):
+        self.oss.throttle(len(body))
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('x-oss-request-id', uuid.uuid4().hex)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _xml(self, root, children):
+        body = f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><{root}>{children}</{root}>".encode()
+        self._send(200, body, {'Content-Type': 'application/xml'})
+
+    def _not_found(self):
+        self._xml_error(404, 'NoSuchKey')
+
+    def _xml_error(self, status, code):
+        body = (f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>{code}</Code>"
+                f"<Message>{code}</Message><RequestId>0</RequestId></Error>").encode()
+        self._send(status, body, {'Content-Type': 'application/xml'})
+
+    def do_PUT(self):
+        bucket, key, query = self._parse()
+        body = self._read_body()
+        if 'uploadId' in query:
+            upload = self.oss.uploads.get(query['uploadId'])
+            if upload is None:
+                return self._xml_error(404, 'NoSuchUpload')
+            etag = hashlib.md5(body).hexdigest().upper()
+            upload[int(query['partNumber'])] = (body, etag)
+            return self._send(200, headers={'ETag': f'"{etag}"'})
+        etag = self.oss.put(key, body)
+        self._send(200, headers={'ETag': f'"{etag}"'})
+
+    def do_POST(self):
+        bucket, key, query = self._parse()
+        body = self._read_body()
+        if 'uploads' in query:
+            upload_id = uuid.uuid4().hex
+            self.oss.uploads[upload_id] = {}
+            return self._xml('InitiateMultipartUploadResult',
+                             f"<Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{upload_id}</UploadId>")
+        if 'uploadId' in query:
+            upload = self.oss.uploads.pop(query['uploadId'], None)
+            if upload is None:
+                return self._xml_error(404, 'NoSuchUpload')
+            numbers = [int(n.text) for n in ElementTree.fromstring(body).iter('PartNumber')]
+            etag = self.oss.put(key, b''.join(upload[n][0] for n in numbers))
+            return self._xml('CompleteMultipartUploadResult',
+                             f"<Bucket>{bucket}</Bucket><Key>{key}</Key><ETag>\"{etag}\"</ETag>")
+        self._xml_error(400, 'InvalidRequest')
+
+    def do_GET(self):
+        bucket, key, query = self._parse()
+        if not key:
+            if 'acl' in query:
+                return self._xml('AccessControlPolicy',
+                                 f"<Owner><ID>0</ID><DisplayName>0</DisplayName></Owner>"
+                                 f"<AccessControlList><Grant>{self.oss.acl}</Grant></AccessControlList>")
+            return self._list_objects(bucket, query)
+        if 'uploadId' in query:
+            upload = self.oss.uploads.get(query['uploadId'], {})
+            parts = ''.join(f"<Part><PartNumber>{n}</PartNumber><ETag>\"{etag}\"</ETag>"
+                            f"<Size>{len(data)}</Size><LastModified>2020-01-01T00:00:00.000Z</LastModified></Part>"
+                            for n, (data, etag) in sorted(upload.items()))
+            return self._xml('ListPartsResult',
+                             f"<Bucket>{bucket}</Bucket><Key>{key}</Key><UploadId>{query['uploadId']}</UploadId>"
+                             f"<NextPartNumberMarker>0</NextPartNumberMarker><IsTruncated>false</IsTruncated>{parts}")
+
+        obj = self.oss.objects.get(key)
+        if obj is None:
+            return self._not_found()
+        data, etag, mtime = obj
+        headers = {'ETag': f'"{etag}"', 'Last-Modified': mtime, 'Content-Type': 'application/octet-stream',
+                   'Accept-Ranges': 'bytes'}
+        match = re.match(r'bytes=(\d*)-(\d*)', self.headers.get('Range') or '')
+        if match:
+            start = int(match.group(1) or 0)
+            end = min(int(match.group(2)) if match.group(2) else len(data) - 1, len(data) - 1)
+            headers['Content-Range'] = f"bytes {start}-{end}/{len(data)}"
+            return self._send(206, data[start:end + 1], headers)
+        self._send(200, data, headers)
+
+    def do_HEAD(self):
+        bucket, key, query = self._parse()
+        obj = self.oss.objects.get(key)
+        if obj is None:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        data, etag, mtime = obj
+        self.send_response(200)
+        for name, value in {'ETag': f'"{etag}"', 'Last-Modified': mtime, 'Content-Length': str(len(data)),
+                            'Content-Type': 'application/octet-stream', 'x-oss-object-type': 'Normal',
+                            'x-oss-request-id': uuid.uuid4().hex}.items():
+            self.send_header(name, value)
+        self.end_headers()
+
+    def do_DELETE(self):
+        bucket, key, query = self._parse()
+        if 'uploadId' in query:
+            self.oss.uploads.pop(query['uploadId'], None)
+        else:
+            self.oss.objects.pop(key, None)
+        self._send(204)
+
+    def _list_objects(self, bucket, query):
+        prefix, marker = query.get('prefix', ''), query.get('marker', '')
+        max_keys = int(query.get('max-keys') or 1000)
+        keys = sorted(k for k in self.oss.objects if k.startswith(prefix) and k > marker)
+        page, truncated = keys[:max_keys], len(keys) > max_keys
+        contents = ''.join(f"<Contents><Key>{k}</Key><LastModified>2020-01-01T00:00:00.000Z</LastModified>"
+                           f"<ETag>\"{self.oss.objects[k][1]}\"</ETag><Type>Normal</Type>"
+                           f"<Size>{len(self.oss.objects[k][0])}</Size><StorageClass>Standard</StorageClass>"
+                           f"</Contents>" for k in page)
+        self._xml('ListBucketResult',
+                  f"<Name>{bucket}</Name><Prefix>{prefix}</Prefix><Marker>{marker}</Marker>"
+                  f"<MaxKeys>{max_keys}</MaxKeys><Delimiter></Delimiter>"
+                  f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+                  f"<NextMarker>{page[-1] if truncated else ''}</NextMarker>{contents}")
+
+
+class FakeOSSServer:
+    """本地模拟 OSS 服务，在后台线程中运行"""
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, bandwidth=None, acl='private', jitter=0.0):
+        """
+        :param latency: 每个请求附加的延迟（秒）
+        :param jitter: 每个请求额外的随机延迟（指数分布的均值，秒），模拟长尾
+        :param bandwidth: 单连接带宽（字节/秒），None 表示不限速
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.acl = acl
+        self.objects = {}   # key -> (data, etag, last_modified)
+        self.uploads = {}   # upload_id -> {part_number: (data, etag)}
+        self.requests = 0
+        self._httpd = ThreadingHTTPServer((host, port), _Handler)
+        self._httpd.daemon_threads = True
+        self._httpd.oss = self
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def put(self, key, data):
+        etag = hashlib.md5(data).hexdigest().upper()
+        mtime = time.strftime('%a, %d %b %Y %H:%M:%S GMT', time.gmtime())
+        self.objects[key] = (data, etag, mtime)
+        return etag
+
+    def throttle(self, size):
+        """模拟单连接带宽"""
+        if self.bandwidth and size:
+            time.sleep(size / self.bandwidth)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
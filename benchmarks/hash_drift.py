@@ -0,0 +1,94 @@
+"""
+降分辨率解码的哈希漂移与速度评估
+
+    python -m benchmarks.hash_drift [--image-dir resources/img/material] [--megapixels 12]
+
+1. 对素材图片分别以全分辨率解码和 fast_decode 计算哈希，统计各算法的汉明距离漂移
+2. 将部分素材放大为多百万像素 JPEG，比较两种解码路径的耗时与解码后像素缓冲大小
+"""
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+
+from PIL import Image
+
+from config import config
+from deduplicator.hashing import HASH_METHODS, ImageHasher
+
+
+def measure_drift(paths, full, fast, threshold):
+    drift = {method: [] for method in HASH_METHODS}
+    for path in paths:
+        full_hashes = full.compute_all(path)
+        fast_hashes = fast.compute_all(path)
+        for method in HASH_METHODS:
+            drift[method].append(ImageHasher.hamming_distance(full_hashes[method], fast_hashes[method]))
+
+    return {
+        method: {
+            'images': len(values),
+            'mean': sum(values) / len(values),
+            'max': max(values),
+            'identical': sum(v == 0 for v in values) / len(values),
+            'over_threshold': sum(v > threshold for v in values) / len(values),
+        }
+        for method, values in drift.items()
+    }
+
+
+def decoded_pixels(hasher, path):
+    """解码（及共享缩小）后的灰度像素缓冲大小"""
+    with Image.open(path) as img:
+        gray = hasher._load_gray(img)
+        return gray.size[0] * gray.size[1]
+
+
+def measure_speed(paths, full, fast, megapixels):
+    with tempfile.TemporaryDirectory() as tmp:
+        large = []
+        for i, path in enumerate(paths):
+            with Image.open(path) as img:
+                scale = (megapixels * 1e6 / (img.size[0] * img.size[1])) ** 0.5
+                size = (int(img.size[0] * scale), int(img.size[1] * scale))
+                target = os.path.join(tmp, f"{i}.jpg")
+                img.convert('RGB').resize(size, Image.BICUBIC).save(target, quality=90)
+                large.append(target)
+
+        result = {}
+        for name, hasher in (('full', full), ('fast', fast)):
+            start = time.perf_counter()
+            for path in large:
+                hasher.compute_all(path)
+            elapsed = time.perf_counter() - start
+            result[name] = {
+                'images_per_sec': len(large) / elapsed,
+                'decoded_pixels': decoded_pixels(hasher, large[0]),
+            }
+        result['speedup'] = result['fast']['images_per_sec'] / result['full']['images_per_sec']
+        result['drift'] = measure_drift(large, full, fast, config.SIMILARITY_THRESHOLD)
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='降分辨率解码哈希漂移评估')
+    parser.add_argument('--image-dir', default=os.path.join(config.BASE_PATH, 'resources/img/material'))
+    parser.add_argument('--megapixels', type=float, default=12)
+    parser.add_argument('--large-samples', type=int, default=10)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.image_dir, '*')))
+    full = ImageHasher(hash_size=config.HASH_SIZE, highfreq_factor=config.HIGHFREQ_FACTOR)
+    fast = ImageHasher(hash_size=config.HASH_SIZE, highfreq_factor=config.HIGHFREQ_FACTOR, fast_decode=True)
+
+    report = {
+        'source_drift': measure_drift(paths, full, fast, config.SIMILARITY_THRESHOLD),
+        'large_jpeg': measure_speed(paths[:args.large_samples], full, fast, args.megapixels),
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""
+不同哈希尺寸（8/16/32，即 64/256/1024 位指纹）的准确性与成本对比
+
+    python -m benchmarks.hash_size [--sizes 8 16 32] [--rows 20000] [--queries 200]
+
+1. 准确性：素材图片与其变体（缩放 + JPEG 重压缩 + 轻微调亮）在按位数缩放后的阈值下的召回率，
+   以及不同素材之间的误判率（任一种哈希在阈值内即视为相似，与去重判断一致）
+2. 成本：哈希计算吞吐、数据库每行字节数、指纹矩阵每行字节数、索引构建耗时与查询延迟（随机指纹）
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+from PIL import Image, ImageEnhance
+
+from config import config
+from deduplicator.database import DatabaseManager
+from deduplicator.fingerprints import FingerprintMatrix, HASH_TYPES
+from deduplicator.hashing import ImageHasher
+from deduplicator.index import FingerprintIndex
+
+
+def make_variant(path, rng):
+    with Image.open(path) as img:
+        img = img.convert('RGB')
+        scale = rng.uniform(0.5, 0.9)
+        img = img.resize((int(img.width * scale), int(img.height * scale)), Image.BICUBIC)
+        img = ImageEnhance.Brightness(img).enhance(rng.uniform(0.95, 1.05))
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=rng.choice((70, 85)))
+        return buffer.getvalue()
+
+
+def measure_accuracy(hasher, paths, variants, threshold):
+    hasher.compute_all(paths[0])    # 预热（导入 scipy 等）
+    start = time.perf_counter()
+    originals = [hasher.compute_all(path) for path in paths]
+    elapsed = time.perf_counter() - start
+    copies = [hasher.compute_all(data) for data in variants]
+
+    matrix = FingerprintMatrix.from_rows([(i, path, *[h[t] for t in HASH_TYPES])
+                                          for i, (path, h) in enumerate(zip(paths, originals))],
+                                         n_words=hasher.n_words)
+    hits = sum(matrix.min_distances(copy)[i] <= threshold for i, copy in enumerate(copies))
+    false_pairs = sum(int((matrix.min_distances(h, start=i + 1) <= threshold).sum())
+                      for i, h in enumerate(originals))
+    pairs = len(paths) * (len(paths) - 1) // 2
+    return {
+        'hash_images_per_sec': round(len(paths) / elapsed, 1),
+        'variant_recall': round(hits / len(paths), 4),
+        'false_positive_pair_rate': round(false_pairs / pairs, 6) if pairs else 0.0,
+    }
+
+
+def measure_cost(hash_size, rows, queries, threshold, workdir):
+    bits = hash_size * hash_size
+    rng = random.Random(0)
+    records = [(f"bench/{i}.jpg", {t: rng.getrandbits(bits) for t in HASH_TYPES}) for i in range(rows)]
+
+    db_path = os.path.join(workdir, f"{hash_size}.db")
+    db = DatabaseManager(db_path, hash_bits=bits)
+    empty_size = os.path.getsize(db_path)
+    db.add_images(records)
+    with db._get_connection() as conn:
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    db_bytes = (os.path.getsize(db_path) - empty_size) / rows
+
+    start = time.perf_counter()
+    matrix = db.load_matrix()
+    load_time = time.perf_counter() - start
+    matrix_bytes = sum(words.nbytes for words in matrix.words.values()) / rows
+
+    targets = [{t: rng.getrandbits(bits) for t in HASH_TYPES} for _ in range(queries)]
+    result = {
+        'db_bytes_per_row': round(db_bytes, 1),
+        'matrix_bytes_per_row': matrix_bytes,
+        'load_matrix_s': round(load_time, 3),
+        'scan_query_ms': round(_time_queries(lambda h: matrix.min_distances(h), targets), 3),
+    }
+    for index_type in ('mih', 'linear'):
+        index = FingerprintIndex(index_type, hash_bits=bits)
+        start = time.perf_counter()
+        index.load(db.iter_images())
+        result[f'{index_type}_build_s'] = round(time.perf_counter() - start, 3)
+        result[f'{index_type}_query_ms'] = round(_time_queries(lambda h: index.search(h, threshold), targets), 3)
+    db.close()
+    return result
+
+
+def _time_queries(fn, targets):
+    start = time.perf_counter()
+    for target in targets:
+        fn(target)
+    return (time.perf_counter() - start) / len(targets) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description='哈希尺寸准确性与成本评估')
+    parser.add_argument('--image-dir', default=os.path.join(config.BASE_PATH, 'resources/img/material'))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[8, 16, 32])
+    parser.add_argument('--threshold', type=int, default=config.SIMILARITY_THRESHOLD, help='64 位基准阈值')
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    paths = sorted(glob.glob(os.path.join(args.image_dir, '*')))
+    variants = [make_variant(path, rng) for path in paths]
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for hash_size in args.sizes:
+            hasher = ImageHasher(hash_size=hash_size, highfreq_factor=config.HIGHFREQ_FACTOR)
+            threshold = hasher.scale_threshold(args.threshold)
+            results.append({
+                'hash_size': hash_size,
+                'hash_bits': hasher.hash_bits,
+                'threshold': threshold,
+                **measure_accuracy(hasher, paths, variants, threshold),
+                **measure_cost(hash_size, args.rows, args.queries, threshold, workdir),
+            })
+    print(json.dumps({'images': len(paths), 'rows': args.rows, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
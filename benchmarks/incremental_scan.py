@@ -0,0 +1,101 @@
+"""
+增量重复扫描与全量扫描的耗时对比
+
+    python -m benchmarks.incremental_scan [--rows 100000] [--new 1000] [--rounds 3]
+
+库中先写入 rows 条随机指纹（其中一部分为已有记录的近似副本），完成一次增量扫描作为基线；
+之后每轮新增 new 条记录，分别计时：
+    full_s          find_duplicates 全量扫描（O(N²) 分块比对）
+    incremental_s   scan_incremental 只查询新增记录（O(new × 索引查询)）
+并校验两者得到的重复组一致。
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from config import config
+from deduplicator.cascade import MatchCascade
+from deduplicator.core import ImageDeduplicator
+from deduplicator.database import DatabaseManager
+from deduplicator.fingerprints import HASH_TYPES
+from deduplicator.index import FingerprintIndex
+from deduplicator.storage import LocalStorageProvider
+
+
+def make_records(count, offset, pool, hash_bits, rng, duplicate_rate=0.1):
+    """随机指纹，duplicate_rate 比例为 pool 中已有指纹翻转少量位的近似副本"""
+    records = []
+    for i in range(count):
+        if pool and rng.random() < duplicate_rate:
+            base = rng.choice(pool)
+            hashes = {t: base[t] ^ sum(1 << b for b in rng.sample(range(hash_bits), rng.randint(0, 4)))
+                      for t in HASH_TYPES}
+        else:
+            hashes = {t: rng.getrandbits(hash_bits) for t in HASH_TYPES}
+        pool.append(hashes)
+        records.append((f"images/{offset + i}.jpg", hashes))
+    return records
+
+
+def groups(iterable):
+    return sorted(sorted(group.members) for group in iterable)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='增量重复扫描评估')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--new', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--no-verify', action='store_true', help='不与全量扫描结果比对')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    cascade = MatchCascade(config.MATCH_POLICY, config.MATCH_PREFILTER, tuple(config.MATCH_VERIFY),
+                           config.MATCH_WEIGHTS, config.MATCH_QUORUM,
+                           config.MATCH_PREFILTER_FACTOR) if config.MATCH_PREFILTER else None
+    pool = []
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        db = DatabaseManager(os.path.join(workdir, 'bench.db'), hash_bits=64)
+        dedup = ImageDeduplicator(LocalStorageProvider(os.path.join(workdir, 'storage')), db,
+                                  index=FingerprintIndex(config.INDEX_TYPE, cascade=cascade),
+                                  threshold=config.SIMILARITY_THRESHOLD)
+        db.add_images(make_records(args.rows, 0, pool, 64, rng))
+        start = time.perf_counter()
+        dedup.scan_incremental()
+        baseline = time.perf_counter() - start
+
+        total = args.rows
+        for _ in range(args.rounds):
+            db.add_images(make_records(args.new, total, pool, 64, rng))
+            total += args.new
+
+            start = time.perf_counter()
+            report = dedup.scan_incremental()
+            incremental = time.perf_counter() - start
+            start = time.perf_counter()
+            full = groups(dedup.find_duplicates())
+            full_time = time.perf_counter() - start
+
+            result = {
+                'rows': total,
+                'new': report.scanned,
+                'incremental_s': round(incremental, 3),
+                'full_s': round(full_time, 3),
+                'speedup': round(full_time / incremental, 1) if incremental else None,
+                'groups': len(full),
+            }
+            if not args.no_verify:
+                result['consistent'] = groups(dedup.find_duplicates(incremental=True)) == full
+            results.append(result)
+        db.close()
+
+    print(json.dumps({'initial_rows': args.rows, 'initial_scan_s': round(baseline, 3),
+                      'index': config.INDEX_TYPE, 'rounds': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""
+指标埋点开销：关闭与开启 metrics 时的单次调用开销及端到端耗时对比
+
+    python -m benchmarks.instrumentation_overhead [--rows 100000] [--images 200] [--repeat 5]
+
+    primitive_ns      timer() / inc() 单次调用开销（关闭时应接近空循环）
+    index_search      FingerprintIndex.search 平均耗时（索引含 rows 条随机指纹）
+    is_original       ImageDeduplicator.is_original 平均耗时（含摘要、解码、哈希、索引查询）
+关闭 / 开启交替运行 repeat 轮取最小值，on_overhead 为开启相对关闭的增幅；
+关闭时的开销无法直接与"无埋点"对比，off_overhead_estimate 按每次调用经过的埋点数 × 关闭时单点开销估算。
+"""
+import argparse
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image
+
+from config import config
+from deduplicator.cascade import MatchCascade
+from deduplicator.core import ImageDeduplicator
+from deduplicator.database import DatabaseManager
+from deduplicator.fingerprints import HASH_TYPES
+from deduplicator.hashing import ImageHasher
+from deduplicator.index import FingerprintIndex
+from deduplicator.metrics import metrics
+from deduplicator.storage import LocalStorageProvider
+
+
+def primitive_ns(loops=1_000_000):
+    """timer / inc 的单次开销（纳秒），扣除空循环"""
+    def run(fn):
+        start = time.perf_counter()
+        fn()
+        return (time.perf_counter() - start) / loops * 1e9
+
+    def empty():
+        for _ in range(loops):
+            pass
+
+    def timer():
+        for _ in range(loops):
+            with metrics.timer('bench'):
+                pass
+
+    def inc():
+        for _ in range(loops):
+            metrics.inc('bench_total', kind='bench')
+
+    baseline = run(empty)
+    result = {}
+    for enabled in (False, True):
+        metrics.enable(enabled)
+        state = 'on' if enabled else 'off'
+        result[f'timer_{state}'] = round(run(timer) - baseline, 1)
+        result[f'inc_{state}'] = round(run(inc) - baseline, 1)
+    metrics.enable(False)
+    metrics.reset()
+    return result
+
+
+def make_images(count, seed=0):
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        field = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        img = Image.fromarray(field).resize((512, 384), Image.BICUBIC)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def compare(fn, repeat, primitive):
+    """关闭 / 开启交替运行，返回两者的最小耗时、开启时的相对增幅与关闭时的估算开销"""
+    timings = {False: [], True: []}
+    points = 0
+    for _ in range(repeat):
+        for enabled in (False, True):
+            metrics.reset()
+            metrics.enable(enabled)
+            start = time.perf_counter()
+            calls = fn()
+            timings[enabled].append((time.perf_counter() - start) / calls)
+        snapshot = metrics.snapshot()
+        # 每个计时点记一次直方图，计数器按同等数量估计
+        points = 2 * sum(stage['count'] for stage in snapshot['stages'].values()) / calls
+    metrics.enable(False)
+    metrics.reset()
+    off, on = min(timings[False]), min(timings[True])
+    off_cost = points * max(primitive['timer_off'], primitive['inc_off']) * 1e-9
+    return {'off_us': round(off * 1e6, 2), 'on_us': round(on * 1e6, 2),
+            'on_overhead': round(on / off - 1, 4),
+            'points_per_call': round(points, 1),
+            'off_overhead_estimate': round(off_cost / off, 5)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='指标埋点开销')
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    hasher = ImageHasher(hash_size=config.HASH_SIZE, highfreq_factor=config.HIGHFREQ_FACTOR)
+    rng = random.Random(0)
+    rows = [(i + 1, f"background/{i}", *[rng.getrandbits(hasher.hash_bits) for _ in HASH_TYPES])
+            for i in range(args.rows)]
+    images = make_images(args.images)
+    queries = [hasher.compute_all(data) for data in images]
+    cascade = MatchCascade(config.MATCH_POLICY, config.MATCH_PREFILTER, tuple(config.MATCH_VERIFY),
+                           config.MATCH_WEIGHTS, config.MATCH_QUORUM,
+                           config.MATCH_PREFILTER_FACTOR) if config.MATCH_PREFILTER else None
+    threshold = hasher.scale_threshold(config.SIMILARITY_THRESHOLD)
+
+    index = FingerprintIndex(config.INDEX_TYPE, hash_bits=hasher.hash_bits, cascade=cascade)
+    index.load(rows)
+
+    def search():
+        for query in queries:
+            index.search(query, threshold)
+        return len(queries)
+
+    with tempfile.TemporaryDirectory() as workdir:
+        db = DatabaseManager(os.path.join(workdir, 'bench.db'), hash_bits=hasher.hash_bits)
+        db.add_images((path, dict(zip(HASH_TYPES, values))) for _, path, *values in rows)
+        dedup = ImageDeduplicator(LocalStorageProvider(os.path.join(workdir, 'storage')), db, hasher,
+                                  FingerprintIndex(config.INDEX_TYPE, hash_bits=hasher.hash_bits, cascade=cascade),
+                                  config.SIMILARITY_THRESHOLD)
+
+        def is_original():
+            for data in images:
+                dedup.is_original(data)
+            return len(images)
+
+        primitive = primitive_ns()
+        result = {
+            'rows': args.rows,
+            'images': args.images,
+            'primitive_ns': primitive,
+            'index_search': compare(search, args.repeat, primitive),
+            'is_original': compare(is_original, args.repeat, primitive),
+        }
+        db.close()
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+级联匹配策略与原"任一种哈希在阈值内"规则的准确性与速度对比
+
+    python -m benchmarks.match_cascade [--templates 20] [--per-template 8] [--background 50000]
+
+语料：每个模板是一张平滑的低频底图，同一模板上叠加不同的随机图形得到彼此不同但整体明暗布局相近的图像
+（aHash 等粗粒度哈希容易误判的困难负样本）；每张图像再生成缩放 + JPEG 重压缩 + 轻微调亮 + 轻微裁剪的变体作为正样本。
+索引中为原图及随机指纹背景行，用变体查询：
+    recall                变体命中其原图的比例
+    false_positive_rate   每次查询命中其他原图的平均数量
+    query_ms              平均查询耗时（含背景行）
+    scan_s                原图 + 变体 + 背景行的全量重复扫描耗时
+"""
+import argparse
+import io
+import json
+import random
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance
+
+from config import config
+from deduplicator.cascade import MatchCascade
+from deduplicator.clustering import iter_duplicate_groups
+from deduplicator.fingerprints import FingerprintMatrix, HASH_TYPES
+from deduplicator.hashing import ImageHasher
+from deduplicator.index import FingerprintIndex
+
+
+def make_corpus(templates, per_template, seed=0):
+    """返回 (原图 bytes 列表, 变体 bytes 列表)"""
+    rng = random.Random(seed)
+    np_rng = np.random.default_rng(seed)
+    originals, variants = [], []
+    for _ in range(templates):
+        field = np_rng.integers(40, 216, size=(4, 4, 3), dtype=np.uint8)
+        base = Image.fromarray(field).resize((256, 256), Image.BICUBIC)
+        for _ in range(per_template):
+            img = base.copy()
+            draw = ImageDraw.Draw(img)
+            for _ in range(rng.randint(4, 8)):
+                x, y = rng.randint(0, 220), rng.randint(0, 220)
+                w, h = rng.randint(12, 48), rng.randint(12, 48)
+                color = tuple(rng.randint(0, 255) for _ in range(3))
+                shape = draw.ellipse if rng.random() < 0.5 else draw.rectangle
+                shape((x, y, x + w, y + h), fill=color)
+            originals.append(_encode(img, 95))
+
+            crop = rng.randint(0, 5)
+            variant = img.crop((crop, crop, 256 - crop, 256 - crop))
+            scale = rng.uniform(0.6, 0.9)
+            variant = variant.resize((int(variant.width * scale), int(variant.height * scale)), Image.BICUBIC)
+            variant = ImageEnhance.Brightness(variant).enhance(rng.uniform(0.95, 1.05))
+            variants.append(_encode(variant, rng.choice((60, 75, 90))))
+    return originals, variants
+
+
+def _encode(img, quality):
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def build_rows(originals, background, hash_bits, seed=1):
+    rng = random.Random(seed)
+    rows = [(i + 1, f"original/{i}", *[h[t] for t in HASH_TYPES]) for i, h in enumerate(originals)]
+    offset = len(rows) + 1
+    rows += [(offset + i, f"background/{i}", *[rng.getrandbits(hash_bits) for _ in HASH_TYPES])
+             for i in range(background)]
+    return rows
+
+
+def evaluate(name, cascade, rows, queries, threshold, hash_bits, scan_rows):
+    index = FingerprintIndex(config.INDEX_TYPE, hash_bits=hash_bits, cascade=cascade)
+    index.load(rows)
+    hits = false_positives = 0
+    start = time.perf_counter()
+    results = [index.search(query, threshold) for query in queries]
+    elapsed = time.perf_counter() - start
+    for i, result in enumerate(results):
+        ids = {item_id for item_id, _, _ in result}
+        hits += (i + 1) in ids
+        false_positives += len(ids - {i + 1})
+
+    matrix = FingerprintMatrix.from_rows(scan_rows, n_words=ImageHasher.words_for_bits(hash_bits))
+    start = time.perf_counter()
+    groups = sum(1 for _ in iter_duplicate_groups(matrix, threshold, cascade=cascade))
+    scan_time = time.perf_counter() - start
+
+    result = {
+        'policy': name,
+        'recall': round(hits / len(queries), 4),
+        'false_positive_rate': round(false_positives / len(queries), 4),
+        'query_ms': round(elapsed / len(queries) * 1000, 3),
+        'scan_s': round(scan_time, 3),
+        'scan_groups': groups,
+    }
+    if cascade is not None:
+        stages = cascade.stats()['stages']
+        result['stages'] = {t: {'candidates_in': s['candidates_in'], 'candidates_out': s['candidates_out'],
+                                'time_s': round(s['time'], 4)} for t, s in stages.items()}
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='级联匹配策略评估')
+    parser.add_argument('--templates', type=int, default=20)
+    parser.add_argument('--per-template', type=int, default=8)
+    parser.add_argument('--background', type=int, default=50000)
+    parser.add_argument('--threshold', type=int, default=config.SIMILARITY_THRESHOLD, help='64 位基准阈值')
+    args = parser.parse_args()
+
+    hasher = ImageHasher(hash_size=config.HASH_SIZE, highfreq_factor=config.HIGHFREQ_FACTOR)
+    threshold = hasher.scale_threshold(args.threshold)
+    originals, variants = make_corpus(args.templates, args.per_template)
+    original_hashes = [hasher.compute_all(data) for data in originals]
+    queries = [hasher.compute_all(data) for data in variants]
+
+    rows = build_rows(original_hashes, args.background, hasher.hash_bits)
+    first_background = len(original_hashes)
+    scan_rows = rows[:first_background] + [
+        (len(rows) + i + 1, f"variant/{i}", *[h[t] for t in HASH_TYPES]) for i, h in enumerate(queries)
+    ] + rows[first_background:]
+
+    weights = {'phash': 2, 'dhash': 1, 'ahash': 1}
+    candidates = [
+        ('any (current)', None),
+        ('cascade any', MatchCascade('any')),
+        ('cascade all', MatchCascade('all')),
+        ('cascade vote', MatchCascade('vote', weights=weights, quorum=0.5)),
+        ('cascade configured', MatchCascade(config.MATCH_POLICY, config.MATCH_PREFILTER, tuple(config.MATCH_VERIFY),
+                                            config.MATCH_WEIGHTS, config.MATCH_QUORUM,
+                                            config.MATCH_PREFILTER_FACTOR) if config.MATCH_PREFILTER else None),
+    ]
+    results = [evaluate(name, cascade, rows, queries, threshold, hasher.hash_bits, scan_rows)
+               for name, cascade in candidates]
+    print(json.dumps({'images': len(originals), 'background': args.background, 'threshold': threshold,
+                      'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""
+内存映射分片索引与 SQLite 加载 / 扫描的对比：启动耗时、峰值 RSS、查询延迟
+
+    python -m benchmarks.mmap_index [--rows 1000000] [--queries 200] [--workdir /tmp/mmap_bench]
+
+先生成含随机指纹的数据库并构建一次 mmap 索引，然后每种模式在独立子进程中冷启动测量：
+    scan    无索引，每次查询由 find_similar 全表扫描 SQLite
+    memory  启动时从 SQLite 读取全表构建内存索引（当前默认，INDEX_TYPE）
+    mmap    启动时映射索引文件，仅增量同步新记录
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from config import config
+from deduplicator.database import DatabaseManager
+from deduplicator.index import FingerprintIndex
+from deduplicator.mmap_index import MmapFingerprintIndex
+
+MODES = ('scan', 'memory', 'mmap')
+
+
+def build_corpus(workdir, rows, batch_size=50000):
+    """生成随机指纹数据库（已存在且行数一致时复用），并构建 mmap 索引"""
+    os.makedirs(workdir, exist_ok=True)
+    db = DatabaseManager(os.path.join(workdir, 'images.db'))
+    existing = sum(1 for _ in db.iter_images())
+    rng = random.Random(0)
+    for start in range(existing, rows, batch_size):
+        db.add_images((f"bench/{i}.jpg", {t: rng.getrandbits(64) for t in ('phash', 'ahash', 'dhash')})
+                      for i in range(start, min(rows, start + batch_size)))
+    db.build_mmap_index(os.path.join(workdir, 'index')).flush()
+    db.close()
+
+
+def run_mode(workdir, mode, queries, threshold):
+    """子进程内执行：冷启动 + 查询"""
+    rng = random.Random(1)
+    targets = [rng.getrandbits(64) for _ in range(queries)]
+
+    start = time.perf_counter()
+    db = DatabaseManager(os.path.join(workdir, 'images.db'))
+    if mode == 'memory':
+        db.attach_index(FingerprintIndex(config.INDEX_TYPE))
+    elif mode == 'mmap':
+        db.attach_index(MmapFingerprintIndex(os.path.join(workdir, 'index'), db))
+    startup = time.perf_counter() - start
+
+    latencies = []
+    for target in targets:
+        start = time.perf_counter()
+        db.find_similar(target, 'phash', threshold)
+        latencies.append(time.perf_counter() - start)
+    latencies = np.array(latencies) * 1000
+
+    return {
+        'mode': mode,
+        'startup_s': round(startup, 3),
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'query_p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'query_p99_ms': round(float(np.percentile(latencies, 99)), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='mmap 分片索引启动与查询评估')
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--threshold', type=int, default=config.SIMILARITY_THRESHOLD)
+    parser.add_argument('--workdir', default='/tmp/mmap_bench')
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--child', choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_mode(args.workdir, args.child, args.queries, args.threshold)))
+        return
+
+    build_corpus(args.workdir, args.rows)
+    results = []
+    for mode in args.modes:
+        # 独立子进程保证冷启动与 RSS 互不影响（页缓存仍是热的）
+        out = subprocess.run([sys.executable, '-m', 'benchmarks.mmap_index', '--child', mode,
+                              '--workdir', args.workdir, '--queries', str(args.queries),
+                              '--threshold', str(args.threshold)],
+                             check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    print(json.dumps({'rows': args.rows, 'results': results}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+"""
+方向不变哈希：计算开销与旋转 / 翻转副本的召回
+
+    python -m benchmarks.orientation [--images 60] [--background 100000]
+
+以 resources/img/material 中的图片为原图，每张生成一个随机旋转 / 翻转（并重压缩）的副本，测量：
+    ingest         单方向 compute_all、单次 DCT 的 8 方向 compute_dihedral、
+                   以及先旋转 / 翻转图像再逐个计算 8 次的朴素做法，每张图像的耗时
+    variant_drift  8 方向哈希与"先变换图像再计算"的哈希之间的平均 / 最大位差
+    recall         单方向与方向不变模式下，副本命中其原图的比例（及其他原图的误命中数）
+    query_ms       索引（含 background 条随机指纹）单方向 / 8 方向查询的平均耗时
+"""
+import argparse
+import glob
+import io
+import json
+import random
+import time
+
+from PIL import Image
+
+from config import config
+from deduplicator.cascade import MatchCascade
+from deduplicator.fingerprints import HASH_TYPES
+from deduplicator.hashing import DIHEDRAL_TRANSFORMS, ImageHasher
+from deduplicator.index import FingerprintIndex
+
+# DIHEDRAL_TRANSFORMS 各方向对应的 PIL 变换
+PIL_TRANSPOSE = {
+    'identity': None,
+    'flip_left_right': Image.Transpose.FLIP_LEFT_RIGHT,
+    'flip_top_bottom': Image.Transpose.FLIP_TOP_BOTTOM,
+    'rotate_180': Image.Transpose.ROTATE_180,
+    'transpose': Image.Transpose.TRANSPOSE,
+    'rotate_90': Image.Transpose.ROTATE_90,
+    'rotate_270': Image.Transpose.ROTATE_270,
+    'transverse': Image.Transpose.TRANSVERSE,
+}
+
+
+def _encode(img, quality=90):
+    buffer = io.BytesIO()
+    img.convert('RGB').save(buffer, format='JPEG', quality=quality)
+    return buffer.getvalue()
+
+
+def _oriented(img, name):
+    op = PIL_TRANSPOSE[name]
+    return img if op is None else img.transpose(op)
+
+
+def bench_ingest(images, hasher, dihedral_hasher):
+    def naive(data):
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+            return [hasher.compute_all(_encode(_oriented(img, name))) for name in DIHEDRAL_TRANSFORMS]
+
+    result = {}
+    for name, fn in (('single', hasher.compute_all), ('dihedral', dihedral_hasher.compute_all),
+                     ('naive_8x', naive)):
+        start = time.perf_counter()
+        for data in images:
+            fn(data)
+        result[f'{name}_ms'] = round((time.perf_counter() - start) / len(images) * 1000, 3)
+    result['dihedral_overhead'] = round(result['dihedral_ms'] / result['single_ms'] - 1, 4)
+    return result
+
+
+def variant_drift(images, hasher, dihedral_hasher):
+    distances = {method: [] for method in HASH_TYPES}
+    for data in images:
+        variants = dihedral_hasher.compute_all(data)['variants']
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()
+            for k, name in enumerate(DIHEDRAL_TRANSFORMS):
+                # 无损保存变换后的图像，只比较哈希计算本身的差异
+                buffer = io.BytesIO()
+                _oriented(img, name).save(buffer, format='PNG')
+                direct = hasher.compute_all(buffer.getvalue())
+                for method in HASH_TYPES:
+                    distances[method].append(ImageHasher.hamming_distance(direct[method], variants[method][k]))
+    return {method: {'mean': round(sum(d) / len(d), 3), 'max': max(d)} for method, d in distances.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='方向不变哈希评估')
+    parser.add_argument('--images', type=int, default=60)
+    parser.add_argument('--background', type=int, default=100000)
+    parser.add_argument('--threshold', type=int, default=config.SIMILARITY_THRESHOLD, help='64 位基准阈值')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    hasher = ImageHasher(hash_size=config.HASH_SIZE, highfreq_factor=config.HIGHFREQ_FACTOR,
+                         fast_decode=config.FAST_DECODE)
+    dihedral_hasher = ImageHasher(hash_size=config.HASH_SIZE, highfreq_factor=config.HIGHFREQ_FACTOR,
+                                  fast_decode=config.FAST_DECODE, orientation_invariant=True)
+    threshold = hasher.scale_threshold(args.threshold)
+
+    seeds = sorted(glob.glob('resources/img/material/*'))[:args.images]
+    originals, copies = [], []
+    for path in seeds:
+        with Image.open(path) as img:
+            img.load()
+            originals.append(_encode(img))
+            name = rng.choice([n for n in DIHEDRAL_TRANSFORMS if n != 'identity'])
+            copies.append(_encode(_oriented(img, name), rng.choice((70, 85))))
+
+    stored = [hasher.compute_all(data) for data in originals]
+    rows = [(i + 1, f"original/{i}", *[h[t] for t in HASH_TYPES]) for i, h in enumerate(stored)]
+    offset = len(rows) + 1
+    rows += [(offset + i, f"background/{i}", *[rng.getrandbits(hasher.hash_bits) for _ in HASH_TYPES])
+             for i in range(args.background)]
+
+    cascade = MatchCascade(config.MATCH_POLICY, config.MATCH_PREFILTER, tuple(config.MATCH_VERIFY),
+                           config.MATCH_WEIGHTS, config.MATCH_QUORUM,
+                           config.MATCH_PREFILTER_FACTOR) if config.MATCH_PREFILTER else None
+    index = FingerprintIndex(config.INDEX_TYPE, hash_bits=hasher.hash_bits, cascade=cascade)
+    index.load(rows)
+
+    recall, query_ms = {}, {}
+    for mode, h in (('single', hasher), ('dihedral', dihedral_hasher)):
+        queries = [h.compute_all(data) for data in copies]
+        hits = false_positives = 0
+        start = time.perf_counter()
+        results = [index.search(query, threshold) for query in queries]
+        query_ms[mode] = round((time.perf_counter() - start) / len(queries) * 1000, 3)
+        for i, result in enumerate(results):
+            ids = {item_id for item_id, _, _ in result}
+            hits += (i + 1) in ids
+            false_positives += len(ids - {i + 1})
+        recall[mode] = {'recall': round(hits / len(queries), 4), 'false_positives': false_positives}
+
+    print(json.dumps({
+        'images': len(seeds),
+        'background': args.background,
+        'threshold': threshold,
+        'index': config.INDEX_TYPE,
+        'ingest': bench_ingest(originals, hasher, dihedral_hasher),
+        'variant_drift': variant_drift(originals[:20], hasher, dihedral_hasher),
+        'recall': recall,
+        'query_ms': query_ms,
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
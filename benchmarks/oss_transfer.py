@@ -0,0 +1,65 @@
+"""
+OSS 单次 PUT/GET 与分片并行传输的吞吐量对比（使用本地模拟 OSS 服务）
+
+    python -m benchmarks.oss_transfer [--sizes 1 8 32] [--bandwidth 20] [--latency 0.02]
+
+模拟服务按单连接限速，分片并行的收益来自多个连接同时传输。
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.fake_oss import FakeOSSServer
+from deduplicator.storage import OSSProvider
+
+MB = 1024 * 1024
+
+
+def measure(provider, path, remote_path, size):
+    start = time.perf_counter()
+    provider.upload(path, remote_path)
+    upload_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    provider.download(remote_path, path + '.download')
+    download_elapsed = time.perf_counter() - start
+    os.remove(path + '.download')
+    return {'upload_mb_per_sec': size / MB / upload_elapsed,
+            'download_mb_per_sec': size / MB / download_elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='OSS 分片传输吞吐量评估')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 8, 32], help='文件大小（MB）')
+    parser.add_argument('--bandwidth', type=float, default=20, help='模拟单连接带宽（MB/s）')
+    parser.add_argument('--latency', type=float, default=0.02, help='模拟请求延迟（秒）')
+    parser.add_argument('--part-size', type=int, default=2, help='分片大小（MB）')
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    report = []
+    with tempfile.TemporaryDirectory() as tmp, \
+            FakeOSSServer(latency=args.latency, bandwidth=args.bandwidth * MB, acl='public-read') as server:
+        providers = {
+            'single': OSSProvider('ak', 'sk', server.endpoint, 'bucket',
+                                  multipart_threshold=1 << 62, checkpoint_dir=tmp),
+            'multipart': OSSProvider('ak', 'sk', server.endpoint, 'bucket',
+                                     multipart_threshold=args.part_size * MB, part_size=args.part_size * MB,
+                                     num_threads=args.threads, checkpoint_dir=tmp),
+        }
+        for size_mb in args.sizes:
+            path = os.path.join(tmp, f"{size_mb}mb.bin")
+            with open(path, 'wb') as f:
+                f.write(os.urandom(size_mb * MB))
+            row = {'size_mb': size_mb}
+            for name, provider in providers.items():
+                row[name] = measure(provider, path, f"bench/{name}/{size_mb}mb.bin", size_mb * MB)
+            report.append(row)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""
+写后上传队列（outbox）与同步上传的 upload_image 延迟对比（使用本地模拟 OSS 服务）
+
+    python -m benchmarks.outbox_latency [--images 100] [--latency 0.03] [--jitter 0.02] [--acl-ttl 0]
+
+逐张调用 upload_image，测量：
+    sync    查重 → 预留 → OSS PUT → ACL 查询（生成访问 URL）→ 写库，调用方等待全部完成
+    outbox  查重 → 预留与入队（单个本地事务）即返回，后台线程上传
+两种模式的调用延迟分位数，以及 outbox 模式下全部上传完成（drain）所需的时间。
+acl-ttl 为 0 时每次上传都查询 Bucket ACL（OSSProvider 默认缓存 300 秒）。
+"""
+import argparse
+import glob
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.fake_oss import FakeOSSServer
+from benchmarks.suite import percentiles
+from config import config
+from deduplicator.core import ImageDeduplicator
+from deduplicator.database import DatabaseManager
+from deduplicator.hashing import ImageHasher
+from deduplicator.outbox import UploadOutbox
+from deduplicator.storage import OSSProvider
+
+
+def run(mode, workdir, server, paths, args):
+    storage = OSSProvider('ak', 'sk', server.endpoint, 'bucket', acl_ttl=args.acl_ttl,
+                          checkpoint_dir=os.path.join(workdir, f"{mode}_checkpoints"))
+    db = DatabaseManager(os.path.join(workdir, f"{mode}.db"))
+    outbox = None
+    if mode == 'outbox':
+        outbox = UploadOutbox(db, storage, spool_dir=os.path.join(workdir, 'spool'),
+                              workers=args.workers).start()
+    hasher = ImageHasher(hash_size=config.HASH_SIZE, highfreq_factor=config.HIGHFREQ_FACTOR,
+                         fast_decode=config.FAST_DECODE)
+    dedup = ImageDeduplicator(storage, db, hasher, threshold=config.SIMILARITY_THRESHOLD, outbox=outbox)
+
+    latency, messages = [], {}
+    start = time.perf_counter()
+    for path in paths:
+        t = time.perf_counter()
+        _, message = dedup.upload_image(path, f"{mode}/")
+        latency.append(time.perf_counter() - t)
+        messages[message] = messages.get(message, 0) + 1
+    calls_s = time.perf_counter() - start
+
+    result = {'upload_image': percentiles(latency), 'messages': messages, 'calls_s': round(calls_s, 3)}
+    if outbox is not None:
+        outbox.drain()
+        result['drain_s'] = round(time.perf_counter() - start, 3)
+        result['tasks'] = db.outbox_counts()
+        outbox.close()
+    result['stored'] = len(db.get_all_images())
+    db.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='写后上传队列延迟评估')
+    parser.add_argument('--images', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0.03, help='模拟请求延迟（秒）')
+    parser.add_argument('--jitter', type=float, default=0.02, help='额外随机延迟均值（秒）')
+    parser.add_argument('--acl-ttl', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(config.BASE_PATH, 'resources/img/material/*')))[:args.images]
+    report = {'images': len(paths), 'latency_s': args.latency, 'jitter_s': args.jitter,
+              'acl_ttl': args.acl_ttl, 'workers': args.workers}
+    with tempfile.TemporaryDirectory() as workdir, \
+            FakeOSSServer(latency=args.latency, jitter=args.jitter, acl='private') as server:
+        for mode in ('sync', 'outbox'):
+            report[mode] = run(mode, workdir, server, paths, args)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""
+批量 pHash 与逐张 pHash 的吞吐量对比
+
+    python -m benchmarks.phash_batch [--repeat 20] [--batch-size 256]
+
+图像预先解码到内存，仅比较哈希计算本身（缩放 + DCT + 中位数 + 打包），并校验两条路径结果逐位一致。
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+from PIL import Image
+
+from config import config
+from deduplicator.hashing import ImageHasher
+
+
+def main():
+    parser = argparse.ArgumentParser(description='批量 pHash 吞吐量评估')
+    parser.add_argument('--image-dir', default=os.path.join(config.BASE_PATH, 'resources/img/material'))
+    parser.add_argument('--repeat', type=int, default=20, help='素材重复次数，用于放大样本量')
+    parser.add_argument('--batch-size', type=int, default=256)
+    args = parser.parse_args()
+
+    hasher = ImageHasher(hash_size=config.HASH_SIZE, highfreq_factor=config.HIGHFREQ_FACTOR)
+    images = []
+    for path in sorted(glob.glob(os.path.join(args.image_dir, '*'))):
+        with Image.open(path) as img:
+            images.append(img.convert('L'))
+    images = images * args.repeat
+
+    start = time.perf_counter()
+    single = [hasher._compute_hash(img) for img in images]
+    single_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    thumbnails = [hasher.phash_thumbnail(img) for img in images]
+    resize_elapsed = time.perf_counter() - start
+    batched = []
+    for i in range(0, len(thumbnails), args.batch_size):
+        batched.extend(hasher.phash_batch(thumbnails[i:i + args.batch_size]))
+    batch_elapsed = time.perf_counter() - start
+
+    # 仅比较缩略图之后的内核部分
+    start = time.perf_counter()
+    for thumb in thumbnails:
+        hasher.phash_batch(thumb[None])
+    kernel_single_elapsed = time.perf_counter() - start
+
+    report = {
+        'images': len(images),
+        'batch_size': args.batch_size,
+        'bit_identical': single == batched,
+        'single_images_per_sec': len(images) / single_elapsed,
+        'batch_images_per_sec': len(images) / batch_elapsed,
+        'kernel_single_images_per_sec': len(images) / kernel_single_elapsed,
+        'kernel_batch_images_per_sec': len(images) / (batch_elapsed - resize_elapsed),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""
+多进程并发上传的查重一致性压力测试
+
+    python -m benchmarks.reserve_stress [--processes 8] [--groups 40] [--variants 4] [--mode reserve|naive]
+
+生成若干组近似重复图像（同一底图的重新压缩 / 轻微调色版本），打乱后由多个进程共享同一数据库并发上传，
+结束后全量比对已入库记录，统计落在阈值内的重复组（应为 0）。
+    reserve  ImageDeduplicator.upload_image（数据库预留 + 事务内复查）
+    naive    先查重、再上传、再写库，无预留（对照组）
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from PIL import Image, ImageEnhance
+
+from deduplicator.clustering import iter_duplicate_groups
+from deduplicator.core import ImageDeduplicator
+from deduplicator.database import DatabaseManager
+from deduplicator.storage import LocalStorageProvider
+
+
+def make_corpus(directory, groups, variants, seed=0):
+    rng = random.Random(seed)
+    paths = []
+    for g in range(groups):
+        base = Image.effect_noise((64, 64), 80).resize((256, 256), Image.BICUBIC)
+        base = Image.merge('RGB', [base, base.rotate(rng.choice((90, 180, 270))), base.transpose(Image.FLIP_LEFT_RIGHT)])
+        for v in range(variants):
+            img = ImageEnhance.Brightness(base).enhance(1 + rng.uniform(-0.05, 0.05))
+            path = os.path.join(directory, f"{g}_{v}.jpg")
+            img.save(path, quality=rng.choice((80, 90, 95)))
+            paths.append(path)
+    rng.shuffle(paths)
+    return paths
+
+
+def worker(args):
+    paths, workdir, mode, threshold, barrier = args
+    db = DatabaseManager(os.path.join(workdir, 'images.db'))
+    dedup = ImageDeduplicator(LocalStorageProvider(os.path.join(workdir, 'storage')), db)
+    barrier.wait()
+    admitted = 0
+    for path in paths:
+        if mode == 'reserve':
+            remote_path, _ = dedup.upload_image(path, threshold=threshold)
+            admitted += remote_path is not None
+        else:
+            original, hashes = dedup._check_original(path, threshold)
+            if not original:
+                continue
+            remote_path = f"images/{os.path.basename(path)}"
+            if dedup.storage.upload(path, remote_path) and db.add_image(remote_path, hashes):
+                admitted += 1
+    db.close()
+    return admitted
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多进程并发上传查重一致性压力测试')
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--groups', type=int, default=40)
+    parser.add_argument('--variants', type=int, default=4)
+    parser.add_argument('--threshold', type=int, default=5)
+    parser.add_argument('--mode', choices=('reserve', 'naive'), default='reserve')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus = os.path.join(workdir, 'corpus')
+        os.makedirs(corpus)
+        paths = make_corpus(corpus, args.groups, args.variants)
+        DatabaseManager(os.path.join(workdir, 'images.db')).close()   # 预先建表
+
+        manager = multiprocessing.Manager()
+        barrier = manager.Barrier(args.processes)
+        # 各进程按相同顺序处理同一批图像，最大化同时到达的近似重复
+        jobs = [(paths, workdir, args.mode, args.threshold, barrier) for _ in range(args.processes)]
+        start = time.perf_counter()
+        with multiprocessing.Pool(args.processes) as pool:
+            admitted = pool.map(worker, jobs)
+        elapsed = time.perf_counter() - start
+
+        db = DatabaseManager(os.path.join(workdir, 'images.db'))
+        groups = list(iter_duplicate_groups(db.load_matrix(), args.threshold))
+        print(json.dumps({
+            'mode': args.mode,
+            'processes': args.processes,
+            'images': len(paths),
+            'attempts': len(paths) * args.processes,
+            'admitted': sum(admitted),
+            'duplicate_groups_admitted': len(groups),
+            'elapsed_s': round(elapsed, 3),
+            'attempts_per_sec': round(len(paths) * args.processes / elapsed, 1),
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
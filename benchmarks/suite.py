@@ -0,0 +1,395 @@
+"""
+去重性能与准确性基准套件，结果输出为 JSON，便于在提交之间比较回归
+
+    python -m benchmarks.suite [--variants 5] [--index-sizes 1000 10000 100000] [--output results.json]
+    python -m benchmarks.suite --compare base.json head.json
+
+以 resources/img/material 中的图片为种子，生成近似重复语料（缩放、重压缩、裁剪、调亮、水印），测量：
+    hashing          各哈希算法单独计算的吞吐量（图像/秒）
+    db_insert        批量 / 逐条写库速率（行/秒）
+    is_original      不同索引规模下 is_original（含摘要、解码与查询）与纯索引查询的延迟分位数
+    find_duplicates  语料库全量重复扫描耗时
+    accuracy         各阈值下成对判定的精确率 / 召回率（原"任一种哈希"规则与配置的级联策略）
+    segments         分段指纹：每张图像的分段数与存储开销、分段投票查询延迟，
+                     以及裁剪 / 加边框 / 截图查询在整图指纹与分段投票下的召回（未入库种子作误报对照）
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageEnhance
+
+from config import config
+from deduplicator.cascade import MatchCascade
+from deduplicator.core import ImageDeduplicator
+from deduplicator.database import DatabaseManager
+from deduplicator.fingerprints import FingerprintMatrix, HASH_TYPES
+from deduplicator.hashing import HASH_METHODS, ImageHasher
+from deduplicator.index import FingerprintIndex
+from deduplicator.segments import SegmentIndex
+from deduplicator.storage import LocalStorageProvider
+
+TRANSFORMS = ('resize', 'recompress', 'crop', 'brightness', 'watermark')
+# 整图指纹难以识别的局部重复
+PARTIAL_TRANSFORMS = ('crop', 'border', 'screenshot')
+
+
+def transform(img, kind, rng):
+    img = img.convert('RGB')
+    if kind == 'resize':
+        scale = rng.uniform(0.4, 0.9)
+        return img.resize((max(8, int(img.width * scale)), max(8, int(img.height * scale))), Image.BICUBIC)
+    if kind == 'crop':
+        dx, dy = int(img.width * rng.uniform(0, 0.05)), int(img.height * rng.uniform(0, 0.05))
+        return img.crop((dx, dy, img.width - dx, img.height - dy))
+    if kind == 'brightness':
+        return ImageEnhance.Brightness(img).enhance(rng.uniform(0.85, 1.15))
+    if kind == 'watermark':
+        overlay = Image.new('RGBA', img.size)
+        draw = ImageDraw.Draw(overlay)
+        x, y = rng.randint(0, max(0, img.width - 80)), rng.randint(0, max(0, img.height - 20))
+        draw.text((x, y), 'SAMPLE', fill=(255, 255, 255, 160))
+        return Image.alpha_composite(img.convert('RGBA'), overlay).convert('RGB')
+    return img     # recompress：仅以较低质量重新保存
+
+
+def partial_transform(img, kind, rng):
+    """大幅裁剪（保留 55%~80% 边长）、加纯色边框、嵌入更大的截图画面"""
+    img = img.convert('RGB')
+    w, h = img.size
+    if kind == 'crop':
+        cw, ch = int(w * rng.uniform(0.55, 0.8)), int(h * rng.uniform(0.55, 0.8))
+        x, y = rng.randint(0, w - cw), rng.randint(0, h - ch)
+        return img.crop((x, y, x + cw, y + ch))
+    if kind == 'border':
+        pad = int(max(w, h) * rng.uniform(0.1, 0.3))
+        out = Image.new('RGB', (w + 2 * pad, h + 2 * pad), tuple(rng.randint(0, 255) for _ in range(3)))
+        out.paste(img, (pad, pad))
+        return out
+    out = Image.new('RGB', (int(w * rng.uniform(1.6, 2.2)), int(h * rng.uniform(1.2, 1.5))), (32, 32, 36))
+    ImageDraw.Draw(out).rectangle((0, 0, out.width, int(h * 0.08)), fill=(220, 220, 220))   # 标题栏
+    out.paste(img, (rng.randint(0, out.width - w), rng.randint(int(h * 0.1), out.height - h)))
+    return out
+
+
+def make_corpus(seeds, variants, directory, seed=0):
+    """
+    :return: [(路径, 种子编号)]，种子编号相同的图像互为近似重复
+    """
+    rng = random.Random(seed)
+    corpus = []
+    for label, path in enumerate(seeds):
+        with Image.open(path) as img:
+            img.load()
+            corpus.append((path, label))
+            for v in range(variants):
+                kinds = rng.sample(TRANSFORMS, rng.randint(1, 2))
+                out = img
+                for kind in kinds:
+                    out = transform(out, kind, rng)
+                target = os.path.join(directory, f"{label}_{v}.jpg")
+                out.convert('RGB').save(target, quality=rng.choice((60, 75, 90)))
+                corpus.append((target, label))
+    return corpus
+
+
+def percentiles(seconds):
+    ms = np.array(seconds) * 1000
+    return {'p50_ms': round(float(np.percentile(ms, 50)), 3), 'p99_ms': round(float(np.percentile(ms, 99)), 3),
+            'mean_ms': round(float(ms.mean()), 3)}
+
+
+def bench_hashing(hasher, paths):
+    hasher.compute_all(paths[0])   # 预热
+    result = {}
+    for method in HASH_METHODS + ('all',):
+        methods = HASH_METHODS if method == 'all' else (method,)
+        start = time.perf_counter()
+        for path in paths:
+            hasher.compute_all(path, methods)
+        result[method] = round(len(paths) / (time.perf_counter() - start), 1)
+    return {'images_per_sec': result}
+
+
+def bench_insert(workdir, hasher, rows):
+    rng = random.Random(2)
+    records = [(f"bench/{i}.jpg", {t: rng.getrandbits(hasher.hash_bits) for t in HASH_TYPES})
+               for i in range(rows)]
+    db = DatabaseManager(os.path.join(workdir, 'insert.db'), hash_bits=hasher.hash_bits)
+    start = time.perf_counter()
+    for i in range(0, rows, 1000):
+        db.add_images(records[i:i + 1000])
+    batch_rate = rows / (time.perf_counter() - start)
+
+    single = records[:min(rows, 2000)]
+    start = time.perf_counter()
+    for storage_path, hashes in single:
+        db.add_image(f"single/{storage_path}", hashes)
+    single_rate = len(single) / (time.perf_counter() - start)
+    db.close()
+    return {'batch_rows_per_sec': round(batch_rate, 1), 'single_rows_per_sec': round(single_rate, 1)}
+
+
+def build_dedup(workdir, name, hasher, cascade, corpus_hashes, background):
+    """由语料原图指纹与随机背景行构建数据库与去重器"""
+    rng = random.Random(3)
+    db = DatabaseManager(os.path.join(workdir, f"{name}.db"), hash_bits=hasher.hash_bits)
+    records = [(f"corpus/{i}", hashes) for i, hashes in enumerate(corpus_hashes)]
+    records += [(f"background/{i}", {t: rng.getrandbits(hasher.hash_bits) for t in HASH_TYPES})
+                for i in range(background)]
+    for i in range(0, len(records), 10000):
+        db.add_images(records[i:i + 10000])
+    index = FingerprintIndex(config.INDEX_TYPE, hash_bits=hasher.hash_bits, cascade=cascade)
+    storage = LocalStorageProvider(os.path.join(workdir, f"{name}_storage"))
+    return ImageDeduplicator(storage, db, hasher, index, config.SIMILARITY_THRESHOLD)
+
+
+def bench_is_original(workdir, hasher, cascade, corpus, seed_hashes, index_sizes, queries):
+    rng = random.Random(4)
+    query_paths = [path for path, _ in rng.sample(corpus, min(queries, len(corpus)))]
+    query_hashes = [hasher.compute_all(path) for path in query_paths]
+    result = {}
+    for size in index_sizes:
+        dedup = build_dedup(workdir, f"index_{size}", hasher, cascade, seed_hashes,
+                            max(0, size - len(seed_hashes)))
+        full, search = [], []
+        for path, hashes in zip(query_paths, query_hashes):
+            start = time.perf_counter()
+            dedup.is_original(path)
+            full.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            dedup.index.search(hashes, dedup.threshold)
+            search.append(time.perf_counter() - start)
+        result[str(size)] = {'is_original': percentiles(full), 'index_search': percentiles(search)}
+        dedup.db.close()
+    return result
+
+
+def bench_find_duplicates(workdir, hasher, cascade, corpus_hashes):
+    dedup = build_dedup(workdir, 'scan', hasher, cascade, corpus_hashes, 0)
+    start = time.perf_counter()
+    groups = sum(1 for _ in dedup.find_duplicates())
+    elapsed = time.perf_counter() - start
+    dedup.db.close()
+    return {'rows': len(corpus_hashes), 'groups': groups, 'wall_s': round(elapsed, 3)}
+
+
+def bench_accuracy(hasher, cascade, corpus, corpus_hashes, thresholds):
+    labels = np.array([label for _, label in corpus])
+    matrix = FingerprintMatrix.from_rows([(i, path, *[h[t] for t in HASH_TYPES])
+                                          for i, ((path, _), h) in enumerate(zip(corpus, corpus_hashes))],
+                                         n_words=hasher.n_words)
+    everything = slice(0, len(matrix))
+    upper = np.triu(np.ones((len(matrix), len(matrix)), dtype=bool), k=1)
+    truth = (labels[:, None] == labels[None, :]) & upper
+    distances = matrix.block_min_distances(everything, everything)
+
+    def score(predicted):
+        predicted &= upper
+        tp = int((predicted & truth).sum())
+        fp = int((predicted & ~truth).sum())
+        positives = int(truth.sum())
+        return {'precision': round(tp / (tp + fp), 4) if tp + fp else 1.0,
+                'recall': round(tp / positives, 4) if positives else 1.0,
+                'false_positives': fp}
+
+    result = {}
+    for threshold in thresholds:
+        scaled = hasher.scale_threshold(threshold)
+        entry = {'scaled_threshold': scaled, 'any': score(distances <= scaled)}
+        if cascade is not None:
+            entry['cascade'] = score(cascade.block_matches(matrix, everything, everything, scaled))
+        result[str(threshold)] = entry
+    return result
+
+
+def _db_size(path):
+    return sum(os.path.getsize(p) for p in (path, path + '-wal') if os.path.exists(p))
+
+
+def bench_segments(workdir, hasher, seeds, background, seed=5):
+    """
+    一半种子入库（带分段指纹），另一半作为误报对照；另建不写分段的同样数据库比较存储开销。
+    背景记录为随机整图指纹与随机分段（每条按入库种子的平均分段数）。
+    """
+    rng = random.Random(seed)
+    segment_hasher = ImageHasher(hash_size=hasher.hash_size, highfreq_factor=hasher.highfreq_factor,
+                                 fast_decode=hasher.fast_decode, segments=True)
+    stored, held_out = seeds[:len(seeds) // 2], seeds[len(seeds) // 2:]
+
+    start = time.perf_counter()
+    stored_hashes = [segment_hasher.compute_all(path) for path in stored]
+    segment_ms = (time.perf_counter() - start) / len(stored) * 1000
+    start = time.perf_counter()
+    for path in stored:
+        hasher.compute_all(path)
+    whole_ms = (time.perf_counter() - start) / len(stored) * 1000
+
+    per_image = [len(h['segments']) for h in stored_hashes]
+    mean_segments = max(1, round(sum(per_image) / len(per_image)))
+    records = [(f"corpus/{i}", h) for i, h in enumerate(stored_hashes)]
+    for i in range(background):
+        hashes = {t: rng.getrandbits(hasher.hash_bits) for t in HASH_TYPES}
+        hashes['segments'] = [rng.getrandbits(hasher.hash_bits) for _ in range(mean_segments)]
+        records.append((f"background/{i}", hashes))
+
+    sizes = {}
+    for name, rows in (('plain', [(path, {k: v for k, v in h.items() if k != 'segments'}) for path, h in records]),
+                       ('segments', records)):
+        db_path = os.path.join(workdir, f"segments_{name}.db")
+        db = DatabaseManager(db_path, hash_bits=hasher.hash_bits)
+        for i in range(0, len(rows), 10000):
+            db.add_images(rows[i:i + 10000])
+        db.close()
+        sizes[name] = _db_size(db_path)
+
+    db = DatabaseManager(os.path.join(workdir, 'segments_segments.db'), hash_bits=hasher.hash_bits)
+    start = time.perf_counter()
+    dedup = ImageDeduplicator(
+        LocalStorageProvider(os.path.join(workdir, 'segments_storage')), db, segment_hasher,
+        FingerprintIndex(config.INDEX_TYPE, hash_bits=hasher.hash_bits), config.SIMILARITY_THRESHOLD,
+        SegmentIndex(config.INDEX_TYPE, hash_bits=hasher.hash_bits,
+                     threshold=hasher.scale_threshold(config.SEGMENT_THRESHOLD),
+                     min_votes=config.SEGMENT_MIN_VOTES))
+    load_s = time.perf_counter() - start
+
+    recall, latency = {}, []
+    for kind in PARTIAL_TRANSFORMS:
+        whole = partial = 0
+        for label, path in enumerate(stored):
+            with Image.open(path) as img:
+                img.load()
+                query = io.BytesIO()
+                partial_transform(img, kind, rng).save(query, format='JPEG', quality=85)
+            hashes = segment_hasher.compute_all(query.getvalue())
+            target = f"corpus/{label}"
+            whole += any(p == target for _, p, _ in dedup.index.search(hashes, dedup.threshold))
+            start = time.perf_counter()
+            matches = dedup.partial_matches(hashes)
+            latency.append(time.perf_counter() - start)
+            partial += any(p == target for _, p, _, _ in matches)
+        recall[kind] = {'whole_image': round(whole / len(stored), 4), 'segments': round(partial / len(stored), 4)}
+
+    false_positives = sum(bool(dedup.partial_matches(segment_hasher.compute_all(path))) for path in held_out)
+    result = {
+        'stored_images': len(stored),
+        'background': background,
+        'segments_per_image': {'mean': round(sum(per_image) / len(per_image), 2), 'max': max(per_image)},
+        'hash_ms': {'whole_image': round(whole_ms, 3), 'with_segments': round(segment_ms, 3)},
+        'storage_bytes_per_image': {
+            'plain': round(sizes['plain'] / len(records), 1),
+            'segments': round(sizes['segments'] / len(records), 1),
+            'overhead': round((sizes['segments'] - sizes['plain']) / len(records), 1),
+        },
+        'index_load_s': round(load_s, 3),
+        'query': percentiles(latency),
+        'recall': recall,
+        'held_out_false_positives': false_positives,
+        'held_out_queries': len(held_out),
+    }
+    db.close()
+    return result
+
+
+def metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=config.BASE_PATH).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'cpu_count': os.cpu_count(),
+        'hash_size': config.HASH_SIZE,
+        'index_type': config.INDEX_TYPE,
+        'match_policy': config.MATCH_POLICY if config.MATCH_PREFILTER else 'any',
+    }
+
+
+def compare(base_path, head_path):
+    """逐项比较两份结果中的数值，输出相对变化"""
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+
+    def walk(a, b, prefix):
+        if isinstance(a, dict) and isinstance(b, dict):
+            for key in a:
+                if key in b and key != 'meta':
+                    yield from walk(a[key], b[key], f"{prefix}.{key}" if prefix else key)
+        elif isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool):
+            yield prefix, a, b, (b - a) / a if a else None
+
+    rows = [{'metric': name, 'base': a, 'head': b, 'change': None if change is None else round(change, 4)}
+            for name, a, b, change in walk(base, head, '')]
+    print(json.dumps({'base': base.get('meta', {}).get('commit'), 'head': head.get('meta', {}).get('commit'),
+                      'metrics': rows}, indent=2, ensure_ascii=False))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='去重性能与准确性基准套件')
+    parser.add_argument('--image-dir', default=os.path.join(config.BASE_PATH, 'resources/img/material'))
+    parser.add_argument('--seeds', type=int, default=None, help='最多使用的种子图片数')
+    parser.add_argument('--variants', type=int, default=5, help='每张种子图片生成的近似重复数')
+    parser.add_argument('--index-sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--insert-rows', type=int, default=50000)
+    parser.add_argument('--segment-background', type=int, default=10000, help='分段评估的随机背景记录数')
+    parser.add_argument('--thresholds', type=int, nargs='+', default=[2, 4, 5, 6, 8, 10, 12],
+                        help='64 位基准阈值')
+    parser.add_argument('--output', help='结果 JSON 文件')
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'), help='比较两份结果 JSON')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    hasher = ImageHasher(hash_size=config.HASH_SIZE, highfreq_factor=config.HIGHFREQ_FACTOR,
+                         fast_decode=config.FAST_DECODE)
+    cascade = None
+    if config.MATCH_PREFILTER:
+        cascade = MatchCascade(config.MATCH_POLICY, config.MATCH_PREFILTER, tuple(config.MATCH_VERIFY),
+                               config.MATCH_WEIGHTS, config.MATCH_QUORUM, config.MATCH_PREFILTER_FACTOR)
+    seeds = sorted(glob.glob(os.path.join(args.image_dir, '*')))[:args.seeds]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        corpus_dir = os.path.join(workdir, 'corpus')
+        os.makedirs(corpus_dir)
+        corpus = make_corpus(seeds, args.variants, corpus_dir)
+        corpus_hashes = [hasher.compute_all(path) for path, _ in corpus]
+        seed_hashes = [h for (path, _), h in zip(corpus, corpus_hashes) if path in seeds]
+
+        results = {
+            'meta': metadata(),
+            'corpus': {'seeds': len(seeds), 'images': len(corpus), 'transforms': list(TRANSFORMS)},
+            'hashing': bench_hashing(hasher, [path for path, _ in corpus]),
+            'db_insert': bench_insert(workdir, hasher, args.insert_rows),
+            'is_original': bench_is_original(workdir, hasher, cascade, corpus, seed_hashes,
+                                             args.index_sizes, args.queries),
+            'find_duplicates': bench_find_duplicates(workdir, hasher, cascade, corpus_hashes),
+            'accuracy': bench_accuracy(hasher, cascade, corpus, corpus_hashes, args.thresholds),
+            'segments': bench_segments(workdir, hasher, seeds, args.segment_background),
+        }
+
+    output = json.dumps(results, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
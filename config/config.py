@@ -14,15 +14,78 @@ class Config(BaseSettings):
     OSS_SECRET_KEY: str = 'your_secret_key'
     OSS_ENDPOINT: str = 'https://oss-cn-hangzhou.aliyuncs.com'
     OSS_BUCKET_NAME: str = 'your-bucket-name'
+    OSS_BUCKET_ACL: str = ''        # 固定 Bucket ACL（public-read/private），为空则查询并缓存
+    OSS_ACL_CACHE_TTL: int = 300    # ACL 缓存秒数
+    OSS_MULTIPART_THRESHOLD: int = 10 * 1024 * 1024     # 超过该大小使用分片上传/分段下载
+    OSS_PART_SIZE: int = 5 * 1024 * 1024
+    OSS_TRANSFER_THREADS: int = 4
+    OSS_CHECKPOINT_DIR: str = ''    # 断点续传记录目录，为空使用 oss2 默认目录
 
     # 哈希配置
     HASH_METHOD: str = 'phash'
-    HASH_SIZE: int = 8
+    HASH_SIZE: int = 8      # 指纹位数为 HASH_SIZE²，超过 64 位时数据库以 BLOB 存储，同一数据库不可混用
     HIGHFREQ_FACTOR: int = 4
+    # 降分辨率解码（JPEG draft），解码更快，但哈希与全分辨率解码可能有少量位差异（见 benchmarks.hash_drift），
+    # 开启后新记录与库中已有的全分辨率记录之间的距离会整体偏移；仅在新建的库或全量重新计算指纹后开启
+    FAST_DECODE: bool = False
+    ORIENTATION_INVARIANT: bool = False     # 查重时同时比较 8 种旋转 / 翻转方向（单次解码、单次 DCT）
 
-    # 去重阈值
+    # 指纹缓存（为空则不启用），哈希参数变化时自动失效
+    HASH_CACHE_PATH: str = ''
+    HASH_CACHE_MAX_ENTRIES: int = 100000
+
+    # 去重阈值（以 HASH_SIZE=8 即 64 位指纹给出，其他尺寸按位数等比例缩放）
     SIMILARITY_THRESHOLD: int = 5
 
+    # 级联匹配：先用粗筛哈希以放宽阈值（阈值 × MATCH_PREFILTER_FACTOR）取候选，再由其余哈希校验，
+    # 按 MATCH_POLICY（any/all/vote）判定；MATCH_PREFILTER 为空（默认）时沿用"任一种哈希在阈值内"规则
+    # benchmarks.suite 实测（阈值 5，素材变体）：任一规则召回率 0.89、级联 vote 0.78，精确率均为 1.0；
+    # 阈值 12 时两者误报相同。级联能压低困难负样本的误报（benchmarks.match_cascade），但会漏掉
+    # 只有部分哈希相近的变体，需要时设置 MATCH_PREFILTER='phash' 开启，并相应调高阈值
+    MATCH_PREFILTER: str = ''
+    MATCH_VERIFY: list = ['dhash', 'ahash']
+    MATCH_POLICY: str = 'vote'
+    MATCH_WEIGHTS: dict = {'phash': 2, 'dhash': 1, 'ahash': 1}
+    MATCH_QUORUM: float = 0.5   # vote 策略下判为重复所需的加权票数占比
+    MATCH_PREFILTER_FACTOR: float = 2.0
+
+    # 指纹索引类型 (linear/bktree/mih)
+    INDEX_TYPE: str = 'mih'
+    # 内存映射分片索引目录（非空时替代内存索引，启动时只增量同步新记录）
+    MMAP_INDEX_DIR: str = ''
+    # 只读挂载内存映射索引（不写入索引文件，由其他进程负责写入；多个写入进程之间以文件锁串行化）
+    MMAP_INDEX_READ_ONLY: bool = False
+
+    # 分段指纹：按内容区域分别计算 pHash 并建倒排索引，与某条记录有至少 SEGMENT_MIN_VOTES 个分段
+    # 在 SEGMENT_THRESHOLD（64 位基准，按位数缩放）内相似时视为局部重复（裁剪、加边框、截图）
+    SEGMENT_MATCHING: bool = False
+    SEGMENT_THRESHOLD: int = 8
+    SEGMENT_MIN_VOTES: int = 2
+
+    # 写后上传队列：upload_image 只等待本地查重、预留与入队事务即返回，后台线程上传并按指数退避重试，
+    # 上传完成后才写入正式记录；OUTBOX_SPOOL_DIR 非空时入队前把文件复制到该目录（调用方可随即删除原文件）
+    OUTBOX_ENABLED: bool = False
+    OUTBOX_WORKERS: int = 4
+    OUTBOX_MAX_ATTEMPTS: int = 8
+    OUTBOX_BACKOFF_BASE: float = 1.0
+    OUTBOX_BACKOFF_MAX: float = 300.0
+    OUTBOX_SPOOL_DIR: str = ''
+
+    # 增量重复扫描：重复组持久化到数据库，每次只比较上次扫描之后新增的记录
+    INCREMENTAL_SCAN: bool = False
+
+    # 常驻去重服务（python main.py serve），SERVICE_SOCKET 非空时监听 Unix 套接字
+    SERVICE_HOST: str = '127.0.0.1'
+    SERVICE_PORT: int = 8080
+    SERVICE_SOCKET: str = ''
+    SERVICE_MAX_BATCH: int = 64
+    SERVICE_MAX_WAIT_MS: float = 2.0    # 并发请求排队时首个请求的最长等待（空闲时单个请求立即处理）
+
+    # 可观测性：各阶段耗时与计数指标（服务 GET /metrics 导出），日志级别与 JSON 结构化日志
+    METRICS_ENABLED: bool = False
+    LOG_LEVEL: str = 'INFO'
+    LOG_JSON: bool = False
+
     # 存储路径
     DB_PATH: str = 'image_fingerprints.db'
     LOCAL_STORAGE_PATH: str = 'resources/storage'  # 测试用
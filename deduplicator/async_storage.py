@@ -0,0 +1,87 @@
+import asyncio
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+from .storage import LocalStorageProvider
+
+
+class AsyncStorageProvider(ABC):
+    """异步存储提供者抽象类，批量操作按 concurrency 限制并发"""
+
+    def __init__(self, concurrency=16):
+        self.concurrency = concurrency
+
+    @abstractmethod
+    async def upload(self, local_path, remote_path):
+        pass
+
+    @abstractmethod
+    async def download(self, remote_path, local_path):
+        pass
+
+    @abstractmethod
+    async def exists(self, remote_path):
+        pass
+
+    @abstractmethod
+    async def delete(self, remote_path):
+        pass
+
+    async def _bounded(self, func, items):
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run(args):
+            async with semaphore:
+                return await func(*args)
+
+        return await asyncio.gather(*(run(args) for args in items))
+
+    async def upload_many(self, items):
+        """
+        批量上传
+        :param items: [(local_path, remote_path), ...]
+        :return: 与 items 顺序一致的上传结果
+        """
+        return await self._bounded(self.upload, items)
+
+    async def download_many(self, items):
+        """
+        批量下载
+        :param items: [(remote_path, local_path), ...]
+        :return: 与 items 顺序一致的下载结果
+        """
+        return await self._bounded(self.download, items)
+
+
+class AsyncStorageAdapter(AsyncStorageProvider):
+    """将同步 StorageProvider 包装为异步接口，阻塞调用在专用线程池中执行"""
+
+    def __init__(self, provider, concurrency=16):
+        super().__init__(concurrency)
+        self.provider = provider
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    async def _call(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def upload(self, local_path, remote_path):
+        return await self._call(self.provider.upload, local_path, remote_path)
+
+    async def download(self, remote_path, local_path):
+        return await self._call(self.provider.download, remote_path, local_path)
+
+    async def exists(self, remote_path):
+        return await self._call(self.provider.exists, remote_path)
+
+    async def delete(self, remote_path):
+        return await self._call(self.provider.delete, remote_path)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class AsyncLocalStorageProvider(AsyncStorageAdapter):
+    """异步本地存储，底层使用零拷贝的 LocalStorageProvider"""
+
+    def __init__(self, base_path, hardlink=False, concurrency=16):
+        super().__init__(LocalStorageProvider(base_path, hardlink), concurrency)
@@ -0,0 +1,95 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class BackfillReport:
+    """存储桶回填统计"""
+
+    def __init__(self):
+        self.pages = 0
+        self.scanned = 0
+        self.skipped = 0        # 已有记录的对象
+        self.inserted = 0
+        self.duplicates = 0     # 内容摘要与已有记录相同
+        self.failed = []        # 读取或解码失败的对象键
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def as_dict(self):
+        return {
+            'pages': self.pages,
+            'scanned': self.scanned,
+            'skipped': self.skipped,
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'failed': len(self.failed),
+            'elapsed': self.elapsed,
+            'objects_per_sec': self.scanned / self.elapsed if self.elapsed else 0.0,
+        }
+
+
+class BucketBackfill:
+    """
+    存储桶回填：分页列举存储中已有但未入库的对象，线程池并发读取并直接从内存计算指纹，
+    每页批量写库并保存列举断点，中断（或达到 max_pages）后可从断点继续，完整列举结束后清空断点
+    """
+
+    def __init__(self, storage, db, hasher, prefix='images/', workers=8, page_size=1000):
+        self.storage = storage
+        self.db = db
+        self.hasher = hasher
+        self.prefix = prefix
+        self.workers = workers
+        self.page_size = page_size
+        self.checkpoint = f"backfill:{prefix}"
+
+    def _fingerprint(self, key):
+        try:
+            data = self.storage.read(key)
+        except Exception as e:
+            logger.warning("Backfill read failed for %s: %s", key, e)
+            return key, None
+        hashes = self.hasher.compute_all(data)
+        if hashes:
+            hashes['digest'] = self.hasher.content_digest(data)
+        return key, hashes
+
+    def run(self, max_pages=None, restart=False):
+        """
+        执行回填
+        :param max_pages: 最多处理的页数（None 表示直到列举结束）
+        :param restart: 忽略已保存的断点，从头列举
+        """
+        report = BackfillReport()
+        marker = '' if restart else (self.db.get_checkpoint(self.checkpoint) or '')
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            while max_pages is None or report.pages < max_pages:
+                keys, next_marker = self.storage.list_page(self.prefix, marker, self.page_size)
+                report.pages += 1
+                report.scanned += len(keys)
+
+                existing = self.db.existing_paths(keys)
+                report.skipped += len(existing)
+                records = []
+                for key, hashes in executor.map(self._fingerprint, [k for k in keys if k not in existing]):
+                    if hashes:
+                        records.append((key, hashes))
+                    else:
+                        report.failed.append(key)
+
+                row_ids = self.db.add_images(records)
+                report.inserted += sum(row_id is not None for row_id in row_ids)
+                report.duplicates += sum(row_id is None for row_id in row_ids)
+
+                # 本页写库后再推进断点；列举完成时清空断点，下次回填从头列举以发现排在前面的新对象
+                marker = next_marker
+                self.db.set_checkpoint(self.checkpoint, marker)
+                if not next_marker:
+                    break
+
+        report.elapsed = time.perf_counter() - report.started
+        return report
@@ -0,0 +1,165 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# 缓存格式版本，哈希算法实现变化时递增以使旧缓存失效
+CACHE_VERSION = 1
+
+
+class HashCache:
+    """
+    磁盘指纹缓存：以文件身份 (路径, 大小, mtime, inode) 为键保存哈希结果，避免重复解码。
+    哈希参数（方法/尺寸/高频因子等）变化时自动清空旧条目；超过 max_entries 时按最近访问时间淘汰。
+    查询只读缓存库：命中/未命中计数先累计在内存中，访问时间只在距上次记录超过 TOUCH_INTERVAL 时
+    才需更新，两者在写入、淘汰、关闭或每 FLUSH_INTERVAL 次查询时批量写回，
+    多进程共享同一缓存时计数仍能汇总（进程退出前未写回的少量计数会丢失）。
+    """
+
+    EVICT_INTERVAL = 256    # 每写入若干条检查一次容量
+    FLUSH_INTERVAL = 256    # 每查询若干次写回一次计数与访问时间
+    TOUCH_INTERVAL = 60.0   # 访问时间的更新粒度（秒）
+
+    def __init__(self, db_path, max_entries=100000):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.params = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._reset_pending()
+        with self._get_connection() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS hash_cache
+                            (path TEXT PRIMARY KEY,
+                            size INTEGER,
+                            mtime_ns INTEGER,
+                            inode INTEGER,
+                            hashes TEXT,
+                            last_access REAL)''')
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_hash_cache_access ON hash_cache (last_access)")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache_meta (key TEXT PRIMARY KEY, value)")
+            for key in ('hits', 'misses', 'evictions'):
+                conn.execute("INSERT OR IGNORE INTO cache_meta VALUES (?, 0)", (key,))
+
+    def __getstate__(self):
+        # 连接不可跨进程传递，子进程中按需重新打开
+        # 未写回的计数留在本进程
+        state = self.__dict__.copy()
+        for key in ('_local', '_lock', '_counts', '_touched', '_lookups'):
+            del state[key]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._reset_pending()
+
+    def _reset_pending(self):
+        self._counts = {'hits': 0, 'misses': 0}
+        self._touched = {}      # 路径 -> 待写回的访问时间
+        self._lookups = 0
+
+    def _get_connection(self):
+        """当前线程/进程的长连接；作为上下文管理器使用时自动提交事务"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def bind(self, params):
+        """绑定哈希参数；与缓存中记录的参数不同时清空全部条目"""
+        params = json.dumps([CACHE_VERSION, *params])
+        with self._get_connection() as conn:
+            row = conn.execute("SELECT value FROM cache_meta WHERE key = 'params'").fetchone()
+            if row is None or row[0] != params:
+                conn.execute("DELETE FROM hash_cache")
+                conn.execute("INSERT OR REPLACE INTO cache_meta VALUES ('params', ?)", (params,))
+        self.params = params
+
+    @staticmethod
+    def _identity(image_path):
+        st = os.stat(image_path)
+        return os.path.abspath(image_path), st.st_size, st.st_mtime_ns, st.st_ino
+
+    def get(self, image_path, methods):
+        """返回缓存的 {方法: 哈希}，文件已变化或缺少所需方法时返回 None（只读查询，不开启写事务）"""
+        path, size, mtime_ns, inode = self._identity(image_path)
+        row = self._get_connection().execute(
+            "SELECT size, mtime_ns, inode, hashes, last_access FROM hash_cache WHERE path = ?", (path,)).fetchone()
+        hashes = json.loads(row[3]) if row and row[:3] == (size, mtime_ns, inode) else {}
+        hit = all(method in hashes for method in methods)
+        now = time.time()
+        with self._lock:
+            self._counts['hits' if hit else 'misses'] += 1
+            if hit and now - (row[4] or 0) > self.TOUCH_INTERVAL:
+                self._touched[path] = now
+            self._lookups += 1
+            due = self._lookups >= self.FLUSH_INTERVAL
+        if due:
+            self.flush()
+        return {method: hashes[method] for method in methods} if hit else None
+
+    def _take_pending(self):
+        with self._lock:
+            counts, touched = self._counts, self._touched
+            self._reset_pending()
+        return counts, touched
+
+    def _write_pending(self, conn, counts, touched):
+        """在调用方事务内写回计数与访问时间"""
+        for key, value in counts.items():
+            if value:
+                conn.execute("UPDATE cache_meta SET value = value + ? WHERE key = ?", (value, key))
+        conn.executemany("UPDATE hash_cache SET last_access = ? WHERE path = ? AND last_access < ?",
+                         ((now, path, now) for path, now in touched.items()))
+
+    def flush(self):
+        """写回内存中累计的命中/未命中计数与访问时间（单个事务）"""
+        counts, touched = self._take_pending()
+        if not any(counts.values()) and not touched:
+            return
+        with self._get_connection() as conn:
+            self._write_pending(conn, counts, touched)
+
+    def close(self):
+        self.flush()
+
+    def put(self, image_path, hashes):
+        """写入（合并）文件的哈希结果"""
+        path, size, mtime_ns, inode = self._identity(image_path)
+        with self._get_connection() as conn:
+            row = conn.execute("SELECT size, mtime_ns, inode, hashes FROM hash_cache WHERE path = ?",
+                               (path,)).fetchone()
+            if row and row[:3] == (size, mtime_ns, inode):
+                hashes = {**json.loads(row[3]), **hashes}
+            conn.execute("INSERT OR REPLACE INTO hash_cache VALUES (?, ?, ?, ?, ?, ?)",
+                         (path, size, mtime_ns, inode, json.dumps(hashes), time.time()))
+            self._write_pending(conn, *self._take_pending())
+
+        self._writes += 1
+        if self._writes % self.EVICT_INTERVAL == 0:
+            self.evict()
+
+    def evict(self):
+        """淘汰最久未访问的条目，使条目数不超过 max_entries"""
+        with self._get_connection() as conn:
+            self._write_pending(conn, *self._take_pending())
+            c = conn.execute('''DELETE FROM hash_cache WHERE path IN
+                                (SELECT path FROM hash_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)''',
+                             (self.max_entries,))
+            if c.rowcount > 0:
+                conn.execute("UPDATE cache_meta SET value = value + ? WHERE key = 'evictions'", (c.rowcount,))
+
+    def stats(self):
+        self.flush()
+        with self._get_connection() as conn:
+            stats = dict(conn.execute("SELECT key, value FROM cache_meta WHERE key != 'params'").fetchall())
+            stats['entries'] = conn.execute("SELECT COUNT(*) FROM hash_cache").fetchone()[0]
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
@@ -0,0 +1,158 @@
+import threading
+import time
+
+import numpy as np
+
+from deduplicator.fingerprints import HASH_TYPES, MISSING_DISTANCE
+from deduplicator.hashing import popcount
+
+# 判定策略：any 任一种哈希在阈值内；all 全部在阈值内；vote 加权票数占比达到 quorum
+MATCH_POLICIES = ('any', 'all', 'vote')
+
+
+class MatchCascade:
+    """
+    由粗到细的级联匹配：
+    1. 粗筛：prefilter 哈希以放宽的阈值（threshold × prefilter_factor）从索引 / 分块中取候选，
+       不满足粗筛的记录不再参与后续比较；
+    2. 校验：按 verify 顺序逐种哈希只对尚未判定的候选计算距离，距离不超过 threshold 记一票（按权重），
+       票数已达到要求的提前接受，剩余权重不足以达到要求的提前淘汰。
+    prefilter 哈希本身在阈值内同样计票，粗筛阶段的距离直接复用。
+    """
+
+    def __init__(self, policy='vote', prefilter='phash', verify=('dhash', 'ahash'),
+                 weights=None, quorum=0.5, prefilter_factor=2.0):
+        """
+        :param policy: any / all / vote
+        :param weights: {哈希类型: 权重}，默认均为 1
+        :param quorum: vote 策略下判为相似所需的加权票数占比
+        :param prefilter_factor: 粗筛阈值相对 threshold 的放宽倍数
+        """
+        if policy not in MATCH_POLICIES:
+            raise ValueError(f"Unsupported match policy: {policy}")
+        self.policy = policy
+        self.stages = (prefilter,) + tuple(t for t in verify if t != prefilter)
+        unknown = set(self.stages) - set(HASH_TYPES)
+        if unknown:
+            raise ValueError(f"Unsupported hash types: {sorted(unknown)}")
+        self.weights = {t: float((weights or {}).get(t, 1)) for t in self.stages}
+        self.quorum = quorum
+        self.prefilter_factor = prefilter_factor
+
+        total = sum(self.weights.values())
+        if policy == 'any':
+            self.required = min(w for w in self.weights.values() if w > 0)
+        elif policy == 'all':
+            self.required = total
+        else:
+            self.required = quorum * total
+
+        self._stats = {t: {'calls': 0, 'candidates_in': 0, 'candidates_out': 0, 'time': 0.0}
+                       for t in self.stages}
+        self._lock = threading.Lock()
+
+    def prefilter_threshold(self, threshold):
+        return int(threshold * self.prefilter_factor)
+
+    def _record(self, stage, candidates_in, candidates_out, elapsed):
+        with self._lock:
+            stats = self._stats[stage]
+            stats['calls'] += 1
+            stats['candidates_in'] += candidates_in
+            stats['candidates_out'] += candidates_out
+            stats['time'] += elapsed
+
+    def stats(self):
+        """各阶段累计的调用次数、输入 / 输出候选数与耗时"""
+        with self._lock:
+            return {'policy': self.policy, 'stages': {t: dict(s) for t, s in self._stats.items()}}
+
+    def _verify(self, distances_for, votes, best, threshold):
+        """
+        逐阶段校验，返回最终判为相似的候选下标
+        :param distances_for: (哈希类型, 候选下标) -> 距离数组，缺失指纹为 MISSING_DISTANCE
+        """
+        remaining = sum(self.weights[t] for t in self.stages[1:])
+        undecided = np.flatnonzero((votes < self.required) & (votes + remaining >= self.required))
+        accepted = [np.flatnonzero(votes >= self.required)]
+        for hash_type in self.stages[1:]:
+            if not len(undecided):
+                break
+            start = time.perf_counter()
+            weight = self.weights[hash_type]
+            remaining -= weight
+            dist = distances_for(hash_type, undecided)
+            hit = dist <= threshold
+            votes[undecided] += weight * hit
+            np.minimum.at(best, undecided[hit], dist[hit])
+
+            done = votes[undecided] >= self.required
+            accepted.append(undecided[done])
+            undecided = undecided[~done & (votes[undecided] + remaining >= self.required)]
+            self._record(hash_type, len(dist), len(undecided), time.perf_counter() - start)
+        return np.sort(np.concatenate(accepted))
+
+    def search(self, index, hashes, threshold):
+        """
+        在 FingerprintIndex 上执行级联查询
+        :return: [(item_id, storage_path, 最小距离)]，按距离排序
+        """
+        prefilter = self.stages[0]
+        if hashes.get(prefilter) is None:
+            return index.search_any(hashes, threshold)     # 缺少粗筛哈希时退回逐种查询
+
+        start = time.perf_counter()
+        loose = self.prefilter_threshold(threshold)
+        found = index.indexes[prefilter].range_query(hashes[prefilter], loose)
+        ids = np.fromiter((item_id for item_id, _ in found), dtype=np.int64, count=len(found))
+        dist0 = np.fromiter((dist for _, dist in found), dtype=np.int64, count=len(found))
+        self._record(prefilter, len(index), len(ids), time.perf_counter() - start)
+
+        hit = dist0 <= threshold
+        votes = self.weights[prefilter] * hit
+        best = np.where(hit, dist0, MISSING_DISTANCE)
+
+        def distances_for(hash_type, positions):
+            value = hashes.get(hash_type)
+            if value is None or hash_type not in index.indexes:
+                return np.full(len(positions), MISSING_DISTANCE, dtype=np.int64)
+            return index.indexes[hash_type].distances(value, ids[positions], threshold)
+
+        matched = self._verify(distances_for, votes.astype(float), best, threshold)
+        return sorted(((int(ids[i]), index.paths[int(ids[i])], int(best[i])) for i in matched),
+                      key=lambda x: x[2])
+
+    def block_matches(self, matrix, rows, cols, threshold):
+        """
+        两个记录分块之间的级联匹配（用于全量重复扫描）
+        :return: 形状 (len(rows), len(cols)) 的布尔矩阵
+        """
+        prefilter = self.stages[0]
+        start = time.perf_counter()
+        words = matrix.words[prefilter]
+        xor = np.bitwise_xor(words[rows][:, None, :], words[cols][None, :, :])
+        dist0 = popcount(xor).sum(axis=2, dtype=np.int64)
+        valid = matrix.valid[prefilter]
+        dist0[~(valid[rows][:, None] & valid[cols][None, :])] = MISSING_DISTANCE
+        shape = dist0.shape
+        i, j = np.nonzero(dist0 <= self.prefilter_threshold(threshold))
+        self._record(prefilter, dist0.size, len(i), time.perf_counter() - start)
+
+        dist0 = dist0[i, j]
+        hit = dist0 <= threshold
+        votes = self.weights[prefilter] * hit
+        best = np.where(hit, dist0, MISSING_DISTANCE)
+        row_ids = np.arange(len(matrix))[rows][i]
+        col_ids = np.arange(len(matrix))[cols][j]
+
+        def distances_for(hash_type, positions):
+            a, b = row_ids[positions], col_ids[positions]
+            words = matrix.words[hash_type]
+            dist = popcount(np.bitwise_xor(words[a], words[b])).sum(axis=1, dtype=np.int64)
+            valid = matrix.valid[hash_type]
+            return np.where(valid[a] & valid[b], dist, MISSING_DISTANCE)
+
+        matched = self._verify(distances_for, votes.astype(float), best, threshold)
+        result = np.zeros(shape, dtype=bool)
+        result[i[matched], j[matched]] = True
+        return result
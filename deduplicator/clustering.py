@@ -0,0 +1,100 @@
+import os
+from collections import deque
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# 重复组：representative 为组内最早入库的图像，members 包含 representative
+DuplicateGroup = namedtuple('DuplicateGroup', ['representative', 'members'])
+
+
+class UnionFind:
+    """并查集（按大小合并 + 路径压缩），同时维护每个集合的成员与最大下标"""
+
+    def __init__(self):
+        self.parent = {}
+        self.members = {}
+        self.maximum = {}
+
+    def find(self, x):
+        root = self.parent.setdefault(x, x)
+        while root != self.parent[root]:
+            root = self.parent[root]
+        while x != root:
+            self.parent[x], x = root, self.parent[x]
+        return root
+
+    def union(self, a, b):
+        ra, rb = self.find(a), self.find(b)
+        if ra == rb:
+            return ra
+        ma = self.members.setdefault(ra, [ra])
+        mb = self.members.setdefault(rb, [rb])
+        if len(ma) < len(mb):
+            ra, rb, ma, mb = rb, ra, mb, ma
+        self.parent[rb] = ra
+        ma.extend(mb)
+        self.maximum[ra] = max(self.maximum.get(ra, ra), self.maximum.pop(rb, rb))
+        del self.members[rb]
+        return ra
+
+
+def _scan_row_block(matrix, start, stop, block_size, threshold, cascade=None):
+    """计算行分块 [start, stop) 与其后所有记录之间的相似边"""
+    edges = []
+    for col_start in range(start, len(matrix), block_size):
+        col_stop = min(col_start + block_size, len(matrix))
+        if cascade is not None:
+            mask = cascade.block_matches(matrix, slice(start, stop), slice(col_start, col_stop), threshold)
+        else:
+            mask = matrix.block_min_distances(slice(start, stop), slice(col_start, col_stop)) <= threshold
+        if col_start == start:
+            mask = np.triu(mask, k=1)   # 同一分块只取上三角
+        i, j = np.nonzero(mask)
+        edges.append((i + start, j + col_start))
+    return edges
+
+
+def iter_duplicate_groups(matrix, threshold=5, block_size=1024, workers=None, cascade=None):
+    """
+    分块向量化全量比对，并查集聚类后流式输出重复组
+    行分块 b 处理完成后，下标小于其终点的记录已与所有记录比较过，
+    成员全部落在该范围内的组不会再变化，可立即输出。
+    :param matrix: FingerprintMatrix
+    :param block_size: 分块大小，单块距离矩阵内存约为 block_size² × 8 字节
+    :param workers: 线程数，默认使用全部 CPU（NumPy 运算期间释放 GIL）
+    :param cascade: MatchCascade 级联匹配策略，为空时任一种哈希在阈值内即视为重复
+    """
+    n = len(matrix)
+    workers = workers or os.cpu_count() or 1
+    uf = UnionFind()
+    active = set()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        starts = iter(range(0, n, block_size))
+        pending = deque()
+
+        def submit():
+            start = next(starts, None)
+            if start is not None:
+                stop = min(start + block_size, n)
+                pending.append((stop, executor.submit(_scan_row_block, matrix, start, stop,
+                                                      block_size, threshold, cascade)))
+
+        for _ in range(2 * workers):  # 限制在途分块数量，控制内存
+            submit()
+
+        while pending:
+            stop, future = pending.popleft()
+            for rows, cols in future.result():
+                for i, j in zip(rows.tolist(), cols.tolist()):
+                    active.discard(uf.find(i))
+                    active.discard(uf.find(j))
+                    active.add(uf.union(i, j))
+            submit()
+
+            for root in [root for root in active if uf.maximum[root] < stop]:
+                active.remove(root)
+                members = sorted(uf.members[root], key=lambda k: matrix.ids[k])
+                yield DuplicateGroup(matrix.paths[members[0]], [matrix.paths[k] for k in members])
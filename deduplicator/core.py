@@ -1,8 +1,50 @@
+import logging
 import os
+import time
+
 from .hashing import ImageHasher
+from .backfill import BucketBackfill
+from .clustering import DuplicateGroup, iter_duplicate_groups
 from .database import DatabaseManager
+from .incremental import IncrementalDuplicateScan
+from .index import FingerprintIndex
+from .ingest import BulkIngest
+from .metrics import metrics
+from .outbox import UploadOutbox
+from .segments import SegmentIndex
 from .storage import StorageProvider
 
+logger = logging.getLogger(__name__)
+
+
+class CheckStats:
+    """原创性检查统计：内容摘要快速路径命中次数及节省的解码耗时"""
+
+    def __init__(self):
+        self.checks = 0
+        self.exact_hits = 0     # 内容摘要命中（跳过解码）
+        self.decodes = 0
+        self.decode_time = 0.0
+
+    @property
+    def avg_decode_time(self):
+        return self.decode_time / self.decodes if self.decodes else 0.0
+
+    @property
+    def decode_time_saved(self):
+        """按平均解码耗时估算快速路径节省的时间"""
+        return self.exact_hits * self.avg_decode_time
+
+    def as_dict(self):
+        return {
+            'checks': self.checks,
+            'exact_hits': self.exact_hits,
+            'exact_hit_rate': self.exact_hits / self.checks if self.checks else 0.0,
+            'decodes': self.decodes,
+            'avg_decode_time': self.avg_decode_time,
+            'decode_time_saved': self.decode_time_saved,
+        }
+
 
 class ImageDeduplicator:
     """图像去重核心类"""
@@ -10,79 +52,180 @@ class ImageDeduplicator:
     def __init__(self,
                  storage_provider: StorageProvider,
                  db_manager: DatabaseManager,
-                 hasher: ImageHasher = None):
+                 hasher: ImageHasher = None,
+                 index: FingerprintIndex = None,
+                 threshold: int = 5,
+                 segment_index: SegmentIndex = None,
+                 outbox: UploadOutbox = None):
+        """
+        :param threshold: 默认相似阈值，以 64 位指纹给出，按 hasher 的指纹位数等比例缩放；
+                          各方法显式传入的阈值按实际位数计，不再缩放
+        :param segment_index: 分段指纹索引，非空时与某条记录有足够多相似分段的图像（裁剪、加边框、截图）
+                              同样视为重复，要求 hasher 开启 segments
+        :param outbox: 写后上传队列，非空时 upload_image 只等待本地查重与入队事务，由后台线程上传
+        """
         self.storage = storage_provider
         self.db = db_manager
         self.hasher = hasher or ImageHasher()
+        if self.hasher.hash_bits != self.db.hash_bits:
+            raise ValueError(f"Hasher produces {self.hasher.hash_bits}-bit hashes, "
+                             f"database stores {self.db.hash_bits}-bit hashes")
+        self.threshold = self.hasher.scale_threshold(threshold)
+        if index is None:
+            index = FingerprintIndex(hash_bits=self.hasher.hash_bits)
+        self.index = self.db.attach_index(index)
+        if segment_index is not None and not self.hasher.segments:
+            raise ValueError("segment_index requires a hasher with segments=True")
+        self.segment_index = None
+        if segment_index is not None:
+            self.segment_index = self.db.attach_segment_index(segment_index)
+        self.outbox = outbox
+        self.stats = CheckStats()
 
-    def is_original(self, image_path, threshold=5):
+    def is_original(self, image_path, threshold=None):
         """检查图像是否原创"""
-        new_hash = self.hasher.compute(image_path)
-        if not new_hash:
-            return False
-
-        # 检查数据库中是否有相似图像
-        all_images = self.db.get_all_images()
-        for _, _, phash, ahash, dhash in all_images:
-            # 使用多种哈希方法检查
-            for hash_val in [phash, ahash, dhash]:
-                if hash_val and ImageHasher.hamming_distance(new_hash, hash_val) <= threshold:
-                    return False
-        return True
-
-    def upload_image(self, image_path, remote_folder="images/"):
-        """上传并记录图像"""
-        if not self.is_original(image_path):
+        return self._check_original(image_path, threshold)[0]
+
+    def _threshold(self, threshold):
+        return self.threshold if threshold is None else threshold
+
+    @metrics.timed('check_original')
+    def _check_original(self, image_path, threshold=None):
+        """
+        先按内容摘要做字节级完全重复的索引查询，未命中时一次解码计算全部哈希并检查是否原创
+        :return: (是否原创, {哈希类型: 十六进制哈希, 'digest': 内容摘要})
+        """
+        self.stats.checks += 1
+        try:
+            digest = ImageHasher.content_digest(image_path)
+        except OSError as e:
+            logger.warning("Error reading %s: %s", image_path, e)
+            metrics.inc('dedup_checks_total', result='error')
+            return False, None
+        if self.db.find_by_digest(digest):
+            self.stats.exact_hits += 1
+            metrics.inc('dedup_checks_total', result='exact_duplicate')
+            return False, None
+
+        start = time.perf_counter()
+        hashes = self.hasher.compute_all(image_path)
+        self.stats.decodes += 1
+        self.stats.decode_time += time.perf_counter() - start
+        if not hashes:
+            metrics.inc('dedup_checks_total', result='error')
+            return False, None
+        hashes['digest'] = digest
+
+        # 通过指纹索引查找相似图像（与同类型哈希比较，按索引的级联策略判定，未配置时任一种相似即重复）
+        if self.index.search(hashes, self._threshold(threshold)):
+            metrics.inc('dedup_checks_total', result='duplicate')
+            return False, hashes
+        if self.partial_matches(hashes):
+            metrics.inc('dedup_checks_total', result='partial_duplicate')
+            return False, hashes
+        metrics.inc('dedup_checks_total', result='original')
+        return True, hashes
+
+    def partial_matches(self, hashes):
+        """
+        分段投票查找局部重复（未配置分段索引或 hashes 不含分段时为空）
+        :return: [(item_id, storage_path, 票数, 最小距离)]
+        """
+        if self.segment_index is None or not hashes.get('segments'):
+            return []
+        return self.segment_index.search(hashes['segments'])
+
+    def find_partial_duplicates(self, image_path):
+        """查找与图像共享足够多相似分段的已有记录，返回 [(storage_path, 票数, 最小距离)]"""
+        if self.segment_index is None:
+            raise RuntimeError("find_partial_duplicates requires a segment index")
+        hashes = self.hasher.compute_all(image_path)
+        if not hashes:
+            return []
+        return [(path, votes, dist) for _, path, votes, dist in self.partial_matches(hashes)]
+
+    @metrics.timed('upload_image')
+    def upload_image(self, image_path, remote_folder="images/", threshold=None):
+        """
+        上传并记录图像
+        先做无锁的快速查重，再通过数据库预留原子地复查并占位，多个进程并行上传时也不会同时接受相似图像。
+        配置了 outbox 时预留与入队在同一事务内完成后即返回 (远程路径, "Queued")，
+        上传结果通过 outbox.status(远程路径) 轮询或 outbox.wait / outbox.future 等待
+        """
+        original, hashes = self._check_original(image_path, threshold)
+        if not original:
             return None, "Duplicate image"
 
         # 生成存储路径
         filename = os.path.basename(image_path)
         remote_path = f"{remote_folder}{filename}"
 
+        if self.outbox is not None:
+            outbox_id, reason = self.outbox.enqueue(image_path, remote_path, hashes, self._threshold(threshold))
+            return (remote_path, "Queued") if outbox_id is not None else (None, reason)
+
+        reservation, reason = self.db.reserve(remote_path, hashes, self._threshold(threshold))
+        if reservation is None:
+            return None, reason
+
         # 上传到存储
-        if not self.storage.upload(image_path, remote_path):
+        try:
+            uploaded = self.storage.upload(image_path, remote_path)
+        except Exception:
+            self.db.release_reservation(reservation)
+            raise
+        if not uploaded:
+            self.db.release_reservation(reservation)
             return None, "Upload failed"
 
-        # 计算多种哈希值
-        hashes = {
-            'phash': self.hasher.compute(image_path),
-            'ahash': ImageHasher(method='ahash').compute(image_path),
-            'dhash': ImageHasher(method='dhash').compute(image_path)
-        }
-
         # 保存到数据库
-        if self.db.add_image(remote_path, hashes):
+        if self.db.commit_reservation(reservation, remote_path, hashes):
             return remote_path, "Success"
         else:
             # 回滚上传
             self.storage.delete(remote_path)
             return None, "Database error"
 
-    def find_duplicates(self, threshold=5):
-        """查找所有重复图像"""
-        all_images = self.db.get_all_images()
-        duplicates = []
-        n = len(all_images)
-
-        for i in range(n):
-            id1, path1, phash1, ahash1, dhash1 = all_images[i]
-            for j in range(i + 1, n):
-                id2, path2, phash2, ahash2, dhash2 = all_images[j]
-
-                # 使用多种哈希方法比较
-                for hash1, hash2 in [(phash1, phash2), (ahash1, ahash2), (dhash1, dhash2)]:
-                    if hash1 and hash2:
-                        dist = ImageHasher.hamming_distance(hash1, hash2)
-                        if dist <= threshold:
-                            duplicates.append((path1, path2, dist))
-                            break  # 找到一种匹配即可
-        return duplicates
-
-    def check_oss_duplicate(self, image_path, threshold=5):
+    def upload_directory(self, source, remote_folder="images/", threshold=None,
+                         hash_workers=None, upload_workers=8, batch_size=100):
+        """
+        批量上传并记录图像：进程池计算哈希，线程池并发上传，批量事务写库，同批次内的相似图像同样会被拦截
+        :param source: 目录路径或图像路径的可迭代对象
+        :return: IngestReport（逐文件结果与吞吐量）
+        """
+        return BulkIngest(self, remote_folder, self._threshold(threshold), hash_workers,
+                          upload_workers, batch_size).run(source)
+
+    def backfill_bucket(self, prefix="images/", workers=8, page_size=1000, max_pages=None, restart=False):
+        """为存储中已有但未入库的对象补录指纹（可断点续跑），返回 BackfillReport"""
+        return BucketBackfill(self.storage, self.db, self.hasher, prefix,
+                              workers, page_size).run(max_pages, restart)
+
+    def find_duplicates(self, threshold=None, block_size=1024, workers=None, incremental=False):
+        """
+        查找所有重复图像，按重复组（DuplicateGroup）流式返回
+        按索引的级联策略判定（未配置时多种哈希任一种匹配即视为重复），分块向量化比对并使用多线程
+        :param incremental: 只扫描上次扫描之后新增的记录并合并到已持久化的重复组，再返回全部重复组
+        """
+        if incremental:
+            self.scan_incremental(threshold)
+            for _, members in self.db.iter_duplicate_groups():
+                yield DuplicateGroup(members[0], members)
+            return
+
+        matrix = self.db.load_matrix()
+        yield from iter_duplicate_groups(matrix, self._threshold(threshold), block_size, workers,
+                                         getattr(self.index, 'cascade', None))
+
+    def scan_incremental(self, threshold=None, restart=False, batch_size=1000):
+        """增量重复扫描（新记录逐条查询指纹索引），返回 IncrementalScanReport"""
+        return IncrementalDuplicateScan(self.db, self.index, self._threshold(threshold), batch_size).run(restart)
+
+    def check_oss_duplicate(self, image_path, threshold=None):
         """检查OSS中是否有重复图像"""
         new_hash = self.hasher.compute(image_path)
         if not new_hash:
             return []
 
         # 在数据库中查找相似图像
-        return self.db.find_similar(new_hash, threshold=threshold)
+        return self.db.find_similar(new_hash, threshold=self._threshold(threshold))
@@ -1,73 +1,924 @@
+import itertools
+import json
+import os
 import sqlite3
+import threading
+import time
+import uuid
 from contextlib import contextmanager
 
-from deduplicator.hashing import ImageHasher
+import numpy as np
+
+from deduplicator.fingerprints import FingerprintMatrix, HASH_TYPES
+from deduplicator.hashing import ImageHasher, WORD_BITS
+from deduplicator.metrics import metrics
+
+# 数据库结构版本（PRAGMA user_version）：0 为早期 TEXT 哈希列，1 为 INTEGER 哈希列，2 增加内容摘要列
+SCHEMA_VERSION = 2
+
+_INT64_SIGN = 1 << 63
+_UINT64_RANGE = 1 << 64
+
+
+def encode_hash(value, hash_bits=64):
+    """
+    十六进制哈希或无符号整数 → SQLite 列值
+    不超过 64 位时为 INTEGER（有符号 64 位），更长的哈希为定长大端序 BLOB
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = int(value, 16)
+    if hash_bits > WORD_BITS:
+        return value.to_bytes(ImageHasher.words_for_bits(hash_bits) * 8, 'big')
+    if not 0 <= value < _UINT64_RANGE:
+        raise ValueError("Hash does not fit in a 64-bit integer column")
+    return value - _UINT64_RANGE if value >= _INT64_SIGN else value
+
+
+def decode_hash(value):
+    """SQLite INTEGER / BLOB → 无符号整数哈希"""
+    if value is None:
+        return None
+    if isinstance(value, bytes):
+        return int.from_bytes(value, 'big')
+    return value + _UINT64_RANGE if value < 0 else value
 
 
 class DatabaseManager:
     """数据库管理类"""
 
-    def __init__(self, db_path='image_fingerprint.db'):
+    def __init__(self, db_path='image_fingerprint.db', hash_bits=None):
+        """
+        :param hash_bits: 指纹位数（hash_size²），与库中记录的位数不一致时报错；
+                          为空时沿用库中记录的位数（新库为 64）
+        """
         self.db_path = db_path
-        self._init_db()
+        self._indexes = []     # 随 add_image 同步更新的指纹索引
+        self._segment_indexes = []  # 随 add_image 同步更新的分段指纹索引
+        self._synced_id = None  # 索引已包含的连续记录ID上界（之后的记录可能由其他进程写入）
+        self._own_ids = set()   # 本实例写入且大于 _synced_id 的记录ID
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self.hash_bits, self.db_id = self._init_db(hash_bits)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with self._lock:
+            self._connections.append(conn)
+        return conn
 
     @contextmanager
     def _get_connection(self):
-        """上下文管理器处理数据库连接"""
-        conn = sqlite3.connect(self.db_path)
+        """获取当前线程的长连接（每个线程/进程一个连接，复用不关闭）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = self._local.conn = self._connect()
+            self._local.pid = os.getpid()
         try:
             yield conn
-        finally:
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+    def close(self):
+        """关闭所有线程的连接"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
             conn.close()
+        self._local = threading.local()
 
-    def _init_db(self):
-        """初始化数据库结构"""
+    def _init_db(self, hash_bits=None):
+        """初始化数据库结构，必要时从旧版 TEXT 结构迁移，返回 (库中指纹位数, 数据库标识)"""
         with self._get_connection() as conn:
             c = conn.cursor()
+            # 迁移、建表与 meta / user_version 在同一事务内提交：中途失败整体回滚，下次打开时重新迁移
+            c.execute("BEGIN IMMEDIATE")
+            version = c.execute("PRAGMA user_version").fetchone()[0]
+            exists = c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'images'").fetchone()
+            migrated_bits = self._migrate_text_hashes(c) if exists and version < 1 else None
+
             c.execute('''CREATE TABLE IF NOT EXISTS images
                          (id INTEGER PRIMARY KEY,
                          storage_path TEXT UNIQUE,
-                         phash TEXT,
-                         ahash TEXT,
-                         dhash TEXT)''')
+                         phash INTEGER,
+                         ahash INTEGER,
+                         dhash INTEGER,
+                         digest TEXT)''')
+            if exists and 'digest' not in self._column_types(c, 'images'):
+                c.execute("ALTER TABLE images ADD COLUMN digest TEXT")
+            c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_images_digest ON images (digest)")
+            for hash_type in HASH_TYPES:
+                c.execute(f"CREATE INDEX IF NOT EXISTS idx_images_{hash_type} ON images ({hash_type})")
+            c.execute('''CREATE TABLE IF NOT EXISTS checkpoints
+                         (name TEXT PRIMARY KEY,
+                         value TEXT,
+                         updated_at REAL)''')
+            c.execute('''CREATE TABLE IF NOT EXISTS reservations
+                         (id INTEGER PRIMARY KEY,
+                         storage_path TEXT UNIQUE,
+                         phash INTEGER,
+                         ahash INTEGER,
+                         dhash INTEGER,
+                         digest TEXT,
+                         expires_at REAL)''')
+            c.execute('''CREATE TABLE IF NOT EXISTS duplicate_members
+                         (image_id INTEGER PRIMARY KEY,
+                         group_id INTEGER NOT NULL)''')
+            c.execute("CREATE INDEX IF NOT EXISTS idx_duplicate_members_group ON duplicate_members (group_id)")
+            c.execute('''CREATE TABLE IF NOT EXISTS segments
+                         (image_id INTEGER NOT NULL,
+                         segment INTEGER NOT NULL,
+                         hash INTEGER,
+                         PRIMARY KEY (image_id, segment)) WITHOUT ROWID''')
+            c.execute('''CREATE TABLE IF NOT EXISTS outbox
+                         (id INTEGER PRIMARY KEY,
+                         reservation_id INTEGER,
+                         local_path TEXT,
+                         storage_path TEXT UNIQUE,
+                         hashes TEXT,
+                         status TEXT NOT NULL,
+                         attempts INTEGER NOT NULL DEFAULT 0,
+                         next_attempt_at REAL,
+                         last_error TEXT,
+                         created_at REAL,
+                         updated_at REAL)''')
+            c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)")
+            c.execute('''CREATE TABLE IF NOT EXISTS meta
+                         (name TEXT PRIMARY KEY,
+                         value TEXT)''')
+
+            # 指纹位数：优先取 meta 记录，其次由库中已有哈希推断（早期 TEXT 库按十六进制长度），空库取参数
+            row = c.execute("SELECT value FROM meta WHERE name = 'hash_bits'").fetchone()
+            if row:
+                stored = int(row[0])
+            else:
+                stored = migrated_bits or self._stored_hash_bits(c) or hash_bits or 64
+                c.execute("INSERT INTO meta VALUES ('hash_bits', ?)", (str(stored),))
+            # 数据库标识：持久化索引（如 MmapFingerprintIndex）据此判断索引文件是否属于本库
+            c.execute("INSERT OR IGNORE INTO meta VALUES ('db_id', ?)", (uuid.uuid4().hex,))
+            db_id = c.execute("SELECT value FROM meta WHERE name = 'db_id'").fetchone()[0]
+
+            c.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
             conn.commit()
 
+        # 位数校验在提交之后：校验失败不会导致下次打开时重复迁移
+        if hash_bits is not None and hash_bits != stored:
+            raise ValueError(f"Database stores {stored}-bit hashes, got hash_bits={hash_bits}")
+        return stored, db_id
+
+    @staticmethod
+    def _column_types(c, table):
+        """{列名: 声明类型}"""
+        return {row[1]: row[2].upper() for row in c.execute(f"PRAGMA table_info({table})")}
+
+    @staticmethod
+    def _stored_hash_bits(c):
+        """由已有记录推断指纹位数：INTEGER 为 64 位，BLOB 按字节数；空库返回 None"""
+        row = c.execute('''SELECT typeof(phash), length(phash) FROM images
+                           WHERE phash IS NOT NULL LIMIT 1''').fetchone()
+        if row is None:
+            return None
+        return row[1] * 8 if row[0] == 'blob' else 64
+
+    @staticmethod
+    def _migrate_text_hashes(c):
+        """
+        将 TEXT 十六进制哈希列迁移为 INTEGER / BLOB 列（在调用方的事务内重建表，不单独提交）
+        哈希列已不是 TEXT 时跳过；逐值只转换 TEXT 值，重复执行是安全的
+        :return: 由十六进制长度推断的指纹位数，未迁移或没有记录时返回 None
+        """
+        types = DatabaseManager._column_types(c, 'images')
+        if all(types.get(hash_type) != 'TEXT' for hash_type in HASH_TYPES):
+            return None
+        row = c.execute('''SELECT MAX(length(phash)) FROM images
+                           WHERE typeof(phash) = 'text' AND phash != '' ''').fetchone()
+        hash_bits = row[0] * 4 if row[0] else None
+        c.connection.create_function('encode_hash', 1, lambda value: encode_hash(value, hash_bits or 64),
+                                     deterministic=True)
+        columns = ', '.join(f"CASE WHEN typeof({hash_type}) = 'text' THEN encode_hash(NULLIF({hash_type}, '')) "
+                            f"ELSE {hash_type} END" for hash_type in HASH_TYPES)
+        c.execute('''CREATE TABLE images_migrated
+                     (id INTEGER PRIMARY KEY,
+                     storage_path TEXT UNIQUE,
+                     phash INTEGER,
+                     ahash INTEGER,
+                     dhash INTEGER)''')
+        c.execute(f'''INSERT INTO images_migrated (id, storage_path, phash, ahash, dhash)
+                      SELECT id, storage_path, {columns} FROM images''')
+        c.execute("DROP TABLE images")
+        c.execute("ALTER TABLE images_migrated RENAME TO images")
+        return hash_bits
+
+    @metrics.timed('db_insert')
     def add_image(self, storage_path, hashes):
-        """添加图像记录"""
+        """
+        添加图像记录
+        :param hashes: {哈希类型: 哈希}，可包含 'digest' 内容摘要与 'segments' 分段指纹
+        """
         with self._get_connection() as conn:
             c = conn.cursor()
             try:
                 c.execute('''INSERT INTO images 
-                             (storage_path, phash, ahash, dhash) 
-                             VALUES (?, ?, ?, ?)''',
-                          (storage_path,
-                           hashes.get('phash'),
-                           hashes.get('ahash'),
-                           hashes.get('dhash')))
+                             (storage_path, phash, ahash, dhash, digest) 
+                             VALUES (?, ?, ?, ?, ?)''',
+                          self._record_params(storage_path, hashes))
+                row_id = c.lastrowid
+                self._insert_segments(c, [(row_id, hashes)])
                 conn.commit()
-                return True
             except sqlite3.IntegrityError:
-                return False  # 路径已存在
+                conn.rollback()
+                return False  # 路径或内容摘要已存在
+
+        self._notify_indexes([(row_id, storage_path, hashes)])
+        return True
+
+    def _notify_indexes(self, records):
+        """将本实例写入的记录 [(id, storage_path, hashes)] 同步到指纹索引"""
+        metrics.inc('dedup_rows_written_total', len(records))
+        with self._lock:
+            for row_id, storage_path, hashes in records:
+                for index in self._indexes + self._segment_indexes:
+                    index.add(row_id, storage_path, hashes)
+                if self._synced_id is not None and row_id == self._synced_id + 1:
+                    self._synced_id = row_id
+                else:
+                    self._own_ids.add(row_id)
+
+    @metrics.timed('db_insert')
+    def add_images(self, records):
+        """
+        批量添加图像记录（executemany，单个事务）
+        :param records: [(storage_path, hashes), ...]
+        :return: 与 records 一一对应的记录ID，路径或内容摘要已存在（或在 records 中重复）的为 None
+        """
+        records = list(records)
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            existing = self._path_ids(c, [storage_path for storage_path, _ in records])
+            digests = set(self._digest_paths(c, [hashes.get('digest') for _, hashes in records
+                                                 if hashes.get('digest')]))
+            fresh = {}
+            for i, (storage_path, hashes) in enumerate(records):
+                digest = hashes.get('digest')
+                if storage_path in existing or storage_path in fresh or digest in digests:
+                    continue
+                fresh[storage_path] = i
+                if digest:
+                    digests.add(digest)
+
+            inserted = self._insert_images(c, {storage_path: records[i][1] for storage_path, i in fresh.items()})
+            conn.commit()
+
+        row_ids = [None] * len(records)
+        for storage_path, i in fresh.items():
+            row_ids[i] = inserted[storage_path]
+        self._notify_indexes([(row_id, storage_path, hashes)
+                              for row_id, (storage_path, hashes) in zip(row_ids, records) if row_id is not None])
+        return row_ids
+
+    @metrics.timed('db_insert')
+    def add_images_checked(self, records):
+        """
+        批量查重并写库（单个事务）：先上传后写库的流程在提交前复查。写事务内同步其他进程新增的记录，
+        逐条按 reserve 的规则与已有记录、未过期的预留比对，同批次先写入的记录同样参与后续记录的查重
+        需要已挂载指纹索引（attach_index）
+        :param records: [(storage_path, hashes, 阈值), ...]
+        :return: 与 records 一一对应的 (记录ID, None) 或 (None, "Duplicate image" / "Path exists")
+        """
+        if not self._indexes:
+            raise RuntimeError("add_images_checked requires an attached fingerprint index")
+        records = list(records)
+        results = [None] * len(records)
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            self._begin_reserve(c, time.time())
+            digests = set(self._digest_paths(c, [hashes.get('digest') for _, hashes, _ in records
+                                                 if hashes.get('digest')]))
+            fresh, batch = {}, []
+            for i, (storage_path, hashes, threshold) in enumerate(records):
+                params = self._record_params(storage_path, hashes)
+                if storage_path in fresh:
+                    reason = "Path exists"
+                elif hashes.get('digest') in digests:
+                    reason = "Duplicate image"
+                else:
+                    reason = self._duplicate_reason(c, storage_path, hashes, params, threshold, batch)
+                if reason:
+                    results[i] = (None, reason)
+                    continue
+                fresh[storage_path] = i
+                batch.append(params)
+                if hashes.get('digest'):
+                    digests.add(hashes['digest'])
+
+            inserted = self._insert_images(c, {storage_path: records[i][1] for storage_path, i in fresh.items()})
+            conn.commit()
+
+        for storage_path, i in fresh.items():
+            results[i] = (inserted[storage_path], None)
+        self._notify_indexes([(inserted[storage_path], storage_path, records[i][1])
+                              for storage_path, i in fresh.items()])
+        return results
+
+    def _insert_images(self, c, records):
+        """写入 {storage_path: hashes} 及其分段指纹（在调用方事务内执行），返回 {storage_path: 记录ID}"""
+        c.executemany('''INSERT INTO images
+                         (storage_path, phash, ahash, dhash, digest)
+                         VALUES (?, ?, ?, ?, ?)''',
+                      (self._record_params(storage_path, hashes) for storage_path, hashes in records.items()))
+        inserted = self._path_ids(c, list(records))
+        self._insert_segments(c, [(inserted[storage_path], hashes) for storage_path, hashes in records.items()])
+        return inserted
+
+    def _record_params(self, storage_path, hashes):
+        return (storage_path,
+                encode_hash(hashes.get('phash'), self.hash_bits),
+                encode_hash(hashes.get('ahash'), self.hash_bits),
+                encode_hash(hashes.get('dhash'), self.hash_bits),
+                hashes.get('digest'))
+
+    def _insert_segments(self, c, records):
+        """写入分段指纹 [(image_id, hashes)]，hashes 不含 'segments' 的跳过（在调用方事务内执行）"""
+        c.executemany("INSERT INTO segments VALUES (?, ?, ?)",
+                      ((image_id, k, encode_hash(value, self.hash_bits))
+                       for image_id, hashes in records
+                       for k, value in enumerate(hashes.get('segments') or ())))
+
+    def get_segments(self, image_id):
+        """某条记录的分段指纹（无符号整数列表）"""
+        with self._get_connection() as conn:
+            c = conn.execute("SELECT hash FROM segments WHERE image_id = ? ORDER BY segment", (image_id,))
+            return [decode_hash(value) for value, in c.fetchall()]
+
+    def iter_segments(self, batch_size=10000, after_id=0):
+        """
+        游标分批读取分段指纹
+        :param after_id: 只读取记录ID大于该值的分段
+        :return: 迭代 (image_id, storage_path, [分段哈希, ...])，哈希为无符号整数
+        """
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute('''SELECT s.image_id, i.storage_path, s.hash FROM segments s
+                         JOIN images i ON i.id = s.image_id
+                         WHERE s.image_id > ? ORDER BY s.image_id, s.segment''', (after_id,))
+            image_id, path, values = None, None, []
+            while True:
+                rows = c.fetchmany(batch_size)
+                if not rows:
+                    break
+                metrics.inc('dedup_rows_scanned_total', len(rows), source='iter_segments')
+                for row_id, storage_path, value in rows:
+                    if row_id != image_id and values:
+                        yield image_id, path, values
+                        values = []
+                    image_id, path = row_id, storage_path
+                    values.append(decode_hash(value))
+            if values:
+                yield image_id, path, values
+
+    @staticmethod
+    def _digest_paths(c, digests, chunk_size=500):
+        """按内容摘要分块查询存储路径"""
+        result = {}
+        for i in range(0, len(digests), chunk_size):
+            chunk = digests[i:i + chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            c.execute(f"SELECT digest, storage_path FROM images WHERE digest IN ({placeholders})", chunk)
+            result.update(c.fetchall())
+        return result
+
+    @metrics.timed('db_digest_lookup')
+    def find_by_digests(self, digests):
+        """
+        按内容摘要批量查找已有图像（唯一索引查询）
+        :return: {digest: storage_path}
+        """
+        with self._get_connection() as conn:
+            return self._digest_paths(conn.cursor(), list(digests))
+
+    def find_by_digest(self, digest):
+        """按内容摘要查找已有图像，返回存储路径或 None"""
+        return self.find_by_digests([digest]).get(digest)
+
+    @staticmethod
+    def _path_ids(c, paths, chunk_size=500):
+        """按存储路径分块查询记录ID"""
+        result = {}
+        for i in range(0, len(paths), chunk_size):
+            chunk = paths[i:i + chunk_size]
+            placeholders = ','.join('?' * len(chunk))
+            c.execute(f"SELECT storage_path, id FROM images WHERE storage_path IN ({placeholders})", chunk)
+            result.update(c.fetchall())
+        return result
+
+    def existing_paths(self, paths):
+        """返回 paths 中已有记录的存储路径集合"""
+        with self._get_connection() as conn:
+            return set(self._path_ids(conn.cursor(), list(paths)))
+
+    def get_checkpoint(self, name):
+        """读取任务断点（如存储桶回填的列举 marker）"""
+        with self._get_connection() as conn:
+            row = conn.execute("SELECT value FROM checkpoints WHERE name = ?", (name,)).fetchone()
+            return row[0] if row else None
+
+    def set_checkpoint(self, name, value):
+        """保存任务断点"""
+        with self._get_connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)", (name, value, time.time()))
+            conn.commit()
+
+    def has_image(self, storage_path):
+        """存储路径是否已有记录"""
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT 1 FROM images WHERE storage_path = ?", (storage_path,))
+            return c.fetchone() is not None
+
+    def attach_index(self, index):
+        """
+        由 images 表构建指纹索引，并在之后的 add_image 中保持同步
+        已持久化的索引（如 MmapFingerprintIndex）只增量追加 last_id 之后的记录；
+        索引属于其他数据库或超前于本库（库被重建、从备份恢复）时由 index.bind 清空后重建
+        """
+        if hasattr(index, 'bind'):
+            with self._get_connection() as conn:
+                max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM images").fetchone()[0]
+            index.bind(self.db_id, max_id)
+        loaded = [index.last_id]
+
+        def rows():
+            for row in self.iter_images(after_id=index.last_id):
+                loaded[0] = row[0]
+                yield row
+
+        index.load(rows())
+        with self._lock:
+            self._indexes.append(index)
+            self._synced_id = loaded[0] if self._synced_id is None else min(self._synced_id, loaded[0])
+        return index
+
+    def attach_segment_index(self, index):
+        """由 segments 表构建分段指纹索引，并在之后的 add_image 中保持同步（需先挂载整图指纹索引）"""
+        index.load(self.iter_segments())
+        with self._lock:
+            self._segment_indexes.append(index)
+        return index
+
+    def sync_indexes(self):
+        """补充其他进程新增的记录到指纹索引，返回索引已包含的最大记录ID"""
+        with self._get_connection() as conn:
+            self._sync_indexes(conn.cursor())
+            conn.commit()
+        return self._synced_id
+
+    def _sync_indexes(self, c):
+        """把其他进程在 _synced_id 之后写入的记录补充到指纹索引（在调用方事务内执行）"""
+        c.execute("SELECT id, storage_path, phash, ahash, dhash FROM images WHERE id > ? ORDER BY id",
+                  (self._synced_id,))
+        rows = c.fetchall()
+        segments = {}
+        if self._segment_indexes and rows:
+            c.execute("SELECT image_id, hash FROM segments WHERE image_id > ? ORDER BY image_id, segment",
+                      (self._synced_id,))
+            for image_id, value in c.fetchall():
+                segments.setdefault(image_id, []).append(decode_hash(value))
+        with self._lock:
+            for row_id, storage_path, *values in rows:
+                if row_id not in self._own_ids:
+                    hashes = dict(zip(HASH_TYPES, (decode_hash(v) for v in values)))
+                    if row_id in segments:
+                        hashes['segments'] = segments[row_id]
+                    for index in self._indexes + self._segment_indexes:
+                        index.add(row_id, storage_path, hashes)
+                self._synced_id = row_id
+            self._own_ids = {row_id for row_id in self._own_ids if row_id > self._synced_id}
+
+    @metrics.timed('db_reserve')
+    def reserve(self, storage_path, hashes, threshold=5, ttl=300):
+        """
+        原子查重并预留：在写事务（BEGIN IMMEDIATE，跨进程串行）内同步其他进程新增的记录，
+        与已有记录及未过期的预留比对，不重复时写入预留行。上传完成后调用 commit_reservation，
+        失败时调用 release_reservation；进程崩溃遗留的预留在 ttl 秒后失效。
+        需要已挂载指纹索引（attach_index）。
+        :return: (预留ID, None) 或 (None, "Duplicate image" / "Path exists")
+        """
+        if not self._indexes:
+            raise RuntimeError("reserve requires an attached fingerprint index")
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            self._begin_reserve(c, now)
+            reservation_id, reason = self._reserve(c, storage_path, hashes, threshold, now + ttl)
+            if reason:
+                conn.rollback()
+                return None, reason
+            conn.commit()
+            return reservation_id, None
+
+    def _begin_reserve(self, c, now):
+        """清理过期预留并同步其他进程新增的记录（在调用方写事务内执行）"""
+        c.execute("DELETE FROM reservations WHERE expires_at < ?", (now,))
+        self._sync_indexes(c)
+
+    def _reserve(self, c, storage_path, hashes, threshold, expires_at):
+        """
+        查重并写入预留行（在调用方写事务内执行），expires_at 为空的预留不会过期
+        :return: (预留ID, None) 或 (None, 原因)
+        """
+        params = self._record_params(storage_path, hashes)
+        reason = self._duplicate_reason(c, storage_path, hashes, params, threshold)
+        if reason:
+            return None, reason
+
+        c.execute('''INSERT INTO reservations
+                     (storage_path, phash, ahash, dhash, digest, expires_at)
+                     VALUES (?, ?, ?, ?, ?, ?)''', params + (expires_at,))
+        return c.lastrowid, None
+
+    def _duplicate_reason(self, c, storage_path, hashes, params, threshold, batch=()):
+        """
+        查重（在调用方写事务内执行）：路径已存在或已预留、与已有记录或未过期的预留相似、分段投票命中
+        :param batch: 同一事务内已接受但尚未写入索引的记录参数，同样参与比对
+        :return: "Path exists" / "Duplicate image"，不重复时为 None
+        """
+        if c.execute("SELECT 1 FROM images WHERE storage_path = ? UNION ALL "
+                     "SELECT 1 FROM reservations WHERE storage_path = ?",
+                     (storage_path, storage_path)).fetchone():
+            return "Path exists"
+        if self._indexes[0].search(hashes, threshold) or self._reserved_match(c, params, threshold, batch):
+            return "Duplicate image"
+        if self._segment_indexes and hashes.get('segments') and \
+                self._segment_indexes[0].search(hashes['segments']):
+            return "Duplicate image"      # 局部重复（分段投票）
+        return None
+
+    @staticmethod
+    def _reserved_match(c, params, threshold, batch=()):
+        """是否与未过期的预留（及 batch 中的记录参数）重复（内容摘要相同，或任一种哈希距离不超过阈值）"""
+        _, *values, digest = params
+        rows = c.execute("SELECT storage_path, phash, ahash, dhash, digest FROM reservations")
+        for _, *reserved, reserved_digest in itertools.chain(rows, batch):
+            if digest and digest == reserved_digest:
+                return True
+            for value, other in zip(values, reserved):
+                if value is not None and other is not None and \
+                        (decode_hash(value) ^ decode_hash(other)).bit_count() <= threshold:
+                    return True
+        return False
+
+    @metrics.timed('db_commit')
+    def commit_reservation(self, reservation_id, storage_path, hashes):
+        """
+        预留转为正式记录（单个事务内写入 images 并删除预留）
+        :return: 是否成功；预留已过期被清理时返回 False，调用方应回滚上传
+        """
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            row_id = self._commit_reservation(c, reservation_id, storage_path, hashes)
+            if row_id is None:
+                conn.rollback()
+                return False
+            conn.commit()
+
+        self._notify_indexes([(row_id, storage_path, hashes)])
+        return True
+
+    def _commit_reservation(self, c, reservation_id, storage_path, hashes):
+        """删除预留并写入正式记录（在调用方写事务内执行），返回记录ID，预留不存在或写入冲突时返回 None"""
+        c.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+        if not c.rowcount:
+            return None
+        try:
+            c.execute('''INSERT INTO images
+                         (storage_path, phash, ahash, dhash, digest)
+                         VALUES (?, ?, ?, ?, ?)''',
+                      self._record_params(storage_path, hashes))
+        except sqlite3.IntegrityError:
+            return None
+        row_id = c.lastrowid
+        self._insert_segments(c, [(row_id, hashes)])
+        return row_id
+
+    def release_reservation(self, reservation_id):
+        """释放预留（上传失败时）"""
+        with self._get_connection() as conn:
+            conn.execute("DELETE FROM reservations WHERE id = ?", (reservation_id,))
+            conn.commit()
+
+    @metrics.timed('outbox_enqueue')
+    def enqueue_uploads(self, records):
+        """
+        待上传图像入队（单个事务）：逐条查重并写入不过期的预留，同时写入 pending 状态的 outbox 行；
+        同批次内先入队的记录同样参与后续记录的查重
+        :param records: [(本地路径, 存储路径, hashes, 阈值)]
+        :return: 与 records 一一对应的 (outbox ID, None) 或 (None, 原因)
+        """
+        if not self._indexes:
+            raise RuntimeError("enqueue_uploads requires an attached fingerprint index")
+        results = []
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            self._begin_reserve(c, now)
+            for local_path, storage_path, hashes, threshold in records:
+                reservation_id, reason = self._reserve(c, storage_path, hashes, threshold, None)
+                if reason:
+                    results.append((None, reason))
+                    continue
+                c.execute("DELETE FROM outbox WHERE storage_path = ? AND status IN ('done', 'failed')",
+                          (storage_path,))
+                c.execute('''INSERT INTO outbox
+                             (reservation_id, local_path, storage_path, hashes, status,
+                              next_attempt_at, created_at, updated_at)
+                             VALUES (?, ?, ?, ?, 'pending', ?, ?, ?)''',
+                          (reservation_id, local_path, storage_path, json.dumps(self._outbox_hashes(hashes)),
+                           now, now, now))
+                results.append((c.lastrowid, None))
+            conn.commit()
+        return results
+
+    @staticmethod
+    def _outbox_hashes(hashes):
+        """入库需要的指纹字段（整图哈希、内容摘要与分段）"""
+        return {k: v for k, v in hashes.items() if k in HASH_TYPES or k in ('digest', 'segments')}
+
+    def claim_upload(self, lease=600):
+        """
+        领取一条到期的上传任务：状态置为 uploading、尝试次数加一，并在 lease 秒内不再被领取
+        （进程崩溃遗留的 uploading 任务租期过后重新领取）
+        :return: {'id', 'local_path', 'storage_path', 'hashes', 'attempts'} 或 None
+        """
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            row = c.execute('''SELECT id, local_path, storage_path, hashes, attempts FROM outbox
+                               WHERE status IN ('pending', 'uploading') AND next_attempt_at <= ?
+                               ORDER BY next_attempt_at, id LIMIT 1''', (now,)).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            c.execute('''UPDATE outbox SET status = 'uploading', attempts = attempts + 1,
+                         next_attempt_at = ?, updated_at = ? WHERE id = ?''', (now + lease, now, row[0]))
+            conn.commit()
+        return {'id': row[0], 'local_path': row[1], 'storage_path': row[2],
+                'hashes': json.loads(row[3]), 'attempts': row[4] + 1}
+
+    def next_upload_due(self):
+        """最早到期的上传任务时间，没有待处理任务时为 None"""
+        with self._get_connection() as conn:
+            return conn.execute("SELECT MIN(next_attempt_at) FROM outbox "
+                                "WHERE status IN ('pending', 'uploading')").fetchone()[0]
+
+    @metrics.timed('db_commit')
+    def complete_upload(self, outbox_id):
+        """
+        上传完成：预留转为正式记录并将任务置为 done（单个事务）
+        :return: 是否成功；预留已不存在或写入冲突时任务置为 failed 并返回 False，调用方应回滚上传；
+                 任务已不由调用方持有（租期过后被重新领取）时返回 None
+        """
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            row = c.execute("SELECT reservation_id, storage_path, hashes FROM outbox "
+                            "WHERE id = ? AND status = 'uploading'", (outbox_id,)).fetchone()
+            if row is None:
+                conn.rollback()
+                return None
+            reservation_id, storage_path, hashes = row[0], row[1], json.loads(row[2])
+            row_id = self._commit_reservation(c, reservation_id, storage_path, hashes)
+            if row_id is None:
+                conn.rollback()
+                self.fail_upload(outbox_id, "Database error")
+                return False
+            c.execute("UPDATE outbox SET status = 'done', last_error = NULL, updated_at = ? WHERE id = ?",
+                      (time.time(), outbox_id))
+            conn.commit()
+
+        self._notify_indexes([(row_id, storage_path, hashes)])
+        return True
+
+    def retry_upload(self, outbox_id, delay, error=None):
+        """上传失败，delay 秒后重试（任务已结束时不变）"""
+        now = time.time()
+        with self._get_connection() as conn:
+            conn.execute("UPDATE outbox SET status = 'pending', next_attempt_at = ?, last_error = ?, updated_at = ? "
+                         "WHERE id = ? AND status = 'uploading'", (now + delay, error, now, outbox_id))
+            conn.commit()
+
+    def fail_upload(self, outbox_id, error=None):
+        """放弃上传：任务置为 failed 并释放预留（单个事务，任务已结束时不变）"""
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            c.execute("UPDATE outbox SET status = 'failed', last_error = ?, updated_at = ? "
+                      "WHERE id = ? AND status = 'uploading'", (error, time.time(), outbox_id))
+            if c.rowcount:
+                c.execute("DELETE FROM reservations WHERE id = (SELECT reservation_id FROM outbox WHERE id = ?)",
+                          (outbox_id,))
+            conn.commit()
+
+    def upload_status(self, storage_path):
+        """
+        按存储路径查询上传任务
+        :return: {'id', 'storage_path', 'status', 'attempts', 'last_error', 'next_attempt_at'} 或 None
+        """
+        with self._get_connection() as conn:
+            row = conn.execute('''SELECT id, storage_path, status, attempts, last_error, next_attempt_at,
+                                           created_at, updated_at
+                                    FROM outbox WHERE storage_path = ?''', (storage_path,)).fetchone()
+        if row is None:
+            return None
+        keys = ('id', 'storage_path', 'status', 'attempts', 'last_error', 'next_attempt_at',
+                'created_at', 'updated_at')
+        return dict(zip(keys, row))
+
+    def outbox_counts(self):
+        """各状态的上传任务数"""
+        with self._get_connection() as conn:
+            return dict(conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall())
+
+    def purge_uploads(self, before):
+        """删除 before（时间戳）之前结束的 done / failed 任务，返回删除数"""
+        with self._get_connection() as conn:
+            c = conn.execute("DELETE FROM outbox WHERE status IN ('done', 'failed') AND updated_at < ?", (before,))
+            conn.commit()
+            return c.rowcount
+
+    def duplicate_groups_for(self, ids, chunk_size=500):
+        """已持久化的重复组归属，返回 {image_id: group_id}"""
+        ids = [int(i) for i in ids]
+        result = {}
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            for i in range(0, len(ids), chunk_size):
+                chunk = ids[i:i + chunk_size]
+                placeholders = ','.join('?' * len(chunk))
+                c.execute(f"SELECT image_id, group_id FROM duplicate_members WHERE image_id IN ({placeholders})",
+                          chunk)
+                result.update(c.fetchall())
+        return result
+
+    def merge_duplicate_groups(self, merges, checkpoint=None):
+        """
+        合并重复组（单个事务），可同时推进扫描断点
+        :param merges: [(新组ID, 并入的原组ID列表, 成员ID列表)]
+        :param checkpoint: (断点名, 值)，与组的更新一起提交
+        """
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute("BEGIN IMMEDIATE")
+            for group_id, absorbed, members in merges:
+                absorbed = [g for g in absorbed if g != group_id]
+                if absorbed:
+                    placeholders = ','.join('?' * len(absorbed))
+                    c.execute(f"UPDATE duplicate_members SET group_id = ? WHERE group_id IN ({placeholders})",
+                              [group_id] + absorbed)
+                c.executemany("INSERT OR REPLACE INTO duplicate_members VALUES (?, ?)",
+                              ((member, group_id) for member in members))
+            if checkpoint is not None:
+                c.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?)", checkpoint + (time.time(),))
+            conn.commit()
+
+    def reset_duplicate_groups(self):
+        """清空已持久化的重复组"""
+        with self._get_connection() as conn:
+            conn.execute("DELETE FROM duplicate_members")
+            conn.commit()
+
+    def iter_duplicate_groups(self):
+        """
+        读取已持久化的重复组
+        :return: 迭代 (group_id, [storage_path, ...])，成员按入库顺序，组ID为最早入库成员的记录ID
+        """
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute('''SELECT m.group_id, i.storage_path FROM duplicate_members m
+                         JOIN images i ON i.id = m.image_id
+                         ORDER BY m.group_id, m.image_id''')
+            group_id, members = None, []
+            for row_group, storage_path in c:
+                if row_group != group_id and members:
+                    yield group_id, members
+                    members = []
+                group_id = row_group
+                members.append(storage_path)
+            if members:
+                yield group_id, members
+
+    def iter_images(self, batch_size=10000, after_id=0):
+        """
+        游标分批流式读取图像记录，不一次性物化整表
+        :param after_id: 只读取ID大于该值的记录
+        :return: 迭代 (id, storage_path, phash, ahash, dhash)，哈希为无符号整数
+        """
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            c.execute("SELECT id, storage_path, phash, ahash, dhash FROM images WHERE id > ? ORDER BY id",
+                      (after_id,))
+            while True:
+                rows = c.fetchmany(batch_size)
+                if not rows:
+                    break
+                metrics.inc('dedup_rows_scanned_total', len(rows), source='iter_images')
+                for row_id, storage_path, phash, ahash, dhash in rows:
+                    yield row_id, storage_path, decode_hash(phash), decode_hash(ahash), decode_hash(dhash)
+
+    def get_paths(self, ids, chunk_size=500):
+        """按记录ID批量查询存储路径，返回 {id: storage_path}"""
+        ids = [int(i) for i in ids]
+        result = {}
+        with self._get_connection() as conn:
+            c = conn.cursor()
+            for i in range(0, len(ids), chunk_size):
+                chunk = ids[i:i + chunk_size]
+                placeholders = ','.join('?' * len(chunk))
+                c.execute(f"SELECT id, storage_path FROM images WHERE id IN ({placeholders})", chunk)
+                result.update(c.fetchall())
+        return result
+
+    def build_mmap_index(self, directory, shard_bits=4, read_only=False):
+        """
+        构建（或增量同步）内存映射分片指纹索引并保持同步
+        :param read_only: 只读挂载，不写入索引文件（由其他进程负责写入）
+        """
+        from deduplicator.mmap_index import MmapFingerprintIndex
+        return self.attach_index(MmapFingerprintIndex(directory, self, hash_bits=self.hash_bits,
+                                                      shard_bits=shard_bits, read_only=read_only))
 
     def get_all_images(self):
         """获取所有图像记录"""
+        return list(self.iter_images())
+
+    @metrics.timed('db_load_matrix')
+    def load_matrix(self, batch_size=10000):
+        """按批构建整表指纹矩阵（每批直接转换为 NumPy 数组）"""
+        chunks = []
         with self._get_connection() as conn:
             c = conn.cursor()
-            c.execute("SELECT id, storage_path, phash, ahash, dhash FROM images")
-            return c.fetchall()
+            c.execute("SELECT id, storage_path, phash, ahash, dhash FROM images ORDER BY id")
+            while True:
+                rows = c.fetchmany(batch_size)
+                if not rows:
+                    break
+                metrics.inc('dedup_rows_scanned_total', len(rows), source='load_matrix')
+                chunks.append(self._matrix_from_rows(rows))
+        if not chunks:
+            return FingerprintMatrix.from_rows([], n_words=ImageHasher.words_for_bits(self.hash_bits))
+        return FingerprintMatrix.concatenate(chunks)
+
+    def _matrix_from_rows(self, rows, hash_types=HASH_TYPES):
+        """
+        由数据库原始行构建指纹矩阵，无需逐个解析哈希：
+        INTEGER 列按有符号 64 位整数重解释，BLOB 列拼接后按大端序 uint64 解析
+        """
+        n_words = ImageHasher.words_for_bits(self.hash_bits)
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        paths = [row[1] for row in rows]
+        words, valid = {}, {}
+        for offset, hash_type in enumerate(hash_types, start=2):
+            column = [row[offset] for row in rows]
+            valid[hash_type] = np.fromiter((v is not None for v in column), dtype=bool, count=len(rows))
+            if n_words == 1:
+                values = np.fromiter((0 if v is None else v for v in column), dtype=np.int64, count=len(rows))
+                words[hash_type] = values.view(np.uint64)[:, None]
+            else:
+                empty = bytes(8 * n_words)
+                data = b''.join(empty if v is None else v for v in column)
+                words[hash_type] = np.frombuffer(data, dtype='>u8').astype(np.uint64).reshape(len(rows), n_words)
+        return FingerprintMatrix(ids, paths, words, valid)
 
+    @metrics.timed('db_find_similar')
     def find_similar(self, target_hash, hash_type='phash', threshold=5):
         """查找相似图像"""
-        if hash_type not in ['phash', 'ahash', 'dhash']:
+        if hash_type not in HASH_TYPES:
             raise ValueError("Invalid hash type")
 
-        query = f"SELECT storage_path, {hash_type} FROM images WHERE {hash_type} IS NOT NULL"
+        # 单一哈希查询不经过级联策略：级联的票数 / 校验规则针对多种哈希，单独一种哈希精确命中也可能被拒
+        for index in self._indexes:
+            if hash_type in index.indexes:
+                return [(path, dist) for _, path, dist in index.search_any({hash_type: target_hash}, threshold)]
+
+        query = f"SELECT id, storage_path, {hash_type} FROM images WHERE {hash_type} IS NOT NULL"
         with self._get_connection() as conn:
             c = conn.cursor()
             c.execute(query)
-            results = []
-            for path, hash_val in c.fetchall():
-                dist = ImageHasher.hamming_distance(target_hash, hash_val)
-                if dist <= threshold:
-                    results.append((path, dist))
-            return sorted(results, key=lambda x: x[1])  # 按相似度排序
+            matrix = self._matrix_from_rows(c.fetchall(), (hash_type,))
+        metrics.inc('dedup_rows_scanned_total', len(matrix), source='find_similar')
+
+        distances = matrix.distances(hash_type, target_hash)
+        matched = np.flatnonzero(distances <= threshold)
+        order = matched[np.argsort(distances[matched], kind='stable')]  # 按相似度排序
+        return [(matrix.paths[i], int(distances[i])) for i in order]
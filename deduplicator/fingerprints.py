@@ -0,0 +1,110 @@
+import numpy as np
+
+from deduplicator.hashing import HASH_METHODS, ImageHasher, popcount
+
+HASH_TYPES = HASH_METHODS
+
+# 缺失指纹的距离占位值，保证不会落入任何阈值
+MISSING_DISTANCE = np.iinfo(np.int64).max
+
+
+class FingerprintMatrix:
+    """指纹矩阵：按哈希类型保存 uint64 字数组，用于批量汉明距离计算"""
+
+    def __init__(self, ids, paths, words, valid):
+        """
+        :param ids: 记录ID数组，形状 (n,)
+        :param paths: 存储路径列表
+        :param words: {哈希类型: 形状 (n, n_words) 的 uint64 数组}
+        :param valid: {哈希类型: 形状 (n,) 的布尔数组，标记该指纹是否存在}
+        """
+        self.ids = ids
+        self.paths = paths
+        self.words = words
+        self.valid = valid
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def hash_types(self):
+        return tuple(self.words)
+
+    @classmethod
+    def from_rows(cls, rows, hash_types=HASH_TYPES, n_words=None):
+        """
+        从数据库记录构建指纹矩阵
+        :param rows: (id, storage_path, *hashes) 形式的记录，哈希顺序与 hash_types 一致，
+                     哈希为十六进制字符串或无符号整数
+        :param n_words: 每个指纹的字数，默认按首个非空哈希推断
+        """
+        rows = list(rows)
+        first = next((h for row in rows for h in row[2:] if h is not None), None)
+        if n_words is None:
+            n_words = 1 if first is None else len(ImageHasher.hash_to_words(first))
+
+        ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+        paths = [row[1] for row in rows]
+        words, valid = {}, {}
+        for offset, hash_type in enumerate(hash_types, start=2):
+            column = [row[offset] for row in rows]
+            valid[hash_type] = np.fromiter((v is not None for v in column), dtype=bool, count=len(rows))
+            if n_words == 1 and isinstance(first, int):
+                words[hash_type] = np.array([0 if v is None else v for v in column], dtype=np.uint64)[:, None]
+            else:
+                matrix = np.zeros((len(rows), n_words), dtype=np.uint64)
+                for i, value in enumerate(column):
+                    if value is not None:
+                        matrix[i] = ImageHasher.hash_to_words(value, n_words)
+                words[hash_type] = matrix
+        return cls(ids, paths, words, valid)
+
+    @classmethod
+    def concatenate(cls, matrices, hash_types=HASH_TYPES):
+        """按顺序拼接多个分块指纹矩阵"""
+        matrices = list(matrices)
+        if not matrices:
+            return cls.from_rows([], hash_types)
+        return cls(np.concatenate([m.ids for m in matrices]),
+                   [path for m in matrices for path in m.paths],
+                   {t: np.concatenate([m.words[t] for m in matrices]) for t in matrices[0].hash_types},
+                   {t: np.concatenate([m.valid[t] for m in matrices]) for t in matrices[0].hash_types})
+
+    def distances(self, hash_type, query, start=0):
+        """
+        查询指纹到 start 之后所有记录的汉明距离，缺失指纹记为 MISSING_DISTANCE
+        :param query: 十六进制哈希、整数或 uint64 字数组
+        """
+        matrix = self.words[hash_type][start:]
+        if isinstance(query, (str, int)):
+            query = ImageHasher.hash_to_words(query, matrix.shape[1])
+        dist = ImageHasher.hamming_distances(query, matrix)
+        return np.where(self.valid[hash_type][start:], dist, MISSING_DISTANCE)
+
+    def min_distances(self, hashes, start=0):
+        """
+        多种哈希分别比较后取最小距离（任一哈希相似即视为相似）
+        :param hashes: {哈希类型: 十六进制哈希或 uint64 字数组}
+        """
+        result = np.full(len(self) - start, MISSING_DISTANCE, dtype=np.int64)
+        for hash_type, query in hashes.items():
+            if query is None or hash_type not in self.words:
+                continue
+            np.minimum(result, self.distances(hash_type, query, start), out=result)
+        return result
+
+    def block_min_distances(self, rows, cols):
+        """
+        两个记录分块之间的成对最小距离（多种哈希取最小）
+        :param rows: 行分块切片
+        :param cols: 列分块切片
+        :return: 形状 (len(rows), len(cols)) 的距离矩阵
+        """
+        result = None
+        for hash_type, words in self.words.items():
+            xor = np.bitwise_xor(words[rows][:, None, :], words[cols][None, :, :])
+            dist = popcount(xor).sum(axis=2, dtype=np.int64)
+            valid = self.valid[hash_type]
+            dist[~(valid[rows][:, None] & valid[cols][None, :])] = MISSING_DISTANCE
+            result = dist if result is None else np.minimum(result, dist, out=result)
+        return result
@@ -1,39 +1,443 @@
+import hashlib
+import io
+import logging
+import os
+
 from PIL import Image
-import imagehash
 import numpy as np
 
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+HASH_METHODS = ('phash', 'ahash', 'dhash')
+
+# 二面体群 D4 的 8 种方向（与 PIL Image.Transpose 对应）：(是否转置, 是否上下翻转, 是否左右翻转)，
+# 作用于缩略图时先转置再翻转；第一种为原方向
+DIHEDRAL_TRANSFORMS = {
+    'identity': (False, False, False),
+    'flip_left_right': (False, False, True),
+    'flip_top_bottom': (False, True, False),
+    'rotate_180': (False, True, True),
+    'transpose': (True, False, False),
+    'rotate_90': (True, True, False),
+    'rotate_270': (True, False, True),
+    'transverse': (True, True, True),
+}
+
+WORD_BITS = 64
+WORD_MASK = (1 << WORD_BITS) - 1
+
+if hasattr(np, 'bitwise_count'):
+    popcount = np.bitwise_count
+else:
+    _POPCOUNT_TABLE = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def popcount(words):
+        words = np.ascontiguousarray(words, dtype=np.uint64)
+        return _POPCOUNT_TABLE[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+
+def _is_path(source):
+    return isinstance(source, (str, os.PathLike))
+
+
+def _as_source(source):
+    """bytes 包装为内存文件，路径与文件对象原样交给 PIL"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return io.BytesIO(source)
+    return source
+
+
+def _describe(source):
+    return source if _is_path(source) else f"<{type(source).__name__}>"
+
 
 class ImageHasher:
-    def __init__(self, method='phash', hash_size=8, highfreq_factor=4):
+    # 降分辨率解码时，中间图像至少保留为最大哈希缩放尺寸的倍数
+    DECODE_OVERSAMPLE = 8
+    # 分段指纹：在长边 SEGMENT_WORK_SIZE 的模糊缩略图上按 SEGMENT_LEVELS 级亮度量化，
+    # 取面积不小于 SEGMENT_MIN_AREA 的连通区域（最多 SEGMENT_MAX 个，按面积从大到小）
+    SEGMENT_WORK_SIZE = 192
+    SEGMENT_LEVELS = 4
+    SEGMENT_MIN_AREA = 0.005
+    SEGMENT_MAX = 24
+
+    def __init__(self, method='phash', hash_size=8, highfreq_factor=4, fast_decode=False, cache=None,
+                 orientation_invariant=False, segments=False):
         """
         图像哈希计算器
         :param method: 哈希方法 (phash/ahash/dhash)
         :param hash_size: 哈希尺寸
         :param highfreq_factor: pHash高频因子
+        :param fast_decode: 降分辨率解码（JPEG DCT 缩放 + 整数倍缩小），哈希可能有少量位差异
+        :param cache: HashCache 磁盘指纹缓存，文件未变化时跳过解码
+        :param orientation_invariant: compute_all 同时给出 8 种旋转 / 翻转方向的哈希（'variants'），
+                                      查询时任一方向相似即命中
+        :param segments: compute_all 同时给出各内容区域的 pHash（'segments'），用于裁剪、加边框、截图等局部重复检测
         """
         self.method = method
         self.hash_size = hash_size
         self.highfreq_factor = highfreq_factor
+        self.fast_decode = fast_decode
+        self.cache = cache
+        self.orientation_invariant = orientation_invariant
+        self.segments = segments
+        if cache is not None:
+            cache.bind(self.cache_params)
+
+    @property
+    def cache_params(self):
+        """影响哈希结果的参数，变化时缓存失效"""
+        params = (self.hash_size, self.highfreq_factor, self.fast_decode, self.DECODE_OVERSAMPLE)
+        if self.segments:
+            params += (self.SEGMENT_WORK_SIZE, self.SEGMENT_LEVELS, self.SEGMENT_MIN_AREA, self.SEGMENT_MAX)
+        return params
+
+    @property
+    def n_words(self):
+        """单个指纹占用的 uint64 字数"""
+        return ImageHasher.words_for_bits(self.hash_bits)
+
+    @property
+    def hash_bits(self):
+        return self.hash_size * self.hash_size
+
+    def scale_threshold(self, threshold, reference_bits=64):
+        """
+        按指纹位数等比例缩放汉明距离阈值，使不同 hash_size 下的相似度标准大致一致
+        :param threshold: 以 reference_bits 位指纹（hash_size=8）给出的阈值
+        """
+        return round(threshold * self.hash_bits / reference_bits)
 
     def compute(self, image_path):
         """计算图像哈希值"""
+        hashes = self.compute_all(image_path, (self.method,))
+        return hashes[self.method] if hashes else None
+
+    def compute_all(self, image_path, methods=HASH_METHODS):
+        """
+        一次解码计算多种哈希：图像只解码、灰度化一次，各哈希共用灰度图
+        :param image_path: 文件路径、bytes 或可读的文件对象
+        :return: {哈希方法: 十六进制哈希}，失败时返回 None；
+                 orientation_invariant 时另含 'variants': {哈希方法: [8 种方向的十六进制哈希]}，
+                 segments 时另含 'segments': [各区域的十六进制 pHash]
+        """
+        if self.orientation_invariant:
+            return self.compute_dihedral(image_path, methods)
+
+        keys = tuple(methods) + (('segments',) if self.segments else ())
+        cached = self._cache_get(image_path, keys)
+        if cached is not None:
+            metrics.inc('dedup_hash_cache_total', result='hit')
+            return cached
+        if self.cache is not None:
+            metrics.inc('dedup_hash_cache_total', result='miss')
+
+        try:
+            with metrics.timer('decode'):
+                with Image.open(_as_source(image_path)) as img:
+                    gray = self._load_gray(img)
+            with metrics.timer('hash'):
+                hashes = {method: self._hash_gray(gray, method) for method in methods}
+            if self.segments:
+                with metrics.timer('segment_hash'):
+                    hashes['segments'] = self._segment_gray(gray)
+        except Exception as e:
+            logger.warning("Error computing hash for %s: %s", _describe(image_path), e)
+            return None
+
+        if self.cache is not None and _is_path(image_path):
+            try:
+                self.cache.put(image_path, hashes)
+            except Exception as e:
+                logger.warning("Error writing hash cache for %s: %s", image_path, e)
+        return hashes
+
+    def compute_dihedral(self, image_path, methods=HASH_METHODS):
+        """
+        一次解码、每种哈希一次变换计算 8 种方向（DIHEDRAL_TRANSFORMS）的哈希：
+        pHash 利用 DCT 的对称性——转置对应系数矩阵转置，上下 / 左右翻转对应第 u 行 / 第 v 列系数乘以 (-1)^u / (-1)^v，
+        只做一次 DCT 后调整低频系数的符号与转置，再分别取中位数；aHash 直接对缩略图转置 / 翻转；
+        dHash 另取一张转置尺寸的缩略图，各方向直接在转置 / 翻转后的缩略图上做差分。
+        原方向的结果与 compute_all 逐位一致，其他方向与先变换图像再计算相比，缩放的舍入可能带来少量位差异
+        :return: {哈希方法: 原方向哈希, 'variants': {哈希方法: [8 种方向的十六进制哈希]}}，失败时返回 None
+        """
+        keys = [f"{method}:dihedral" for method in methods] + (['segments'] if self.segments else [])
+        variants = self._cache_get(image_path, keys)
+        if variants is not None:
+            metrics.inc('dedup_hash_cache_total', result='hit')
+        else:
+            if self.cache is not None:
+                metrics.inc('dedup_hash_cache_total', result='miss')
+            try:
+                with metrics.timer('decode'):
+                    with Image.open(_as_source(image_path)) as img:
+                        gray = self._load_gray(img)
+                with metrics.timer('hash'):
+                    variants = {key: self._dihedral_gray(gray, method) for key, method in zip(keys, methods)}
+                if self.segments:
+                    with metrics.timer('segment_hash'):
+                        variants['segments'] = self._segment_gray(gray)
+            except Exception as e:
+                logger.warning("Error computing hash for %s: %s", _describe(image_path), e)
+                return None
+            if self.cache is not None and _is_path(image_path):
+                try:
+                    self.cache.put(image_path, variants)
+                except Exception as e:
+                    logger.warning("Error writing hash cache for %s: %s", image_path, e)
+
+        segments = variants.get('segments')
+        variants = {method: variants[key] for key, method in zip(keys, methods)}
+        hashes = {method: values[0] for method, values in variants.items()}
+        hashes['variants'] = variants
+        if segments is not None:
+            hashes['segments'] = segments
+        return hashes
+
+    @staticmethod
+    def _orient(array, transpose, flip_rows, flip_cols):
+        if transpose:
+            array = array.T
+        if flip_rows:
+            array = array[::-1]
+        if flip_cols:
+            array = array[:, ::-1]
+        return array
+
+    def _dihedral_gray(self, gray, method):
+        """由灰度图计算 8 种方向的哈希（顺序同 DIHEDRAL_TRANSFORMS）"""
+        size = self.hash_size
+        if method == 'phash':
+            import scipy.fftpack
+            img_size = size * self.highfreq_factor
+            pixels = np.asarray(gray.resize((img_size, img_size), Image.LANCZOS))
+            dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=0), axis=1)
+            low_freq = dct[:size, :size]
+            signs = (-1.0) ** np.arange(size)
+            stacked = []
+            for transpose, flip_rows, flip_cols in DIHEDRAL_TRANSFORMS.values():
+                coeffs = low_freq.T if transpose else low_freq
+                if flip_rows:
+                    coeffs = coeffs * signs[:, None]
+                if flip_cols:
+                    coeffs = coeffs * signs[None, :]
+                stacked.append(coeffs.ravel())
+            stacked = np.array(stacked)
+            bits = stacked > np.median(stacked, axis=1, keepdims=True)
+        elif method == 'ahash':
+            pixels = np.asarray(gray.resize((size, size), Image.LANCZOS))
+            bits = np.array([self._orient(pixels, *t).ravel() for t in DIHEDRAL_TRANSFORMS.values()])
+            bits = bits > pixels.mean()
+        elif method == 'dhash':
+            # 横向差分用 (size + 1) 宽的缩略图，转置方向的横向差分即原图的纵向差分
+            wide = np.asarray(gray.resize((size + 1, size), Image.LANCZOS))
+            tall = np.asarray(gray.resize((size, size + 1), Image.LANCZOS))
+            bits = []
+            for transpose, flip_rows, flip_cols in DIHEDRAL_TRANSFORMS.values():
+                pixels = self._orient(tall if transpose else wide, transpose, flip_rows, flip_cols)
+                bits.append((pixels[:, 1:] > pixels[:, :-1]).ravel())
+            bits = np.array(bits)
+        else:
+            raise ValueError(f"Unsupported hash method: {method}")
+        return ImageHasher.pack_hex(bits)
+
+    def compute_segments(self, image_path):
+        """
+        分段指纹：各内容区域外接矩形的 pHash 列表（区域按内容划分，不随裁剪、加边框、嵌入截图而错位）
+        :return: 十六进制哈希列表，失败时返回 None
+        """
         try:
-            with Image.open(image_path) as img:
-                return self._compute_hash(img)
+            with Image.open(_as_source(image_path)) as img:
+                gray = self._load_gray(img)
+            return self._segment_gray(gray)
         except Exception as e:
-            print(f"Error computing hash for {image_path}: {str(e)}")
+            logger.warning("Error computing segments for %s: %s", _describe(image_path), e)
             return None
 
+    def segment_boxes(self, gray):
+        """
+        内容区域：模糊缩略图按亮度量化后的 8 连通区域，返回原图坐标下的外接矩形 [(left, top, right, bottom)]
+        """
+        from PIL import ImageFilter
+        import scipy.ndimage
+
+        scale = self.SEGMENT_WORK_SIZE / max(gray.size)
+        size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        small = np.asarray(gray.resize(size, Image.BILINEAR).filter(ImageFilter.GaussianBlur(1)))
+        levels = small.astype(np.int32) * self.SEGMENT_LEVELS // 256
+        min_area = self.SEGMENT_MIN_AREA * small.size
+
+        regions = []
+        for level in range(self.SEGMENT_LEVELS):
+            labels, count = scipy.ndimage.label(levels == level, structure=np.ones((3, 3)))
+            if not count:
+                continue
+            areas = np.bincount(labels.ravel())[1:]
+            for area, (rows, cols) in zip(areas, scipy.ndimage.find_objects(labels)):
+                if area >= min_area:
+                    regions.append((area, (cols.start / scale, rows.start / scale,
+                                           cols.stop / scale, rows.stop / scale)))
+        regions.sort(key=lambda r: -r[0])
+        return [tuple(int(round(v)) for v in box) for _, box in regions[:self.SEGMENT_MAX]]
+
+    def _segment_gray(self, gray):
+        """各内容区域的 pHash，跳过过小或近乎纯色的区域"""
+        thumbnails = []
+        for box in self.segment_boxes(gray):
+            if box[2] - box[0] < self.hash_size or box[3] - box[1] < self.hash_size:
+                continue
+            thumbnail = self.phash_thumbnail(gray.crop(box))
+            if thumbnail.std() >= 4:
+                thumbnails.append(thumbnail)
+        return self.phash_batch(np.stack(thumbnails)) if thumbnails else []
+
+    def _cache_get(self, image_path, methods):
+        if self.cache is None or not _is_path(image_path):
+            return None
+        try:
+            return self.cache.get(image_path, methods)
+        except Exception:
+            return None     # 文件不存在等情况交由解码流程报告
+
+    def _resize_target(self, method):
+        """各哈希算法最终缩放到的边长"""
+        if method == 'phash':
+            return self.hash_size * self.highfreq_factor
+        return self.hash_size + 1 if method == 'dhash' else self.hash_size
+
+    def _load_gray(self, img):
+        """
+        解码并灰度化；fast_decode 时先让解码器按最小够用尺寸解码，
+        再整数倍缩小为各哈希共用的中间图像（尺寸按全部哈希算法确定，保证单独计算与批量计算结果一致）
+        """
+        if not self.fast_decode:
+            return img.convert('L')
+
+        min_size = max(self._resize_target(method) for method in HASH_METHODS) * self.DECODE_OVERSAMPLE
+        img.draft('L', (min_size, min_size))    # JPEG: DCT 域缩放解码
+        gray = img.convert('L')
+        factor = min(gray.size) // min_size
+        return gray.reduce(factor) if factor > 1 else gray
+
     def _compute_hash(self, image):
         """根据配置的算法计算哈希"""
-        if self.method == 'phash':      # 感知哈希
-            return str(imagehash.phash(image, self.hash_size, self.highfreq_factor))
-        elif self.method == 'ahash':    # 平均哈希
-            return str(imagehash.average_hash(image, self.hash_size))
-        elif self.method == 'dhash':    # 差异哈希
-            return str(imagehash.dhash(image, self.hash_size))
+        return self._hash_gray(image.convert('L'), self.method)
+
+    def _hash_gray(self, gray, method):
+        """由灰度图计算哈希，结果与 imagehash 对应算法逐位一致"""
+        if method == 'phash':      # 感知哈希
+            import scipy.fftpack
+            img_size = self.hash_size * self.highfreq_factor
+            pixels = np.asarray(gray.resize((img_size, img_size), Image.LANCZOS))
+            dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=0), axis=1)
+            low_freq = dct[:self.hash_size, :self.hash_size]
+            bits = low_freq > np.median(low_freq)
+        elif method == 'ahash':    # 平均哈希
+            pixels = np.asarray(gray.resize((self.hash_size, self.hash_size), Image.LANCZOS))
+            bits = pixels > pixels.mean()
+        elif method == 'dhash':    # 差异哈希
+            pixels = np.asarray(gray.resize((self.hash_size + 1, self.hash_size), Image.LANCZOS))
+            bits = pixels[:, 1:] > pixels[:, :-1]
+        else:
+            raise ValueError(f"Unsupported hash method: {method}")
+        return ImageHasher.bits_to_hex(bits)
+
+    def phash_thumbnail(self, image):
+        """pHash 输入缩略图：灰度化并缩放到 (hash_size × highfreq_factor) 见方"""
+        img_size = self.hash_size * self.highfreq_factor
+        return np.asarray(image.convert('L').resize((img_size, img_size), Image.LANCZOS))
+
+    def phash_batch(self, thumbnails):
+        """
+        批量 pHash：N 张缩略图堆叠为一个数组，DCT、中位数与打包位一次完成，
+        结果与逐张 _compute_hash 逐位一致
+        :param thumbnails: 形状 (N, S, S) 的数组，或 PIL 图像 / 二维数组的序列
+        :return: 十六进制哈希列表
+        """
+        import scipy.fftpack
+        img_size = self.hash_size * self.highfreq_factor
+        if isinstance(thumbnails, np.ndarray):
+            pixels = thumbnails
         else:
-            raise ValueError(f"Unsupported hash method: {self.method}")
+            pixels = np.stack([self.phash_thumbnail(t) if isinstance(t, Image.Image) else np.asarray(t)
+                               for t in thumbnails])
+        if pixels.ndim != 3 or pixels.shape[1:] != (img_size, img_size):
+            raise ValueError(f"Thumbnails must be {img_size}x{img_size} grayscale images")
+
+        dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=1), axis=2)
+        low_freq = dct[:, :self.hash_size, :self.hash_size].reshape(len(pixels), -1)
+        bits = low_freq > np.median(low_freq, axis=1, keepdims=True)
+        return ImageHasher.pack_hex(bits)
+
+    @staticmethod
+    def pack_hex(bits):
+        """批量将 (N, n_bits) 布尔数组打包为十六进制字符串列表"""
+        n_bits = bits.shape[1]
+        padding = -n_bits % 8
+        width = -(-n_bits // 4)
+        packed = np.packbits(bits, axis=1)
+        if padding == 0 and width == 2 * packed.shape[1]:
+            return [row.tobytes().hex() for row in packed]
+        return [f"{int.from_bytes(row.tobytes(), 'big') >> padding:0{width}x}" for row in packed]
+
+    @staticmethod
+    def bits_to_hex(bits):
+        """布尔位数组（行优先）转十六进制字符串，格式同 str(ImageHash)"""
+        bits = np.asarray(bits, dtype=bool).ravel()
+        padding = -len(bits) % 8
+        value = int.from_bytes(np.packbits(bits).tobytes(), 'big') >> padding
+        return f"{value:0{-(-len(bits) // 4)}x}"
+
+    @staticmethod
+    def content_digest(image_path, chunk_size=1 << 20):
+        """
+        分块流式计算内容摘要（BLAKE2b-256），用于字节级完全重复的快速判断
+        :param image_path: 文件路径、bytes 或可读的文件对象
+        """
+        digest = hashlib.blake2b(digest_size=32)
+        size = 0
+        with metrics.timer('digest'):
+            if isinstance(image_path, (bytes, bytearray, memoryview)):
+                digest.update(image_path)
+                size = len(image_path)
+            elif _is_path(image_path):
+                with open(image_path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(chunk_size), b''):
+                        digest.update(chunk)
+                        size += len(chunk)
+            else:
+                for chunk in iter(lambda: image_path.read(chunk_size), b''):
+                    digest.update(chunk)
+                    size += len(chunk)
+                if image_path.seekable():
+                    image_path.seek(0)  # 便于随后继续解码同一文件对象
+        metrics.inc('dedup_bytes_total', size, kind='digest')
+        return digest.hexdigest()
+
+    @staticmethod
+    def words_for_bits(bits):
+        """容纳指定位数所需的 uint64 字数"""
+        return max(1, -(-bits // WORD_BITS))
+
+    @staticmethod
+    def hash_to_words(hash_value, n_words=None):
+        """
+        将十六进制哈希（或整数）转换为大端序的 uint64 字数组
+        :param hash_value: 十六进制字符串 / int
+        :param n_words: 字数，默认按十六进制长度推断
+        """
+        if isinstance(hash_value, str):
+            if n_words is None:
+                n_words = ImageHasher.words_for_bits(len(hash_value) * 4)
+            hash_value = int(hash_value, 16)
+        elif n_words is None:
+            n_words = ImageHasher.words_for_bits(hash_value.bit_length())
+
+        return np.array([(hash_value >> (WORD_BITS * (n_words - 1 - i))) & WORD_MASK
+                         for i in range(n_words)], dtype=np.uint64)
 
     @staticmethod
     def hamming_distance(hash1, hash2):
@@ -41,17 +445,26 @@ class ImageHasher:
         if len(hash1) != len(hash2):
             raise ValueError("Hashes must be of same length")
 
-        # 十六进制转二进制
-        bin1 = bin(int(hash1, 16))[2:].zfill(64)
-        bin2 = bin(int(hash2, 16))[2:].zfill(64)
+        return (int(hash1, 16) ^ int(hash2, 16)).bit_count()
+
+    @staticmethod
+    def hamming_distances(query, matrix):
+        """
+        批量计算一个查询指纹到所有指纹的汉明距离（XOR + popcount）
+        :param query: 查询指纹，形状 (n_words,) 的 uint64 数组
+        :param matrix: 指纹矩阵，形状 (n, n_words) 的 uint64 数组
+        :return: 形状 (n,) 的距离数组
+        """
+        query = np.asarray(query, dtype=np.uint64)
+        matrix = np.asarray(matrix, dtype=np.uint64)
+        if matrix.ndim == 1:
+            matrix = matrix[:, None]
+        if matrix.shape[1] != query.shape[-1]:
+            raise ValueError("Hashes must be of same length")
 
-        return sum(c1 != c2 for c1, c2 in zip(bin1, bin2))
+        return popcount(np.bitwise_xor(matrix, query)).sum(axis=1, dtype=np.int64)
 
     @staticmethod
     def multi_hash(image_path, methods=('phash', 'ahash')):
         """计算多种哈希组合"""
-        with Image.open(image_path) as img:
-            return {
-                method: str(getattr(imagehash, method)(img))
-                for method in methods
-            }
+        return ImageHasher().compute_all(image_path, methods)
@@ -0,0 +1,119 @@
+import json
+import time
+
+from deduplicator.clustering import UnionFind
+from deduplicator.fingerprints import HASH_TYPES
+from deduplicator.metrics import metrics
+
+
+class IncrementalScanReport:
+    """增量重复扫描统计"""
+
+    def __init__(self, watermark):
+        self.start_watermark = watermark
+        self.watermark = watermark
+        self.rebuilt = False        # 参数变化或 restart，已清空重复组从头扫描
+        self.scanned = 0
+        self.edges = 0
+        self.groups_touched = set()     # 本次新建或合并后的组ID
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def as_dict(self):
+        return {
+            'start_watermark': self.start_watermark,
+            'watermark': self.watermark,
+            'rebuilt': self.rebuilt,
+            'scanned': self.scanned,
+            'edges': self.edges,
+            'groups_touched': len(self.groups_touched),
+            'elapsed': self.elapsed,
+        }
+
+
+class IncrementalDuplicateScan:
+    """
+    增量重复扫描：重复组持久化在 duplicate_members 表，断点记录已扫描的最大记录ID。
+    每次只对断点之后新增的记录逐条查询指纹索引（索引包含全部记录，新记录之间的相似也会被找到），
+    得到的相似边与已有的组合并；每批合并结果与断点在同一事务内提交，中断后可继续。
+    阈值或级联策略变化时已有的组不再适用，自动清空后从头扫描。
+    """
+
+    CHECKPOINT = 'duplicate_scan'
+
+    def __init__(self, db, index, threshold, batch_size=1000):
+        self.db = db
+        self.index = index
+        self.threshold = threshold
+        self.batch_size = batch_size
+
+    def _params(self):
+        cascade = getattr(self.index, 'cascade', None)
+        params = {'threshold': self.threshold, 'hash_bits': self.db.hash_bits, 'cascade': None}
+        if cascade is not None:
+            params['cascade'] = {'policy': cascade.policy, 'stages': list(cascade.stages),
+                                 'weights': cascade.weights, 'quorum': cascade.quorum,
+                                 'prefilter_factor': cascade.prefilter_factor}
+        return params
+
+    def run(self, restart=False):
+        """
+        扫描断点之后的新记录并合并到已持久化的重复组
+        :param restart: 清空已有的组，从头扫描
+        """
+        params = self._params()
+        state = json.loads(self.db.get_checkpoint(self.CHECKPOINT) or '{}')
+        rebuild = restart or state.get('params') != params
+        report = IncrementalScanReport(0 if rebuild else state.get('watermark', 0))
+        if rebuild:
+            self.db.reset_duplicate_groups()
+            report.rebuilt = True
+
+        # 只扫描索引已包含的记录，保证新记录之间的比较不遗漏
+        upper = self.db.sync_indexes()
+        batch = []
+        for row in self.db.iter_images(self.batch_size, after_id=report.watermark):
+            if row[0] > upper:
+                break
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                self._scan_batch(batch, params, report)
+                batch = []
+        if batch or rebuild:
+            self._scan_batch(batch, params, report)
+
+        report.elapsed = time.perf_counter() - report.started
+        return report
+
+    def _scan_batch(self, rows, params, report):
+        edges = []
+        with metrics.timer('incremental_scan'):
+            for row_id, _, *values in rows:
+                hashes = dict(zip(HASH_TYPES, values))
+                edges.extend((row_id, item_id) for item_id, _, _ in self.index.search(hashes, self.threshold)
+                             if item_id != row_id)
+        metrics.inc('dedup_rows_scanned_total', len(rows), source='incremental_scan')
+
+        # 已在组内的记录以组ID参与合并，组ID为组内最小的记录ID
+        nodes = {i for edge in edges for i in edge}
+        groups = self.db.duplicate_groups_for(nodes)
+        uf = UnionFind()
+        for a, b in edges:
+            uf.union(groups.get(a, a), groups.get(b, b))
+
+        components = {}
+        for node in nodes:
+            components.setdefault(uf.find(groups.get(node, node)), set()).add(node)
+        merges = []
+        for members in components.values():
+            absorbed = {groups[m] for m in members if m in groups}
+            group_id = min(members | absorbed)
+            merges.append((group_id, sorted(absorbed), sorted(members)))
+            report.groups_touched.add(group_id)
+
+        if rows:
+            report.watermark = rows[-1][0]
+        report.scanned += len(rows)
+        report.edges += len(edges)
+        self.db.merge_duplicate_groups(
+            merges, (self.CHECKPOINT, json.dumps({'watermark': report.watermark, 'params': params})))
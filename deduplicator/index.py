@@ -0,0 +1,365 @@
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from itertools import combinations
+
+import numpy as np
+
+from deduplicator.fingerprints import HASH_TYPES, MISSING_DISTANCE
+from deduplicator.hashing import ImageHasher, popcount
+from deduplicator.metrics import metrics
+
+
+class HammingIndex(ABC):
+    """汉明空间索引抽象类（单一哈希类型，指纹以整数表示）"""
+
+    def __init__(self, hash_bits=64):
+        self.hash_bits = hash_bits
+        self.queries = 0
+        self.candidates_examined = 0    # 累计计算过距离的候选数
+        self.last_candidates = 0        # 最近一次查询的候选数
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    @abstractmethod
+    def add(self, item_id, value):
+        pass
+
+    @abstractmethod
+    def _search(self, value, threshold):
+        """返回 ([(item_id, dist), ...], 候选数)"""
+        pass
+
+    def range_query(self, value, threshold):
+        """查询汉明距离不超过 threshold 的所有记录，按距离排序"""
+        if isinstance(value, str):
+            value = int(value, 16)
+        results, examined = self._search(value, threshold)
+        self.queries += 1
+        self.candidates_examined += examined
+        self.last_candidates = examined
+        metrics.inc('dedup_candidates_compared_total', examined, index=type(self).__name__)
+        return sorted(results, key=lambda x: x[1])
+
+    def range_query_many(self, values, threshold):
+        """多个查询指纹（如同一图像的各方向哈希）的范围查询，每条记录取最小距离，按距离排序"""
+        values = [int(v, 16) if isinstance(v, str) else v for v in values]
+        results, examined = self._search_many(values, threshold)
+        self.queries += 1
+        self.candidates_examined += examined
+        self.last_candidates = examined
+        metrics.inc('dedup_candidates_compared_total', examined, index=type(self).__name__)
+        return sorted(results, key=lambda x: x[1])
+
+    def _search_many(self, values, threshold):
+        """默认逐个查询后合并"""
+        best, examined = {}, 0
+        for value in values:
+            results, count = self._search(value, threshold)
+            examined += count
+            for item_id, dist in results:
+                if dist < best.get(item_id, dist + 1):
+                    best[item_id] = dist
+        return list(best.items()), examined
+
+    def distances(self, value, item_ids, threshold):
+        """
+        指定记录到查询指纹的汉明距离（级联校验用），不存在的记录为 MISSING_DISTANCE
+        默认基于范围查询实现，距离超过 threshold 的记录同样返回 MISSING_DISTANCE
+        """
+        if isinstance(value, str):
+            value = int(value, 16)
+        found = dict(self._search(value, threshold)[0])
+        return np.array([found.get(item_id, MISSING_DISTANCE) for item_id in item_ids.tolist()], dtype=np.int64)
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'queries': self.queries,
+            'candidates_examined': self.candidates_examined,
+            'last_candidates': self.last_candidates,
+        }
+
+
+class LinearIndex(HammingIndex):
+    """线性扫描索引（向量化 XOR + popcount），作为基准实现"""
+
+    def __init__(self, hash_bits=64):
+        super().__init__(hash_bits)
+        self.n_words = ImageHasher.words_for_bits(hash_bits)
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._words = np.zeros((0, self.n_words), dtype=np.uint64)
+        self._size = 0
+        self._ascending = True  # 记录ID是否按递增顺序追加（可直接二分查找位置）
+        self._order = None      # 非递增时按ID排序的位置缓存，追加后失效
+
+    def __len__(self):
+        return self._size
+
+    def add(self, item_id, value):
+        if isinstance(value, str):
+            value = int(value, 16)
+        if self._size and item_id <= self._ids[self._size - 1]:
+            self._ascending = False
+        self._order = None
+        if self._size == len(self._ids):    # 容量翻倍，均摊 O(1) 追加
+            capacity = max(16, 2 * len(self._ids))
+            self._ids = np.resize(self._ids, capacity)
+            self._words = np.resize(self._words, (capacity, self.n_words))
+        self._ids[self._size] = item_id
+        self._words[self._size] = ImageHasher.hash_to_words(value, self.n_words)
+        self._size += 1
+
+    def _search(self, value, threshold):
+        query = ImageHasher.hash_to_words(value, self.n_words)
+        distances = ImageHasher.hamming_distances(query, self._words[:self._size])
+        matched = np.flatnonzero(distances <= threshold)
+        return [(int(self._ids[i]), int(distances[i])) for i in matched], self._size
+
+    def _search_many(self, values, threshold):
+        """全部查询指纹与全部记录一次向量化比较（查询数 × 记录数），取最小距离"""
+        return self._match_positions(values, np.arange(self._size), threshold), self._size
+
+    def _match_positions(self, values, positions, threshold):
+        queries = np.stack([ImageHasher.hash_to_words(v, self.n_words) for v in values])
+        xor = np.bitwise_xor(self._words[positions][None, :, :], queries[:, None, :])
+        distances = popcount(xor).sum(axis=2, dtype=np.int64).min(axis=0)
+        matched = distances <= threshold
+        return [(int(item_id), int(dist))
+                for item_id, dist in zip(self._ids[positions[matched]], distances[matched])]
+
+    def _positions(self, item_ids):
+        """记录ID → 存储位置，返回 (位置, 是否存在)"""
+        ids = self._ids[:self._size]
+        if self._ascending:
+            order, sorted_ids = None, ids
+        else:
+            if self._order is None:
+                self._order = np.argsort(ids, kind='stable')
+            order, sorted_ids = self._order, ids[self._order]
+        positions = np.minimum(np.searchsorted(sorted_ids, item_ids), max(self._size - 1, 0))
+        found = sorted_ids[positions] == item_ids if self._size else np.zeros(len(item_ids), dtype=bool)
+        return (positions if order is None else order[positions]), found
+
+    def distances(self, value, item_ids, threshold):
+        """按位置直接计算指定记录的距离（向量化），不存在的记录为 MISSING_DISTANCE"""
+        if isinstance(value, str):
+            value = int(value, 16)
+        positions, found = self._positions(np.asarray(item_ids, dtype=np.int64))
+        query = ImageHasher.hash_to_words(value, self.n_words)
+        distances = ImageHasher.hamming_distances(query, self._words[positions])
+        return np.where(found, distances, MISSING_DISTANCE)
+
+
+class BKTreeIndex(HammingIndex):
+    """BK树索引：利用三角不等式剪枝"""
+
+    def __init__(self, hash_bits=64):
+        super().__init__(hash_bits)
+        self._root = None   # 节点: [指纹, [记录ID], {距离: 子节点}]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, item_id, value):
+        if isinstance(value, str):
+            value = int(value, 16)
+        self._size += 1
+        if self._root is None:
+            self._root = [value, [item_id], {}]
+            return
+
+        node = self._root
+        while True:
+            dist = (node[0] ^ value).bit_count()
+            if dist == 0:
+                node[1].append(item_id)
+                return
+            child = node[2].get(dist)
+            if child is None:
+                node[2][dist] = [value, [item_id], {}]
+                return
+            node = child
+
+    def _search(self, value, threshold):
+        results, examined = [], 0
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            examined += 1
+            dist = (node[0] ^ value).bit_count()
+            if dist <= threshold:
+                results.extend((item_id, dist) for item_id in node[1])
+            for child_dist, child in node[2].items():
+                if dist - threshold <= child_dist <= dist + threshold:
+                    stack.append(child)
+        return results, examined
+
+
+@lru_cache(maxsize=1 << 16)
+def _substring_neighbors(key, radius, bits):
+    """与 key 汉明距离不超过 radius 的所有子串取值（枚举翻转位组合，子串较宽时不遍历全部取值）"""
+    neighbors = [key]
+    for r in range(1, radius + 1):
+        for flipped in combinations(range(bits), r):
+            neighbors.append(key ^ sum(1 << b for b in flipped))
+    return tuple(neighbors)
+
+
+class MultiIndexHashing(LinearIndex):
+    """
+    多索引哈希（鸽巢原理）：指纹切分为 m 个 substring_bits 位子串，每个子串一张哈希表。
+    距离不超过 T 时至少有一个子串距离不超过 T // m，只需在各子串表中查找近邻桶，再校验候选。
+    """
+
+    def __init__(self, hash_bits=64, substring_bits=8):
+        super().__init__(hash_bits)
+        self.substring_bits = substring_bits
+        self.n_substrings = -(-hash_bits // substring_bits)
+        self._mask = (1 << substring_bits) - 1
+        self._tables = [{} for _ in range(self.n_substrings)]   # 子串取值 -> 记录位置列表
+        self._frozen = [{} for _ in range(self.n_substrings)]   # 桶的 numpy 缓存，桶变更后失效
+
+    def _substrings(self, value):
+        return [(value >> (self.substring_bits * j)) & self._mask for j in range(self.n_substrings)]
+
+    def add(self, item_id, value):
+        if isinstance(value, str):
+            value = int(value, 16)
+        position = self._size
+        super().add(item_id, value)
+        for table, frozen, key in zip(self._tables, self._frozen, self._substrings(value)):
+            table.setdefault(key, []).append(position)
+            frozen.pop(key, None)
+
+    def _bucket(self, j, key):
+        frozen = self._frozen[j]
+        bucket = frozen.get(key)
+        if bucket is None:
+            bucket = frozen[key] = np.array(self._tables[j].get(key, ()), dtype=np.int64)
+        return bucket
+
+    def _candidates(self, value, threshold):
+        """各子串近邻桶中的候选位置"""
+        radius = threshold // self.n_substrings
+        buckets = [self._bucket(j, neighbor)
+                   for j, key in enumerate(self._substrings(value))
+                   for neighbor in _substring_neighbors(key, radius, self.substring_bits)]
+        positions, hits = np.unique(np.concatenate(buckets), return_counts=True)
+
+        # 子串精确匹配时，距离 ≤ T 的记录至少有 m - T 个子串完全相同
+        min_hits = self.n_substrings - threshold if radius == 0 else 1
+        return positions[hits >= min_hits]
+
+    def _search_many(self, values, threshold):
+        """各查询指纹的候选合并后一次向量化校验"""
+        positions = np.unique(np.concatenate([self._candidates(v, threshold) for v in values]))
+        if not len(positions):
+            return [], 0
+        return self._match_positions(values, positions, threshold), len(positions)
+
+    def _search(self, value, threshold):
+        positions = self._candidates(value, threshold)
+
+        query = ImageHasher.hash_to_words(value, self.n_words)
+        distances = ImageHasher.hamming_distances(query, self._words[positions])
+        matched = distances <= threshold
+        results = [(int(item_id), int(dist))
+                   for item_id, dist in zip(self._ids[positions[matched]], distances[matched])]
+        return results, len(positions)
+
+
+INDEX_TYPES = {
+    'linear': LinearIndex,
+    'bktree': BKTreeIndex,
+    'mih': MultiIndexHashing,
+}
+
+
+class FingerprintIndex:
+    """多哈希类型指纹索引：由 images 表构建，并通过 DatabaseManager.add_image 保持同步"""
+
+    def __init__(self, index_type='mih', hash_types=HASH_TYPES, hash_bits=64, cascade=None):
+        """
+        :param cascade: MatchCascade 级联匹配策略，为空时任一种哈希在阈值内即命中
+        """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type: {index_type}")
+        self.index_type = index_type
+        self.hash_bits = hash_bits
+        self.cascade = cascade
+        self.indexes = {hash_type: INDEX_TYPES[index_type](hash_bits) for hash_type in hash_types}
+        self.paths = {}
+        self.last_id = 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, item_id, storage_path, hashes):
+        """添加一条记录，hashes 为 {哈希类型: 十六进制哈希}"""
+        self.paths[item_id] = storage_path
+        self.last_id = max(self.last_id, item_id)
+        for hash_type, index in self.indexes.items():
+            if hashes.get(hash_type) is not None:
+                index.add(item_id, hashes[hash_type])
+
+    def load(self, rows):
+        """从 (id, storage_path, phash, ahash, dhash) 记录批量构建"""
+        for item_id, storage_path, *values in rows:
+            self.add(item_id, storage_path, dict(zip(HASH_TYPES, values)))
+
+    def search(self, hashes, threshold=5):
+        """
+        查找相似记录：配置了级联策略时按级联匹配，否则多种哈希分别查询、任一种相似即命中
+        :return: [(item_id, storage_path, 最小距离)]，按距离排序
+        """
+        with metrics.timer('index_search'):
+            if hashes.get('variants'):
+                return self.search_variants(hashes['variants'], threshold)
+            if self.cascade is not None:
+                return self.cascade.search(self, hashes, threshold)
+            return self.search_any(hashes, threshold)
+
+    def search_variants(self, variants, threshold=5):
+        """
+        方向不变查询：variants 为 {哈希类型: [各方向哈希]}，任一方向相似即命中
+        无级联策略时每种哈希的全部方向在索引中一次向量化比较；有级联策略时逐方向级联匹配后合并
+        """
+        best = {}
+        if self.cascade is not None:
+            n = max(len(values) for values in variants.values())
+            for k in range(n):
+                oriented = {t: values[k] for t, values in variants.items() if k < len(values)}
+                for item_id, _, dist in self.cascade.search(self, oriented, threshold):
+                    if dist < best.get(item_id, dist + 1):
+                        best[item_id] = dist
+        else:
+            for hash_type, values in variants.items():
+                values = [v for v in values if v is not None]
+                if not values or hash_type not in self.indexes:
+                    continue
+                for item_id, dist in self.indexes[hash_type].range_query_many(values, threshold):
+                    if dist < best.get(item_id, dist + 1):
+                        best[item_id] = dist
+        return sorted(((item_id, self.paths[item_id], dist) for item_id, dist in best.items()),
+                      key=lambda x: x[2])
+
+    def search_any(self, hashes, threshold=5):
+        """多种哈希分别查询，任一种相似即命中"""
+        best = {}
+        for hash_type, value in hashes.items():
+            if value is None or hash_type not in self.indexes:
+                continue
+            for item_id, dist in self.indexes[hash_type].range_query(value, threshold):
+                if dist < best.get(item_id, dist + 1):
+                    best[item_id] = dist
+        return sorted(((item_id, self.paths[item_id], dist) for item_id, dist in best.items()),
+                      key=lambda x: x[2])
+
+    def stats(self):
+        stats = {hash_type: index.stats() for hash_type, index in self.indexes.items()}
+        if self.cascade is not None:
+            stats['cascade'] = self.cascade.stats()
+        return stats
@@ -0,0 +1,215 @@
+import logging
+import os
+import time
+from collections import namedtuple
+from functools import partial
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+from .hashing import ImageHasher
+from .index import FingerprintIndex
+
+logger = logging.getLogger(__name__)
+
+# 单个文件的入库结果，message 与 upload_image 的返回信息一致
+IngestResult = namedtuple('IngestResult', ['local_path', 'remote_path', 'message'])
+
+
+class IngestReport:
+    """批量入库报告：逐文件结果与整体吞吐量"""
+
+    def __init__(self):
+        self.results = []
+        self.bytes_uploaded = 0
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    def add(self, local_path, remote_path, message):
+        self.results.append(IngestResult(local_path, remote_path, message))
+
+    def finish(self):
+        self.elapsed = time.perf_counter() - self.started
+        return self
+
+    @property
+    def counts(self):
+        counts = {}
+        for result in self.results:
+            counts[result.message] = counts.get(result.message, 0) + 1
+        return counts
+
+    @property
+    def files_per_sec(self):
+        return len(self.results) / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes_uploaded / self.elapsed if self.elapsed else 0.0
+
+    def summary(self):
+        return {
+            'files': len(self.results),
+            'counts': self.counts,
+            'elapsed': self.elapsed,
+            'files_per_sec': self.files_per_sec,
+            'bytes_per_sec': self.bytes_per_sec,
+        }
+
+
+def iter_image_paths(source):
+    """目录递归展开为文件路径（按路径排序），否则原样迭代"""
+    if isinstance(source, (str, os.PathLike)) and os.path.isdir(source):
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                yield os.path.join(root, name)
+    else:
+        yield from source
+
+
+def _timed_compute_all(hasher, path):
+    """解码并计算全部哈希，同时返回耗时（在哈希进程中执行）"""
+    start = time.perf_counter()
+    hashes = hasher.compute_all(path)
+    return hashes, time.perf_counter() - start
+
+
+def _safe_digest(path):
+    try:
+        return ImageHasher.content_digest(path)
+    except OSError:
+        return None
+
+
+class BulkIngest:
+    """
+    批量入库流水线：进程池计算哈希 → 查重（含同批次内查重）→ 线程池上传 → 批量事务写库
+    """
+
+    def __init__(self, deduplicator, remote_folder="images/", threshold=5,
+                 hash_workers=None, upload_workers=8, batch_size=100):
+        """
+        :param hash_workers: 哈希进程数，默认 CPU 数；0 表示在当前进程内计算
+        :param upload_workers: 并发上传线程数
+        :param batch_size: 每个数据库事务写入的记录数
+        """
+        self.dedup = deduplicator
+        self.remote_folder = remote_folder
+        self.threshold = threshold
+        self.hash_workers = hash_workers
+        self.upload_workers = upload_workers
+        self.batch_size = batch_size
+
+        # 本次已接受但可能尚未入库的指纹，用于同批次内查重
+        self._pending = FingerprintIndex('linear', hash_bits=deduplicator.hasher.hash_bits,
+                                         cascade=getattr(deduplicator.index, 'cascade', None))
+        self._failed = set()
+        self._remote_paths = set()
+        self._digests = set()
+        self._rows = []
+
+    def run(self, source):
+        report = IngestReport()
+        paths = list(iter_image_paths(source))
+
+        with ThreadPoolExecutor(max_workers=self.upload_workers) as uploader:
+            inflight = {}
+            for local_path, hashes, message in self._iter_hashes(paths):
+                self.dedup.stats.checks += 1
+                if message:
+                    report.add(local_path, None, message)
+                    continue
+                remote_path = self._admit(local_path, hashes, report)
+                if remote_path is None:
+                    continue
+
+                future = uploader.submit(self.dedup.storage.upload, local_path, remote_path)
+                inflight[future] = (len(self._pending) - 1, local_path, remote_path, hashes)
+                if len(inflight) >= 2 * self.upload_workers:   # 限制在途上传数
+                    done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                    self._collect(done, inflight, report)
+
+            self._collect(inflight, inflight, report)
+        self._flush(report)
+        return report.finish()
+
+    def _iter_hashes(self, paths):
+        """先按内容摘要批量过滤完全重复的文件，其余文件再解码计算哈希"""
+        compute_all = partial(_timed_compute_all, self.dedup.hasher)
+        with ThreadPoolExecutor(max_workers=self.upload_workers) as reader:
+            digests = dict(zip(paths, reader.map(_safe_digest, paths)))
+        existing = self.dedup.db.find_by_digests([d for d in digests.values() if d])
+
+        to_hash = []
+        for path in paths:
+            digest = digests[path]
+            if digest and (digest in existing or digest in self._digests):
+                self.dedup.stats.exact_hits += 1
+                yield path, None, "Duplicate image"
+            else:
+                self._digests.add(digest)
+                to_hash.append(path)
+
+        if self.hash_workers == 0:
+            results = map(compute_all, to_hash)
+            yield from self._with_digests(to_hash, results, digests)
+            return
+        with ProcessPoolExecutor(max_workers=self.hash_workers) as executor:
+            results = executor.map(compute_all, to_hash, chunksize=8)
+            yield from self._with_digests(to_hash, results, digests)
+
+    def _with_digests(self, paths, results, digests):
+        for path, (hashes, elapsed) in zip(paths, results):
+            self.dedup.stats.decodes += 1
+            self.dedup.stats.decode_time += elapsed
+            if hashes and digests[path]:
+                hashes['digest'] = digests[path]
+            yield path, hashes, None
+
+    def _admit(self, local_path, hashes, report):
+        """查重并登记待上传文件，返回远程路径；不通过时记录结果并返回 None"""
+        remote_path = f"{self.remote_folder}{os.path.basename(local_path)}"
+        if not hashes:
+            report.add(local_path, None, "Hash failed")
+        elif self.dedup.index.search(hashes, self.threshold) or self.dedup.partial_matches(hashes) or any(
+                item_id not in self._failed for item_id, _, _ in self._pending.search(hashes, self.threshold)):
+            report.add(local_path, None, "Duplicate image")
+        elif remote_path in self._remote_paths or self.dedup.db.has_image(remote_path):
+            report.add(local_path, remote_path, "Path exists")
+        else:
+            self._pending.add(len(self._pending), remote_path, hashes)
+            self._remote_paths.add(remote_path)
+            return remote_path
+        return None
+
+    def _collect(self, done, inflight, report):
+        for future in list(done):
+            pending_id, local_path, remote_path, hashes = inflight.pop(future)
+            try:
+                uploaded = future.result()
+            except Exception as e:
+                logger.error("Upload failed for %s: %s", local_path, e)
+                uploaded = False
+            if not uploaded:
+                self._failed.add(pending_id)
+                report.add(local_path, remote_path, "Upload failed")
+                continue
+
+            report.bytes_uploaded += os.path.getsize(local_path)
+            self._rows.append((local_path, remote_path, hashes))
+            if len(self._rows) >= self.batch_size:
+                self._flush(report)
+
+    def _flush(self, report):
+        """批量事务写库（事务内复查其他进程 / 线程同时写入的相似记录），被拒绝的回滚上传"""
+        if not self._rows:
+            return
+        rows, self._rows = self._rows, []
+        results = self.dedup.db.add_images_checked([(remote_path, hashes, self.threshold)
+                                                    for _, remote_path, hashes in rows])
+        for (row_id, reason), (local_path, remote_path, _) in zip(results, rows):
+            if row_id is None:
+                if reason != "Path exists":     # 路径已被其他记录占用时，对象属于该记录，不能删除
+                    self.dedup.storage.delete(remote_path)
+                report.add(local_path, None, reason)
+            else:
+                report.add(local_path, remote_path, "Success")
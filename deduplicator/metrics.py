@@ -0,0 +1,286 @@
+import cProfile
+import io
+import json
+import logging
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from functools import wraps
+
+# 延迟直方图桶上界（秒）
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """累积分桶直方图（Prometheus 语义），记录次数、总和与各桶计数"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)     # 最后一个为 +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """按桶上界估算分位数"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return float('inf')
+
+
+class _NullTimer:
+    """关闭时使用的空计时器，避免任何计时开销"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ('registry', 'stage', 'start')
+
+    def __init__(self, registry, stage):
+        self.registry = registry
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.registry.observe(self.stage, time.perf_counter() - self.start)
+        if exc_type is not None:
+            self.registry.inc('dedup_errors_total', stage=self.stage)
+        return False
+
+
+class MetricsRegistry:
+    """
+    进程内指标注册表：各阶段延迟直方图（dedup_stage_seconds{stage=...}）与带标签的计数器。
+    关闭时 timer() 返回空计时器、inc() / observe() 直接返回，开销仅为一次属性判断。
+    """
+
+    def __init__(self, enabled=False, buckets=DEFAULT_BUCKETS):
+        self.enabled = enabled
+        self.buckets = buckets
+        self._histograms = {}
+        self._counters = Counter()
+        self._lock = threading.Lock()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def timer(self, stage):
+        """with metrics.timer('decode'): ... 记录该阶段耗时，异常时计入 dedup_errors_total"""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, stage)
+
+    def timed(self, stage):
+        """函数装饰器版 timer"""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                with _Timer(self, stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def observe(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    def inc(self, name, value=1, **labels):
+        """计数器累加，如 inc('dedup_bytes_total', n, kind='upload')"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] += value
+
+    def snapshot(self):
+        """JSON 快照：各阶段次数、总耗时、估算分位数与桶计数，以及全部计数器"""
+        with self._lock:
+            stages = {stage: {
+                'count': h.count,
+                'sum_s': h.sum,
+                'p50_s': h.quantile(0.5),
+                'p90_s': h.quantile(0.9),
+                'p99_s': h.quantile(0.99),
+                'buckets': dict(zip([str(b) for b in h.buckets] + ['+Inf'], h.counts)),
+            } for stage, h in self._histograms.items()}
+            counters = [{'name': name, 'labels': dict(labels), 'value': value}
+                        for (name, labels), value in sorted(self._counters.items())]
+        return {'enabled': self.enabled, 'stages': stages, 'counters': counters}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False)
+
+    def to_prometheus(self):
+        """Prometheus 文本格式"""
+        lines = []
+        with self._lock:
+            if self._histograms:
+                lines.append('# TYPE dedup_stage_seconds histogram')
+            for stage, h in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip([str(b) for b in h.buckets] + ['+Inf'], h.counts):
+                    cumulative += count
+                    lines.append(f'dedup_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'dedup_stage_seconds_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'dedup_stage_seconds_count{{stage="{stage}"}} {h.count}')
+
+            declared = set()
+            for (name, labels), value in sorted(self._counters.items()):
+                if name not in declared:
+                    lines.append(f'# TYPE {name} counter')
+                    declared.add(name)
+                label_text = ','.join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f'{name}{{{label_text}}} {value}' if label_text else f'{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+# 全局注册表，默认关闭（Config.METRICS_ENABLED 控制）
+metrics = MetricsRegistry()
+
+
+@contextmanager
+def profiled(output=None, sort='cumulative', limit=30):
+    """
+    cProfile 剖析代码块；output 为空时把耗时最多的 limit 项写入日志，否则保存 .prof 文件
+    """
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        if output:
+            profiler.dump_stats(output)
+        else:
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats(sort).print_stats(limit)
+            logging.getLogger(__name__).info("profile:\n%s", stream.getvalue())
+
+
+class SamplingProfiler:
+    """
+    采样剖析：后台线程按 interval 秒采集其他线程的调用栈，统计最内层函数与完整栈的出现次数，
+    开销与调用次数无关，适合在服务中长时间开启
+    """
+
+    def __init__(self, interval=0.005, max_depth=20):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.functions = Counter()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+        return False
+
+    def _run(self):
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    self.samples += 1
+                    self.functions[stack[0]] += 1
+                    self.stacks[' <- '.join(stack)] += 1
+
+    def report(self, limit=20):
+        return {
+            'samples': self.samples,
+            'interval_s': self.interval,
+            'top_functions': [{'frame': frame, 'samples': n, 'share': n / self.samples}
+                              for frame, n in self.functions.most_common(limit)],
+        }
+
+
+class JsonFormatter(logging.Formatter):
+    """结构化日志：每条记录输出一行 JSON，extra 中的字段一并输出"""
+
+    _RESERVED = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in self._RESERVED})
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def configure_logging(level='INFO', json_format=False):
+    """配置 deduplicator 包的日志输出（json_format 时为每行一条 JSON）"""
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter() if json_format else
+                         logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger = logging.getLogger('deduplicator')
+    logger.handlers[:] = [handler]
+    logger.setLevel(level)
+    logger.propagate = False
+    return logger
@@ -0,0 +1,332 @@
+import fcntl
+import json
+import os
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from deduplicator.fingerprints import HASH_TYPES
+from deduplicator.hashing import ImageHasher, popcount
+from deduplicator.metrics import metrics
+
+# 索引文件格式版本
+FORMAT_VERSION = 1
+
+
+class MmapFingerprintIndex:
+    """
+    内存映射分片指纹索引：按主哈希（hash_types[0]）前 shard_bits 位分片，
+    每个分片保存定长的记录ID数组（int64）、各哈希类型的 uint64 字数组与有效标记，
+    通过 numpy.memmap 直接映射，启动时无需读取和解析整表。
+
+    目录结构：
+        manifest.json               版本、字数、分片行数、已同步的最大记录ID、所属数据库标识与重建代次
+        shard_XX.ids                int64 记录ID
+        shard_XX.<hash_type>        uint64 指纹，每行 n_words 个字
+        shard_XX.<hash_type>.valid  uint8 有效标记
+
+    新记录先缓存在内存中，达到 flush_size 或调用 flush() 时追加写入文件，再原子更新 manifest；
+    manifest 之外的残留数据（如写入中断）会在下次追加前截断。
+    多个进程可同时写入同一目录：flush 持有目录下 index.lock 的排他文件锁，加锁后重新读取 manifest，
+    在最新的行数之后追加，并跳过其他进程已写入的记录。manifest 原子替换，读取无需加锁；
+    查询前发现 manifest 变化时重新加载。
+    挂载到数据库（DatabaseManager.attach_index → bind）时校验索引文件属于该库且不超前于库中记录，
+    否则清空重建。
+    """
+
+    def __init__(self, directory, db=None, hash_types=HASH_TYPES, hash_bits=64, shard_bits=4, flush_size=1024,
+                 read_only=False):
+        """
+        :param db: DatabaseManager，用于把命中的记录ID解析为存储路径
+        :param read_only: 只读挂载，不写入索引文件；之后新增的记录只保存在内存中，
+                          其他进程写入文件后自动从内存中移除
+        """
+        self.directory = directory
+        self.db = db
+        self.flush_size = flush_size
+        self.read_only = read_only
+        if not read_only:
+            os.makedirs(directory, exist_ok=True)
+
+        manifest = self._read_manifest()
+        if manifest is None:
+            manifest = self._empty_manifest(hash_types, ImageHasher.words_for_bits(hash_bits), shard_bits)
+        elif manifest['version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format version: {manifest['version']}")
+        elif manifest['n_words'] != ImageHasher.words_for_bits(hash_bits) or \
+                tuple(manifest['hash_types']) != tuple(hash_types):
+            raise ValueError(f"Index at {directory} stores {manifest['n_words'] * 64}-bit "
+                             f"{'/'.join(manifest['hash_types'])} hashes, "
+                             f"got hash_bits={hash_bits}, hash_types={'/'.join(hash_types)}")
+        self.manifest = manifest
+        self.hash_types = tuple(manifest['hash_types'])
+        self.n_words = manifest['n_words']
+        self.shard_bits = manifest['shard_bits']
+        self.indexes = dict.fromkeys(self.hash_types)   # 与 FingerprintIndex 一致，供 find_similar 判断哈希类型
+        self._maps = {}
+        self._manifest_stat = self._stat_manifest()
+        self._pending = []
+        self.queries = 0
+        self.candidates_examined = 0
+
+    @staticmethod
+    def _empty_manifest(hash_types, n_words, shard_bits, db_id=None):
+        return {
+            'version': FORMAT_VERSION,
+            'hash_types': list(hash_types),
+            'n_words': n_words,
+            'shard_bits': shard_bits,
+            'counts': [0] * (1 << shard_bits),
+            'last_id': 0,
+            'db_id': db_id,
+            'epoch': uuid.uuid4().hex,
+        }
+
+    # ---- 文件 ----
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _shard_file(self, shard, suffix):
+        return self._path(f"shard_{shard:02x}.{suffix}")
+
+    def _read_manifest(self):
+        try:
+            with open(self._path('manifest.json')) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _stat_manifest(self):
+        try:
+            stat = os.stat(self._path('manifest.json'))
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def _locked(self):
+        """目录级排他文件锁（跨进程串行化写入）"""
+        with open(self._path('index.lock'), 'a') as f:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    def refresh(self, force=False):
+        """manifest 被其他进程更新时重新加载，并移除内存中已写入文件的记录"""
+        stat = self._stat_manifest()
+        if not force and stat == self._manifest_stat:
+            return
+        manifest = self._read_manifest()
+        self._manifest_stat = stat
+        if manifest is None:
+            return
+        if manifest['version'] != FORMAT_VERSION:
+            raise ValueError(f"Unsupported index format version: {manifest['version']}")
+        if manifest.get('epoch') != self.manifest.get('epoch'):
+            self._maps = {}     # 其他进程清空重建了索引，已映射的分片文件失效
+        self.manifest = manifest
+        self._pending = self._unwritten(self._pending)
+
+    def bind(self, db_id, max_id):
+        """
+        绑定到数据库：索引文件属于其他数据库（db_id 不同）或 last_id 超过库中最大记录ID 时清空重建
+        （持有目录文件锁，多个进程同时挂载时只重建一次）；只读挂载时无法重建，直接报错
+        """
+        if self.manifest.get('db_id') == db_id and self.last_id <= max_id:
+            return
+        if self.read_only:
+            if not self.last_id:
+                self.manifest['db_id'] = db_id     # 尚无索引文件，记录全部保存在内存中
+                return
+            raise ValueError(f"Index at {self.directory} does not match the database; "
+                             "rebuild it with a writable attach")
+        with self._locked():
+            self.refresh(force=True)
+            if self.manifest.get('db_id') == db_id and self.last_id <= max_id:
+                return
+            for shard in range(len(self.manifest['counts'])):
+                for path, _ in self._files(shard):
+                    if os.path.exists(path):
+                        os.remove(path)
+            self.manifest = self._empty_manifest(self.hash_types, self.n_words, self.shard_bits, db_id)
+            self._maps = {}
+            self._pending = []
+            self._write_manifest()
+            self._manifest_stat = self._stat_manifest()
+
+    def _unwritten(self, rows):
+        """过滤掉分片文件中已有的记录（只有不超过 last_id 的记录可能已写入）"""
+        last_id = self.manifest['last_id']
+        if not rows or min(item_id for item_id, _ in rows) > last_id:
+            return rows
+        result = []
+        for shard, shard_rows in self._by_shard(rows).items():
+            if self.manifest['counts'][shard]:
+                ids = np.array([item_id for item_id, _ in shard_rows], dtype=np.int64)
+                present = np.isin(ids, self._shard_arrays(shard)[0])
+                shard_rows = [row for row, found in zip(shard_rows, present) if not found]
+            result.extend(shard_rows)
+        return result
+
+    def _by_shard(self, rows):
+        by_shard = {}
+        for item_id, words in rows:
+            by_shard.setdefault(self._shard_of(words[self.hash_types[0]]), []).append((item_id, words))
+        return by_shard
+
+    def _write_manifest(self):
+        tmp = self._path('manifest.json.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(self.manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path('manifest.json'))
+
+    def _files(self, shard):
+        """分片各文件及每行字节数"""
+        yield self._shard_file(shard, 'ids'), 8
+        for hash_type in self.hash_types:
+            yield self._shard_file(shard, hash_type), 8 * self.n_words
+            yield self._shard_file(shard, f"{hash_type}.valid"), 1
+
+    def _shard_arrays(self, shard):
+        """映射分片（行数变化时重新映射），返回 (ids, {类型: 字数组}, {类型: 有效标记})"""
+        count = self.manifest['counts'][shard]
+        cached = self._maps.get(shard)
+        if cached is None or cached[0] != count:
+            ids = np.memmap(self._shard_file(shard, 'ids'), dtype=np.int64, mode='r', shape=(count,))
+            words = {t: np.memmap(self._shard_file(shard, t), dtype=np.uint64, mode='r',
+                                  shape=(count, self.n_words)) for t in self.hash_types}
+            valid = {t: np.memmap(self._shard_file(shard, f"{t}.valid"), dtype=np.bool_, mode='r',
+                                  shape=(count,)) for t in self.hash_types}
+            cached = self._maps[shard] = (count, ids, words, valid)
+        return cached[1:]
+
+    # ---- 写入 ----
+
+    @property
+    def last_id(self):
+        return self.manifest['last_id']
+
+    def __len__(self):
+        return sum(self.manifest['counts']) + len(self._pending)
+
+    def _to_words(self, value):
+        return ImageHasher.hash_to_words(value, self.n_words)
+
+    def _shard_of(self, words):
+        """主哈希最高 shard_bits 位作为分片号"""
+        if words is None:
+            return 0
+        return int(words[0] >> np.uint64(64 - self.shard_bits))
+
+    def add(self, item_id, storage_path, hashes):
+        """追加一条记录（先缓存，批量落盘）"""
+        words = {t: None if hashes.get(t) is None else self._to_words(hashes[t]) for t in self.hash_types}
+        self._pending.append((item_id, words))
+        if len(self._pending) >= self.flush_size and not self.read_only:
+            self.flush()
+
+    def load(self, rows):
+        """从 (id, storage_path, phash, ahash, dhash) 记录增量追加"""
+        for item_id, storage_path, *values in rows:
+            self.add(item_id, storage_path, dict(zip(HASH_TYPES, values)))
+        self.flush()
+
+    def flush(self):
+        """
+        将缓存的记录追加到分片文件并更新 manifest（持有目录文件锁，先重新读取 manifest，
+        跳过其他进程已写入的记录）；只读挂载时只同步 manifest
+        """
+        if self.read_only:
+            self.refresh()
+            return
+        if not self._pending:
+            return
+        with self._locked():
+            self.refresh(force=True)
+            if self._pending:
+                self._append(self._pending)
+            self._pending = []
+
+    def _append(self, pending):
+        """追加到分片文件并原子更新 manifest（调用方持有文件锁）"""
+        zero = np.zeros(self.n_words, dtype=np.uint64)
+        for shard, rows in self._by_shard(pending).items():
+            count = self.manifest['counts'][shard]
+            columns = [np.array([item_id for item_id, _ in rows], dtype=np.int64)]
+            for t in self.hash_types:
+                columns.append(np.stack([zero if w[t] is None else w[t] for _, w in rows]))
+                columns.append(np.array([w[t] is not None for _, w in rows], dtype=np.bool_))
+            for (path, row_bytes), column in zip(self._files(shard), columns):
+                with open(path, 'ab') as f:
+                    f.truncate(count * row_bytes)   # 丢弃上次中断残留的数据
+                    f.write(column.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            self.manifest['counts'][shard] = count + len(rows)
+
+        self.manifest['last_id'] = max(self.manifest['last_id'], max(item_id for item_id, _ in pending))
+        self._write_manifest()
+        self._manifest_stat = self._stat_manifest()
+
+    # ---- 查询 ----
+
+    def _iter_blocks(self):
+        for shard, count in enumerate(self.manifest['counts']):
+            if count:
+                yield self._shard_arrays(shard)
+        if self._pending:
+            ids = np.array([item_id for item_id, _ in self._pending], dtype=np.int64)
+            zero = np.zeros(self.n_words, dtype=np.uint64)
+            words = {t: np.stack([zero if w[t] is None else w[t] for _, w in self._pending]) for t in self.hash_types}
+            valid = {t: np.array([w[t] is not None for _, w in self._pending]) for t in self.hash_types}
+            yield ids, words, valid
+
+    @metrics.timed('index_search')
+    def search(self, hashes, threshold=5):
+        """
+        多种哈希分别比较，任一种相似即命中（各分片向量化 XOR + popcount）
+        每次查询比较全部分片：分片只用于追加写入的局部性，不做前缀剪枝——前缀只约束主哈希，
+        且 shard_bits 位前缀的距离不超过 shard_bits，常用阈值下无法排除任何分片
+        hashes 含 'variants'（方向不变模式）时，每种哈希的全部方向与分片一次比较，取最小距离
+        :return: [(item_id, storage_path, 最小距离)]，按距离排序
+        """
+        self.refresh()
+        variants = hashes.get('variants') or {t: [v] for t, v in hashes.items() if t in self.indexes}
+        queries = {t: np.stack([self._to_words(v) for v in values if v is not None])
+                   for t, values in variants.items()
+                   if t in self.indexes and any(v is not None for v in values)}
+        best = {}
+        examined = 0
+        for ids, words, valid in self._iter_blocks():
+            examined += len(ids)
+            for hash_type, query in queries.items():
+                xor = np.bitwise_xor(words[hash_type][None, :, :], query[:, None, :])
+                distances = popcount(xor).sum(axis=2, dtype=np.int64).min(axis=0)
+                matched = np.flatnonzero((distances <= threshold) & valid[hash_type])
+                for item_id, dist in zip(ids[matched].tolist(), distances[matched].tolist()):
+                    if dist < best.get(item_id, dist + 1):
+                        best[item_id] = dist
+        self.queries += 1
+        self.candidates_examined += examined
+        metrics.inc('dedup_candidates_compared_total', examined, index=type(self).__name__)
+
+        paths = self.db.get_paths(best) if self.db is not None else {}
+        return sorted(((item_id, paths.get(item_id), dist) for item_id, dist in best.items()),
+                      key=lambda x: x[2])
+
+    # 与 FingerprintIndex 一致：本索引没有级联策略，search 即为任一种哈希相似即命中
+    search_any = search
+
+    def stats(self):
+        return {
+            'size': len(self),
+            'shards': sum(1 for count in self.manifest['counts'] if count),
+            'queries': self.queries,
+            'candidates_examined': self.candidates_examined,
+        }
@@ -0,0 +1,249 @@
+import logging
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+from contextlib import nullcontext
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# 上传任务的终态
+FINAL_STATUSES = ('done', 'failed')
+
+
+class UploadOutbox:
+    """
+    写后上传队列（write-behind）：调用方只等待本地事务——查重、写入不过期的预留与 outbox 行——即返回，
+    后台线程领取到期任务上传到存储，成功后在同一事务内把预留转为正式记录，失败按指数退避重试，
+    超过最大次数后释放预留。任务状态保存在 SQLite 的 outbox 表，进程重启后继续处理；
+    多个进程可共享同一数据库，领取任务在写事务内完成，不会重复上传。
+    """
+
+    def __init__(self, db, storage, spool_dir=None, workers=4, max_attempts=8,
+                 backoff_base=1.0, backoff_max=300.0, lease=600, poll_interval=1.0):
+        """
+        :param spool_dir: 入队时把本地文件复制（并 fsync）到该目录，调用方返回后即可删除原文件；
+                          为空时直接引用原路径，调用方需保留文件直到上传结束
+        :param workers: 并发上传线程数
+        :param max_attempts: 最大尝试次数，超过后任务置为 failed
+        :param backoff_base: 第 n 次失败后等待 backoff_base × 2^(n-1) 秒（加随机抖动，不超过 backoff_max）
+        :param lease: 领取后的租期（秒），进程崩溃遗留的任务租期过后重新领取
+        :param poll_interval: 空闲时检查其他进程入队任务的间隔
+        """
+        self.db = db
+        self.storage = storage
+        self.spool_dir = spool_dir
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease = lease
+        self.poll_interval = poll_interval
+        self.index_lock = nullcontext()     # 写入指纹索引时持有的锁（常驻服务中为服务的索引锁）
+        self._futures = {}      # 存储路径 -> [Future]
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._stop = threading.Event()
+        self._threads = []
+        if spool_dir:
+            os.makedirs(spool_dir, exist_ok=True)
+
+    # ---- 生命周期 ----
+
+    def start(self):
+        self._stop.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'upload-outbox-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def close(self):
+        """停止后台线程（未完成的任务保留在 outbox 表中，下次启动后继续）"""
+        self._stop.set()
+        with self._wakeup:
+            self._wakeup.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    # ---- 入队与查询 ----
+
+    def enqueue(self, local_path, storage_path, hashes, threshold=5):
+        """
+        查重、预留并入队
+        :return: (outbox ID, None) 或 (None, "Duplicate image" / "Path exists")
+        """
+        return self.enqueue_many([(local_path, storage_path, hashes, threshold)])[0]
+
+    def enqueue_many(self, records):
+        """
+        批量入队（单个事务）
+        :param records: [(本地路径, 存储路径, hashes, 阈值)]
+        :return: 与 records 一一对应的 (outbox ID, None) 或 (None, 原因)
+        """
+        spooled = [self._spool(local_path) for local_path, _, _, _ in records]
+        try:
+            results = self.db.enqueue_uploads([(spool, storage_path, hashes, threshold)
+                                               for spool, (_, storage_path, hashes, threshold)
+                                               in zip(spooled, records)])
+        except Exception:
+            for spool, (local_path, _, _, _) in zip(spooled, records):
+                self._unspool(spool, local_path)
+            raise
+        for spool, (local_path, _, _, _), (outbox_id, _) in zip(spooled, records, results):
+            if outbox_id is None:
+                self._unspool(spool, local_path)
+        metrics.inc('dedup_outbox_total', sum(outbox_id is not None for outbox_id, _ in results), result='queued')
+        with self._wakeup:
+            self._wakeup.notify_all()
+        return results
+
+    def status(self, storage_path):
+        """
+        轮询上传状态
+        :return: {'status': pending/uploading/done/failed, 'attempts', 'last_error', ...} 或 None（未入队）
+        """
+        return self.db.upload_status(storage_path)
+
+    def future(self, storage_path):
+        """
+        上传结束时完成的 Future（结果为最终状态字典），异步代码中可 await asyncio.wrap_future(...)
+        只在本进程处理的任务结束时通知；其他进程完成的任务可用 wait() 轮询
+        """
+        future = Future()
+        with self._lock:
+            self._futures.setdefault(storage_path, []).append(future)
+        # 注册之后再检查，避免与后台线程完成任务的时序竞争
+        status = self.status(storage_path)
+        if status is None or status['status'] in FINAL_STATUSES:
+            self._resolve(storage_path, status)
+        return future
+
+    def wait(self, storage_path, timeout=None):
+        """阻塞等待上传结束，返回最终状态；超时返回当前状态"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        future = self.future(storage_path)
+        while True:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            wait = self.poll_interval if remaining is None else max(0.0, min(self.poll_interval, remaining))
+            try:
+                return future.result(wait)
+            except FutureTimeoutError:
+                pass
+            status = self.status(storage_path)
+            if status is None or status['status'] in FINAL_STATUSES:
+                self._resolve(storage_path, status)
+                return status
+            if remaining is not None and remaining <= 0:
+                return status
+
+    def drain(self, timeout=None):
+        """等待所有到期任务处理完毕（含退避中的重试），返回是否已无待处理任务"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.db.next_upload_due() is not None:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(min(self.poll_interval, 0.05))
+        return True
+
+    def stats(self):
+        return {'workers': self.workers, 'tasks': self.db.outbox_counts()}
+
+    # ---- 后台处理 ----
+
+    def _run(self):
+        while not self._stop.is_set():
+            task = self.db.claim_upload(self.lease)
+            if task is None:
+                self._idle()
+                continue
+            self._process(task)
+
+    def _idle(self):
+        """没有到期任务时等待入队通知，或等到最早的重试时间（不超过 poll_interval）"""
+        due = self.db.next_upload_due()
+        delay = self.poll_interval if due is None else min(self.poll_interval, max(0.0, due - time.time()))
+        with self._wakeup:
+            if not self._stop.is_set():
+                self._wakeup.wait(delay)
+
+    def _process(self, task):
+        local_path, storage_path = task['local_path'], task['storage_path']
+        error = None
+        try:
+            with metrics.timer('outbox_upload'):
+                uploaded = self.storage.upload(local_path, storage_path)
+            if not uploaded:
+                error = "Upload failed"
+        except Exception as e:
+            logger.warning("Upload attempt %d for %s failed: %s", task['attempts'], storage_path, e)
+            error = f"Upload failed: {e}"
+
+        if error is None:
+            with self.index_lock:
+                completed = self.db.complete_upload(task['id'])
+            if completed:
+                metrics.inc('dedup_outbox_total', result='done')
+            elif completed is False:
+                self.storage.delete(storage_path)   # 回滚上传
+                metrics.inc('dedup_outbox_total', result='failed')
+            else:
+                # 租期过后已被其他线程 / 进程领取并完成，暂存文件由其清理
+                logger.warning("Upload task for %s was reclaimed by another worker", storage_path)
+                self._resolve(storage_path, self.status(storage_path))
+                return
+            self._finish(task)
+        elif task['attempts'] >= self.max_attempts:
+            logger.warning("Giving up upload of %s after %d attempts: %s", storage_path, task['attempts'], error)
+            self.db.fail_upload(task['id'], error)
+            metrics.inc('dedup_outbox_total', result='failed')
+            self._finish(task)
+        else:
+            delay = min(self.backoff_max, self.backoff_base * 2 ** (task['attempts'] - 1))
+            self.db.retry_upload(task['id'], delay * random.uniform(0.5, 1.0), error)
+            metrics.inc('dedup_outbox_total', result='retry')
+
+    def _finish(self, task):
+        if self.spool_dir:
+            self._unspool(task['local_path'], None)
+        self._resolve(task['storage_path'], self.status(task['storage_path']))
+
+    def _resolve(self, storage_path, status):
+        with self._lock:
+            futures = self._futures.pop(storage_path, [])
+        for future in futures:
+            if not future.done():
+                future.set_result(status)
+
+    # ---- 本地文件暂存 ----
+
+    def _spool(self, local_path):
+        if not self.spool_dir:
+            return local_path
+        name = f"{uuid.uuid4().hex}{os.path.splitext(local_path)[1]}"
+        target = os.path.join(self.spool_dir, name)
+        with open(local_path, 'rb') as src, open(target, 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+            dst.flush()
+            os.fsync(dst.fileno())
+        return target
+
+    def _unspool(self, spool, local_path):
+        if spool != local_path:
+            try:
+                os.remove(spool)
+            except OSError:
+                pass
@@ -0,0 +1,86 @@
+from deduplicator.index import INDEX_TYPES, MultiIndexHashing
+from deduplicator.metrics import metrics
+
+# 每条记录最多的分段数，分段在索引中的ID为 image_id * SEGMENT_SLOTS + 分段序号
+SEGMENT_SLOTS = 64
+
+
+class SegmentIndex:
+    """
+    分段指纹倒排索引：所有记录的分段哈希放在同一个汉明索引中（默认多索引哈希，按子串分桶查找，
+    不扫描全表），查询时每个查询分段对命中的记录投一票，票数达到 min_votes 即视为局部重复。
+    由 segments 表构建，并通过 DatabaseManager.add_image 保持同步。
+    """
+
+    # 分段数约为记录数的 20 余倍，多索引哈希采用更宽的子串以减少每个桶中的候选
+    MIH_SUBSTRING_BITS = 13
+
+    def __init__(self, index_type='mih', hash_bits=64, threshold=8, min_votes=2):
+        """
+        :param threshold: 分段哈希的汉明距离阈值（按 hash_bits 计）
+        :param min_votes: 判定局部重复所需的最少命中分段数
+        """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type: {index_type}")
+        self.index_type = index_type
+        self.hash_bits = hash_bits
+        self.threshold = threshold
+        self.min_votes = min_votes
+        if index_type == 'mih':
+            self.index = MultiIndexHashing(hash_bits, self.MIH_SUBSTRING_BITS)
+        else:
+            self.index = INDEX_TYPES[index_type](hash_bits)
+        self.paths = {}
+        self.last_id = 0
+
+    def __len__(self):
+        return len(self.paths)
+
+    def add(self, item_id, storage_path, hashes):
+        """添加一条记录的分段指纹（hashes['segments']），没有分段的记录忽略"""
+        segments = hashes.get('segments')
+        if not segments:
+            return
+        self.paths[item_id] = storage_path
+        self.last_id = max(self.last_id, item_id)
+        for k, value in enumerate(segments[:SEGMENT_SLOTS]):
+            self.index.add(item_id * SEGMENT_SLOTS + k, value)
+
+    def load(self, rows):
+        """从 (image_id, storage_path, [分段哈希, ...]) 记录批量构建"""
+        for item_id, storage_path, segments in rows:
+            self.add(item_id, storage_path, {'segments': segments})
+
+    def search(self, segments, threshold=None, min_votes=None):
+        """
+        按分段投票查找局部重复
+        :param segments: 查询图像的分段哈希列表
+        :return: [(item_id, storage_path, 票数, 最小距离)]，按票数降序、距离升序
+        """
+        threshold = self.threshold if threshold is None else threshold
+        min_votes = self.min_votes if min_votes is None else min_votes
+        votes, best = {}, {}
+        with metrics.timer('segment_search'):
+            for value in segments or ():
+                matched = {}
+                for segment_id, dist in self.index.range_query(value, threshold):
+                    item_id = segment_id // SEGMENT_SLOTS
+                    if dist < matched.get(item_id, dist + 1):
+                        matched[item_id] = dist
+                # 每个查询分段对每条记录至多一票
+                for item_id, dist in matched.items():
+                    votes[item_id] = votes.get(item_id, 0) + 1
+                    if dist < best.get(item_id, dist + 1):
+                        best[item_id] = dist
+        results = [(item_id, self.paths[item_id], n, best[item_id])
+                   for item_id, n in votes.items() if n >= min_votes]
+        return sorted(results, key=lambda x: (-x[2], x[3]))
+
+    def stats(self):
+        return {
+            'images': len(self.paths),
+            'segments': len(self.index),
+            'threshold': self.threshold,
+            'min_votes': self.min_votes,
+            **{k: v for k, v in self.index.stats().items() if k != 'size'},
+        }
@@ -0,0 +1,449 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import ThreadingMixIn, UnixStreamServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from .hashing import ImageHasher
+from .index import FingerprintIndex
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class LatencyRecorder:
+    """按操作记录最近 window 次请求耗时，输出分位数（毫秒）"""
+
+    def __init__(self, window=10000):
+        self.window = window
+        self._samples = {}
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def record(self, op, seconds):
+        with self._lock:
+            self._samples.setdefault(op, deque(maxlen=self.window)).append(seconds)
+            self._counts[op] = self._counts.get(op, 0) + 1
+
+    def percentiles(self):
+        with self._lock:
+            snapshot = {op: np.array(samples) * 1000 for op, samples in self._samples.items()}
+            counts = dict(self._counts)
+        return {op: {
+            'count': counts[op],
+            'p50_ms': float(np.percentile(ms, 50)),
+            'p90_ms': float(np.percentile(ms, 90)),
+            'p99_ms': float(np.percentile(ms, 99)),
+            'max_ms': float(ms.max()),
+        } for op, ms in snapshot.items()}
+
+
+class RequestBatcher:
+    """
+    请求合并：并发提交的请求由后台线程按批取出（最多 max_batch 个），交给 handler(payloads) 一次处理，
+    handler 返回与 payloads 一一对应的结果。取出首个请求时队列中没有其他请求（空闲）则立即处理，
+    不增加延迟；已有请求排队（并发到达）时才在首个请求后最多等待 max_wait 秒继续合并
+    """
+
+    def __init__(self, handler, max_batch=64, max_wait=0.002):
+        self.handler = handler
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.batched_requests = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='request-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, payload):
+        future = Future()
+        self._queue.put((payload, future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _next_batch(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                remaining = deadline - time.monotonic()
+                if len(batch) == 1 or remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if item is None:
+                self._queue.put(None)   # 处理完当前批次后再退出
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self.batches += 1
+            self.batched_requests += len(batch)
+            try:
+                results = self.handler([payload for payload, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+
+class DedupService:
+    """
+    常驻去重服务：指纹索引只在启动时加载一次，入库时由 DatabaseManager 同步更新。
+    check / upload 请求经 RequestBatcher 合并：批内并行计算摘要与哈希，批量查询摘要，
+    统一查重（同批次先到的上传会拦截后到的相似图像），成功上传的记录单事务写库。
+    """
+
+    def __init__(self, deduplicator, threshold=None, max_batch=64, max_wait=0.002, workers=8):
+        """:param threshold: 默认相似阈值（按实际指纹位数），为空时使用 deduplicator.threshold"""
+        self.dedup = deduplicator
+        self.threshold = deduplicator.threshold if threshold is None else threshold
+        self.latency = LatencyRecorder()
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.RLock()    # 保护指纹索引的读写
+        if deduplicator.outbox is not None:
+            deduplicator.outbox.index_lock = self._lock     # 后台上传完成时同样写入索引
+        self._batcher = RequestBatcher(self._process_batch, max_batch, max_wait)
+
+    def close(self):
+        self._batcher.close()
+        self._pool.shutdown()
+
+    def _timed(self, op, fn, *args):
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            self.latency.record(op, time.perf_counter() - start)
+
+    # ---- 对外操作 ----
+
+    def check(self, source, threshold=None):
+        """
+        检查图像是否原创
+        :param source: 文件路径或图像 bytes
+        :return: {'original': bool, 'matches': [{'path', 'distance', 'segments'?}], 'error'?}，
+                 局部重复（分段投票命中）的匹配项带 'segments' 命中分段数
+        """
+        if not isinstance(source, (str, bytes, bytearray)):
+            raise TypeError("check requires a local file path or image bytes")
+        return self._timed('check', lambda: self._batcher.submit(('check', source, None, threshold)).result())
+
+    def check_hashes(self, hashes, threshold=None):
+        """
+        调用方已有指纹（{哈希类型: 十六进制哈希}，可含 'segments' 分段哈希列表）时直接查询常驻索引，不经合并队列
+        """
+        def run():
+            with self._lock:
+                matches = [{'path': path, 'distance': dist}
+                           for _, path, dist in self.dedup.index.search(hashes, self._threshold(threshold))]
+                if not matches:
+                    matches = [{'path': path, 'distance': dist, 'segments': votes}
+                               for _, path, votes, dist in self.dedup.partial_matches(hashes)]
+            return {'original': not matches, 'matches': matches}
+        return self._timed('check_hashes', run)
+
+    def upload(self, image_path, remote_folder="images/", threshold=None):
+        """查重并上传入库，返回 {'path': 远程路径或 None, 'message': 结果}"""
+        if not isinstance(image_path, str):
+            raise TypeError("upload requires a local file path")
+        return self._timed('upload', lambda: self._batcher.submit(
+            ('upload', image_path, remote_folder, threshold)).result())
+
+    def find_similar(self, target_hash, hash_type='phash', threshold=None):
+        def run():
+            with self._lock:
+                return self.dedup.db.find_similar(target_hash, hash_type, self._threshold(threshold))
+        return self._timed('find_similar', run)
+
+    def scan(self, threshold=None, block_size=1024, workers=None, incremental=False):
+        """全库重复扫描（incremental 时只比较新增记录），返回 [{'representative', 'members'}]"""
+        def run():
+            groups = self.dedup.find_duplicates(self._threshold(threshold), block_size, workers, incremental)
+            if incremental:
+                with self._lock:    # 增量扫描查询指纹索引
+                    groups = list(groups)
+            return [{'representative': group.representative, 'members': group.members} for group in groups]
+        return self._timed('scan', run)
+
+    def stats(self):
+        stats = {
+            'latency': self.latency.percentiles(),
+            'batches': self._batcher.batches,
+            'batched_requests': self._batcher.batched_requests,
+            'checks': self.dedup.stats.as_dict(),
+            'index': self.dedup.index.stats(),
+            'metrics': metrics.snapshot(),
+        }
+        if self.dedup.segment_index is not None:
+            stats['segment_index'] = self.dedup.segment_index.stats()
+        if self.dedup.outbox is not None:
+            stats['outbox'] = self.dedup.outbox.stats()
+        return stats
+
+    def upload_status(self, storage_path, wait=None):
+        """
+        写后上传的任务状态，wait 秒内等待上传结束
+        :return: outbox 状态字典，未入队时为 None
+        """
+        if self.dedup.outbox is None:
+            raise ValueError("Upload outbox is not enabled")
+        if wait:
+            return self.dedup.outbox.wait(storage_path, wait)
+        return self.dedup.outbox.status(storage_path)
+
+    # ---- 批处理 ----
+
+    def _threshold(self, threshold):
+        return self.threshold if threshold is None else threshold
+
+    def _digest(self, source):
+        try:
+            return ImageHasher.content_digest(source)
+        except OSError as e:
+            logger.warning("Error reading %s: %s", source if isinstance(source, str) else '<bytes>', e)
+            return None
+
+    def _hash(self, source):
+        start = time.perf_counter()
+        hashes = self.dedup.hasher.compute_all(source)
+        return hashes, time.perf_counter() - start
+
+    @metrics.timed('service_batch')
+    def _process_batch(self, jobs):
+        metrics.inc('dedup_service_requests_total', len(jobs))
+        stats = self.dedup.stats
+        stats.checks += len(jobs)
+        digests = list(self._pool.map(self._digest, [source for _, source, _, _ in jobs]))
+        known = self.dedup.db.find_by_digests({d for d in digests if d})
+
+        results = [None] * len(jobs)
+        to_hash = []
+        for i, digest in enumerate(digests):
+            if digest is None:
+                results[i] = {'original': False, 'matches': [], 'error': 'Read failed'}
+            elif digest in known:
+                stats.exact_hits += 1
+                results[i] = {'original': False, 'matches': [{'path': known[digest], 'distance': 0}]}
+            else:
+                to_hash.append(i)
+
+        hashed = dict(zip(to_hash, self._pool.map(self._hash, [jobs[i][1] for i in to_hash])))
+        pending = FingerprintIndex('linear', hash_bits=self.dedup.hasher.hash_bits,   # 本批次已接受的上传
+                                   cascade=getattr(self.dedup.index, 'cascade', None))
+        admitted = []
+        seen_digests = {}
+        with self._lock:
+            for i in to_hash:
+                op, source, remote_folder, threshold = jobs[i]
+                hashes, elapsed = hashed[i]
+                stats.decodes += 1
+                stats.decode_time += elapsed
+                if not hashes:
+                    results[i] = {'original': False, 'matches': [], 'error': 'Hash failed'}
+                    continue
+                hashes['digest'] = digests[i]
+                threshold = self._threshold(threshold)
+                matches = [{'path': path, 'distance': dist}
+                           for _, path, dist in self.dedup.index.search(hashes, threshold)]
+                if not matches:
+                    matches = [{'path': path, 'distance': dist, 'segments': votes}
+                               for _, path, votes, dist in self.dedup.partial_matches(hashes)]
+                if op == 'upload':
+                    if digests[i] in seen_digests:
+                        matches.append({'path': seen_digests[digests[i]], 'distance': 0})
+                    matches += [{'path': path, 'distance': dist}
+                                for _, path, dist in pending.search(hashes, threshold)]
+                results[i] = {'original': not matches, 'matches': matches}
+                if op == 'upload' and not matches:
+                    remote_path = f"{remote_folder}{os.path.basename(source)}"
+                    if self.dedup.db.has_image(remote_path) or remote_path in seen_digests.values():
+                        results[i] = {'path': remote_path, 'message': 'Path exists'}
+                        continue
+                    pending.add(len(pending), remote_path, hashes)
+                    seen_digests[digests[i]] = remote_path
+                    admitted.append((i, remote_path, hashes))
+
+        if admitted:
+            self._commit_uploads(jobs, admitted, results)
+        for i, (op, _, _, _) in enumerate(jobs):
+            if op == 'upload' and 'message' not in results[i]:
+                results[i] = {'path': None, 'message': results[i].get('error', 'Duplicate image')}
+        return results
+
+    def _commit_uploads(self, jobs, admitted, results):
+        """
+        并发上传本批次接受的图像，成功的单事务复查并写库（同步其他进程的记录后再比对）；
+        配置了 outbox 时改为单事务预留并入队，由后台线程上传，结果为 'Queued'
+        """
+        outbox = self.dedup.outbox
+        if outbox is not None:
+            with self._lock:
+                queued = outbox.enqueue_many([(jobs[i][1], remote_path, hashes, self._threshold(jobs[i][3]))
+                                              for i, remote_path, hashes in admitted])
+            for (i, remote_path, _), (outbox_id, reason) in zip(admitted, queued):
+                results[i] = {'path': remote_path, 'message': 'Queued'} if outbox_id is not None else \
+                    {'path': None, 'message': reason}
+            return
+
+        def upload(item):
+            i, remote_path, _ = item
+            try:
+                return self.dedup.storage.upload(jobs[i][1], remote_path)
+            except Exception as e:
+                logger.error("Upload failed for %s: %s", jobs[i][1], e)
+                return False
+
+        uploaded = []
+        for item, ok in zip(admitted, self._pool.map(upload, admitted)):
+            if ok:
+                uploaded.append(item)
+            else:
+                results[item[0]] = {'path': None, 'message': 'Upload failed'}
+        if not uploaded:
+            return
+
+        with self._lock:
+            committed = self.dedup.db.add_images_checked([(remote_path, hashes, self._threshold(jobs[i][3]))
+                                                          for i, remote_path, hashes in uploaded])
+        for (i, remote_path, _), (row_id, reason) in zip(uploaded, committed):
+            if row_id is not None:
+                results[i] = {'path': remote_path, 'message': 'Success'}
+            else:
+                if reason != "Path exists":     # 路径已被其他记录占用时，对象属于该记录，不能删除
+                    self.dedup.storage.delete(remote_path)
+                results[i] = {'path': None, 'message': reason}
+
+
+class DedupRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON over HTTP：
+        POST /check         {"path", "threshold"?}，或 application/octet-stream 图像内容（?threshold=），
+                            或 {"hashes": {哈希类型: 十六进制哈希}} 直接查询索引
+        POST /upload        {"path", "remote_folder"?, "threshold"?}
+        POST /find_similar  {"hash", "hash_type"?, "threshold"?}
+        POST /scan          {"threshold"?, "incremental"?}
+        GET  /upload_status ?path=远程路径[&wait=秒]，写后上传（outbox）的任务状态
+        GET  /stats
+        GET  /metrics       Prometheus 文本格式（?format=json 时为 JSON 快照）
+    """
+    service = None
+    protocol_version = 'HTTP/1.1'     # 保持长连接，避免每次请求重新握手
+    disable_nagle_algorithm = True
+
+    def address_string(self):
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, body, content_type='application/json'):
+        data = body.encode() if isinstance(body, str) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            self._reply(200, self.service.stats())
+        elif url.path == '/upload_status':
+            query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+            try:
+                status = self.service.upload_status(query['path'], float(query.get('wait') or 0))
+            except (KeyError, ValueError) as e:
+                self._reply(400, {'error': str(e)})
+                return
+            if status:
+                self._reply(200, status)
+            else:
+                self._reply(404, {'error': 'Not found'})
+        elif url.path == '/metrics' and parse_qs(url.query).get('format') == ['json']:
+            self._reply(200, metrics.snapshot())
+        elif url.path == '/metrics':
+            self._reply(200, metrics.to_prometheus(), 'text/plain; version=0.0.4')
+        else:
+            self._reply(404, {'error': 'Not found'})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            if self.headers.get('Content-Type') == 'application/octet-stream':
+                params = {k: v[-1] for k, v in parse_qs(url.query).items()}
+                source = body
+            else:
+                params = json.loads(body or b'{}')
+                source = params.get('path')
+            threshold = int(params['threshold']) if params.get('threshold') is not None else None
+
+            if url.path == '/check' and 'hashes' in params:
+                result = self.service.check_hashes(params['hashes'], threshold)
+            elif url.path == '/check':
+                result = self.service.check(source, threshold)
+            elif url.path == '/upload':
+                result = self.service.upload(source, params.get('remote_folder', 'images/'), threshold)
+            elif url.path == '/find_similar':
+                result = [{'path': path, 'distance': dist} for path, dist in self.service.find_similar(
+                    params['hash'], params.get('hash_type', 'phash'), threshold)]
+            elif url.path == '/scan':
+                result = self.service.scan(threshold, incremental=bool(params.get('incremental')))
+            else:
+                self._reply(404, {'error': 'Not found'})
+                return
+        except (KeyError, ValueError, TypeError) as e:
+            self._reply(400, {'error': str(e)})
+            return
+        except Exception as e:
+            logger.exception("Error handling %s: %s", url.path, e)
+            self._reply(500, {'error': str(e)})
+            return
+        self._reply(200, result)
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ('unix', 0)
+
+
+def make_server(service, host='127.0.0.1', port=8080, unix_socket=None):
+    """
+    创建 HTTP 服务（unix_socket 非空时监听 Unix 套接字），调用 serve_forever() 运行
+    """
+    attrs = {'service': service, 'disable_nagle_algorithm': not unix_socket}
+    handler = type('BoundDedupRequestHandler', (DedupRequestHandler,), attrs)
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        return UnixHTTPServer(unix_socket, handler)
+    return ThreadingHTTPServer((host, port), handler)
@@ -1,8 +1,19 @@
+import itertools
+import logging
 import os
+import re
+import shutil
+import threading
+import time
 from abc import ABC, abstractmethod
+from collections import Counter, OrderedDict
 
 import oss2
 
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
 
 class StorageProvider(ABC):
     """存储提供者抽象类"""
@@ -23,30 +34,103 @@ class StorageProvider(ABC):
     def delete(self, remote_path):
         pass
 
+    @abstractmethod
+    def list_page(self, prefix='', marker='', max_keys=1000):
+        """
+        分页列举对象
+        :return: (对象键列表, 下一页 marker)，没有下一页时 marker 为空字符串
+        """
+        pass
+
+    @abstractmethod
+    def read(self, remote_path):
+        """读取对象内容（bytes），不落地临时文件"""
+        pass
+
 
 class OSSProvider(StorageProvider):
     """阿里云OSS存储实现"""
 
-    def __init__(self, access_key, secret_key, endpoint, bucket_name):
+    # 签名URL缓存上限
+    SIGNED_URL_CACHE_SIZE = 10000
+
+    def __init__(self, access_key, secret_key, endpoint, bucket_name,
+                 acl=None, acl_ttl=300, url_refresh_margin=60,
+                 multipart_threshold=10 * 1024 * 1024, part_size=5 * 1024 * 1024,
+                 num_threads=4, checkpoint_dir=None):
+        """
+        :param acl: 固定的 Bucket ACL（如 public-read / private），设置后不再查询
+        :param acl_ttl: 查询到的 ACL 缓存秒数
+        :param url_refresh_margin: 签名URL距过期不足该秒数时重新签名
+        :param multipart_threshold: 文件达到该大小时改用分片上传 / 分段并行下载
+        :param part_size: 分片大小
+        :param num_threads: 并行分片数
+        :param checkpoint_dir: 断点续传记录目录，默认 ~/.py-oss-upload 与 ~/.py-oss-download
+        """
         self.access_key = access_key
         self.secret_key = secret_key
         self.endpoint = endpoint
         self.bucket_name = bucket_name
+        self.acl = acl or None
+        self.acl_ttl = acl_ttl
+        self.url_refresh_margin = url_refresh_margin
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+        self.num_threads = num_threads
+        self.checkpoint_dir = checkpoint_dir
+        self._upload_store = None       # 断点续传记录，首次上传 / 下载时创建（会创建目录）
+        self._download_store = None
 
         auth = oss2.Auth(access_key, secret_key)
         self.bucket = oss2.Bucket(auth, endpoint, bucket_name)
 
+        self._lock = threading.Lock()
+        self._acl_cache = None      # (acl, 过期时间)
+        self._signed_urls = OrderedDict()   # (object_name, expires) -> (url, 过期时间)
+
+    @property
+    def upload_store(self):
+        with self._lock:
+            if self._upload_store is None:
+                self._upload_store = oss2.ResumableStore(root=self.checkpoint_dir)
+            return self._upload_store
+
+    @property
+    def download_store(self):
+        with self._lock:
+            if self._download_store is None:
+                self._download_store = oss2.ResumableDownloadStore(root=self.checkpoint_dir)
+            return self._download_store
+
+    def get_bucket_acl(self):
+        """Bucket ACL：优先使用固定配置，其次使用 TTL 缓存，过期后才发起请求"""
+        if self.acl:
+            metrics.inc('dedup_oss_acl_total', source='config')
+            return self.acl
+        now = time.time()
+        with self._lock:
+            if self._acl_cache and self._acl_cache[1] > now:
+                metrics.inc('dedup_oss_acl_total', source='cache')
+                return self._acl_cache[0]
+        with metrics.timer('oss_get_acl'):
+            acl = self.bucket.get_bucket_acl().acl
+        metrics.inc('dedup_oss_acl_total', source='remote')
+        with self._lock:
+            self._acl_cache = (acl, now + self.acl_ttl)
+        return acl
+
     def get_file_url(self, remote_path, expires=3600):
         """获取文件访问URL（自动判断Bucket类型）"""
-        # 检查Bucket ACL
-        acl = self.bucket.get_bucket_acl().acl
+        return self.get_file_urls([remote_path], expires)[remote_path]
 
-        if acl == oss2.BUCKET_ACL_PUBLIC_READ:
+    def get_file_urls(self, remote_paths, expires=3600):
+        """批量获取文件访问URL，只判断一次Bucket类型，签名在本地完成"""
+        if self.get_bucket_acl() == oss2.BUCKET_ACL_PUBLIC_READ:
             # 公共读Bucket，直接返回公开URL
-            return self._get_public_url(remote_path)
+            return {path: self._get_public_url(path) for path in remote_paths}
         else:
             # 私有Bucket，返回签名URL
-            return self._get_signed_url(remote_path, expires)
+            return {path: self._get_signed_url(path, expires) for path in remote_paths}
 
     def _get_public_url(self, object_name):
         """生成公开访问URL"""
@@ -55,61 +139,237 @@ class OSSProvider(StorageProvider):
         return f"https://{self.bucket_name}.{endpoint}/{object_name}"
 
     def _get_signed_url(self, object_name, expires=3600):
-        """生成带签名的临时访问URL"""
-        return self.bucket.sign_url('GET', object_name, expires)
+        """生成带签名的临时访问URL（在临近过期前复用已签名的URL）"""
+        key = (object_name, expires)
+        now = time.time()
+        with self._lock:
+            cached = self._signed_urls.get(key)
+            if cached and cached[1] - self.url_refresh_margin > now:
+                self._signed_urls.move_to_end(key)
+                return cached[0]
+
+        url = self.bucket.sign_url('GET', object_name, expires)
+        with self._lock:
+            self._signed_urls[key] = (url, now + expires)
+            self._signed_urls.move_to_end(key)
+            while len(self._signed_urls) > self.SIGNED_URL_CACHE_SIZE:
+                self._signed_urls.popitem(last=False)
+        return url
 
     def upload(self, local_path, remote_path):
+        """上传文件：小文件单次 PUT，大文件并行分片上传，失败重试时从断点继续"""
         try:
-            res = self.bucket.put_object_from_file(remote_path, local_path)
+            with metrics.timer('storage_upload'):
+                res = oss2.resumable_upload(self.bucket, remote_path, local_path,
+                                            store=self.upload_store,
+                                            multipart_threshold=self.multipart_threshold,
+                                            part_size=self.part_size,
+                                            num_threads=self.num_threads)
             if res.status == 200:
+                metrics.inc('dedup_bytes_total', os.path.getsize(local_path), kind='upload')
                 # 获取访问URL
                 return self.get_file_url(remote_path)
         except Exception as e:
-            print(f"OSS upload failed: {str(e)}")
+            logger.error("OSS upload failed: %s", e)
 
     def download(self, remote_path, local_path):
+        """下载文件：大文件按 Range 分段并行下载，支持断点续传"""
         try:
-            res = self.bucket.get_object_to_file(remote_path, local_path)
-            if res.status == 200:
-                return True
+            with metrics.timer('storage_download'):
+                oss2.resumable_download(self.bucket, remote_path, local_path,
+                                        multiget_threshold=self.multipart_threshold,
+                                        part_size=self.part_size,
+                                        num_threads=self.num_threads,
+                                        store=self.download_store)
+            metrics.inc('dedup_bytes_total', os.path.getsize(local_path), kind='download')
+            return True
         except Exception as e:
-            print(f"OSS download failed: {str(e)}")
+            logger.error("OSS download failed: %s", e)
 
     def exists(self, remote_path):
         return self.bucket.object_exists(remote_path)
 
+    def list_page(self, prefix='', marker='', max_keys=1000):
+        result = self.bucket.list_objects(prefix, marker=marker, max_keys=max_keys)
+        keys = [obj.key for obj in result.object_list if not obj.key.endswith('/')]
+        return keys, result.next_marker if result.is_truncated else ''
+
+    def read(self, remote_path):
+        with metrics.timer('storage_read'):
+            data = self.bucket.get_object(remote_path).read()
+        metrics.inc('dedup_bytes_total', len(data), kind='read')
+        return data
+
     def delete(self, remote_path):
         try:
             res = self.bucket.delete_object(remote_path)
             if res.status == 204:
                 return True
         except Exception as e:
-            print(f"OSS delete failed: {str(e)}")
+            logger.error("OSS delete failed: %s", e)
 
 
 class LocalStorageProvider(StorageProvider):
 
     """本地存储实现"""
 
-    def __init__(self, base_path):
+    FICLONE = 0x40049409    # Linux ioctl: 写时复制克隆（btrfs/xfs 等）
+    TMP_NAME = re.compile(r'\.\d+\.\d+\.tmp$')    # _transfer 写入中的临时文件名后缀
+
+    def __init__(self, base_path, hardlink=False):
+        """
+        :param hardlink: 允许使用硬链接（与源文件共享 inode，源文件被原地修改时存储内容随之变化）
+        """
         self.base_path = base_path
+        self.hardlink = hardlink
+        self.transfer_methods = Counter()   # 各复制方式的使用次数
         os.makedirs(base_path, exist_ok=True)
 
+    def _full_path(self, remote_path):
+        return os.path.join(self.base_path, remote_path)
+
+    def _transfer(self, src, dst):
+        """
+        复制文件：允许硬链接（hardlink=True）时先尝试硬链接，否则或失败时依次尝试 reflink、
+        copy_file_range、sendfile，最后回退到普通复制。
+        先写入临时文件再原子替换，读取方不会看到写了一半的文件。
+        """
+        os.makedirs(os.path.dirname(dst) or '.', exist_ok=True)
+        tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            method = self._copy(src, tmp)
+            os.replace(tmp, dst)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            raise
+        self.transfer_methods[method] += 1
+        return method
+
+    def _copy(self, src, dst):
+        if self.hardlink:
+            try:
+                os.link(src, dst)
+                return 'hardlink'
+            except OSError:
+                pass
+
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            try:
+                import fcntl
+                fcntl.ioctl(fdst.fileno(), self.FICLONE, fsrc.fileno())
+                return 'reflink'
+            except (ImportError, OSError):
+                pass
+
+            size = os.fstat(fsrc.fileno()).st_size
+            for method, syscall in (('copy_file_range', getattr(os, 'copy_file_range', None)),
+                                    ('sendfile', getattr(os, 'sendfile', None))):
+                if syscall is None:
+                    continue
+                try:
+                    self._copy_loop(syscall, fsrc.fileno(), fdst.fileno(), size)
+                    return method
+                except OSError:
+                    fdst.seek(0)
+                    fdst.truncate()
+
+            fsrc.seek(0)
+            shutil.copyfileobj(fsrc, fdst, 1 << 20)
+            return 'copy'
+
+    @staticmethod
+    def _copy_loop(syscall, src_fd, dst_fd, size):
+        offset = 0
+        while offset < size:
+            if syscall is os.sendfile:
+                sent = os.sendfile(dst_fd, src_fd, offset, size - offset)
+            else:
+                sent = syscall(src_fd, dst_fd, size - offset, offset, offset)
+            if sent == 0:
+                break
+            offset += sent
+
     def upload(self, local_path, remote_path):
-        import shutil
         try:
-            shutil.copy(local_path, f"{self.base_path}/{remote_path}")
+            with metrics.timer('storage_upload'):
+                self._transfer(local_path, self._full_path(remote_path))
+            metrics.inc('dedup_bytes_total', os.path.getsize(local_path), kind='upload')
+            return True
+        except Exception as e:
+            logger.error("Local storage upload failed: %s", e)
+            return False
+
+    def download(self, remote_path, local_path):
+        try:
+            with metrics.timer('storage_download'):
+                self._transfer(self._full_path(remote_path), local_path)
+            metrics.inc('dedup_bytes_total', os.path.getsize(local_path), kind='download')
             return True
         except Exception as e:
-            print(f"Local storage upload failed: {str(e)}")
+            logger.error("Local storage download failed: %s", e)
             return False
 
+    def exists(self, remote_path):
+        return os.path.isfile(self._full_path(remote_path))
+
+    def delete(self, remote_path):
+        try:
+            os.remove(self._full_path(remote_path))
+            return True
+        except Exception as e:
+            logger.error("Local storage delete failed: %s", e)
+            return False
+
+    def list_page(self, prefix='', marker='', max_keys=1000):
+        # 与 OSS 一致：按键的字典序列举，marker 之后的 max_keys 个对象；按序遍历，取满一页即停止
+        keys = list(itertools.islice(self._iter_keys(self.base_path, '', prefix, marker), max_keys + 1))
+        page = keys[:max_keys]
+        return page, page[-1] if len(keys) > max_keys else ''
+
+    def _iter_keys(self, directory, parent, prefix, marker):
+        """
+        按键的字典序遍历目录：子目录按"名称/"参与排序，即与其下所有键的相对顺序一致；
+        跳过与 prefix 不符或整体不大于 marker 的子树，以及 _transfer 写入中的临时文件
+        """
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return
+        children = []
+        for entry in entries:
+            key = parent + entry.name
+            if entry.is_dir(follow_symlinks=False):
+                key += '/'
+                if not (key.startswith(prefix) or prefix.startswith(key)):
+                    continue
+                if key <= marker and not marker.startswith(key):
+                    continue
+            elif not key.startswith(prefix) or key <= marker or self.TMP_NAME.search(entry.name):
+                continue
+            children.append((key, entry))
+        for key, entry in sorted(children, key=lambda child: child[0]):
+            if key.endswith('/'):
+                yield from self._iter_keys(entry.path, key, prefix, marker)
+            else:
+                yield key
+
+    def read(self, remote_path):
+        with metrics.timer('storage_read'), open(self._full_path(remote_path), 'rb') as f:
+            data = f.read()
+        metrics.inc('dedup_bytes_total', len(data), kind='read')
+        return data
 
 
 if  __name__ == '__main__':
     from config import config
 
-    storage = OSSProvider(config.OSS_ACCESS_KEY, config.OSS_SECRET_KEY, config.OSS_ENDPOINT, config.OSS_BUCKET_NAME)
+    storage = OSSProvider(config.OSS_ACCESS_KEY, config.OSS_SECRET_KEY, config.OSS_ENDPOINT, config.OSS_BUCKET_NAME,
+                          config.OSS_BUCKET_ACL, config.OSS_ACL_CACHE_TTL,
+                          multipart_threshold=config.OSS_MULTIPART_THRESHOLD,
+                          part_size=config.OSS_PART_SIZE,
+                          num_threads=config.OSS_TRANSFER_THREADS,
+                          checkpoint_dir=config.OSS_CHECKPOINT_DIR or None)
     # res = storage.upload(os.path.join(config.BASE_PATH, "resources/img/bg2.png"), "images/bg2.png")
     res = storage.delete("images/bg2.png")
     print(res)
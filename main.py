@@ -1,49 +1,143 @@
+import sys
+
+from deduplicator.cache import HashCache
+from deduplicator.cascade import MatchCascade
 from deduplicator.core import ImageDeduplicator
 from deduplicator.storage import OSSProvider, LocalStorageProvider
 from deduplicator.database import DatabaseManager
 from deduplicator.hashing import ImageHasher
+from deduplicator.index import FingerprintIndex
+from deduplicator.metrics import configure_logging, metrics
+from deduplicator.mmap_index import MmapFingerprintIndex
+from deduplicator.outbox import UploadOutbox
+from deduplicator.segments import SegmentIndex
+from deduplicator.service import DedupService, make_server
 from config import config
 
 
-def main():
+def build_deduplicator():
+    configure_logging(config.LOG_LEVEL, config.LOG_JSON)
+    metrics.enable(config.METRICS_ENABLED)
+
     # 初始化组件（oss存储有图片去重机制，这里只是演示）
     storage = OSSProvider(
         config.OSS_ACCESS_KEY,
         config.OSS_SECRET_KEY,
         config.OSS_ENDPOINT,
-        config.OSS_BUCKET_NAME
+        config.OSS_BUCKET_NAME,
+        config.OSS_BUCKET_ACL,
+        config.OSS_ACL_CACHE_TTL,
+        multipart_threshold=config.OSS_MULTIPART_THRESHOLD,
+        part_size=config.OSS_PART_SIZE,
+        num_threads=config.OSS_TRANSFER_THREADS,
+        checkpoint_dir=config.OSS_CHECKPOINT_DIR or None
     )
 
     # 测试时可以使用本地存储
     # storage = LocalStorageProvider(config.LOCAL_STORAGE_PATH)
 
-    db = DatabaseManager(config.DB_PATH)
+    db = DatabaseManager(config.DB_PATH, hash_bits=config.HASH_SIZE ** 2)
+    cache = HashCache(config.HASH_CACHE_PATH, config.HASH_CACHE_MAX_ENTRIES) if config.HASH_CACHE_PATH else None
     hasher = ImageHasher(
         method=config.HASH_METHOD,
         hash_size=config.HASH_SIZE,
-        highfreq_factor=config.HIGHFREQ_FACTOR
+        highfreq_factor=config.HIGHFREQ_FACTOR,
+        fast_decode=config.FAST_DECODE,
+        cache=cache,
+        orientation_invariant=config.ORIENTATION_INVARIANT,
+        segments=config.SEGMENT_MATCHING
     )
 
-    deduplicator = ImageDeduplicator(storage, db, hasher)
+    cascade = None
+    if config.MATCH_PREFILTER:
+        cascade = MatchCascade(
+            policy=config.MATCH_POLICY,
+            prefilter=config.MATCH_PREFILTER,
+            verify=tuple(config.MATCH_VERIFY),
+            weights=config.MATCH_WEIGHTS,
+            quorum=config.MATCH_QUORUM,
+            prefilter_factor=config.MATCH_PREFILTER_FACTOR
+        )
+
+    if config.MMAP_INDEX_DIR:
+        index = MmapFingerprintIndex(config.MMAP_INDEX_DIR, db, hash_bits=config.HASH_SIZE ** 2,
+                                     read_only=config.MMAP_INDEX_READ_ONLY)
+    else:
+        index = FingerprintIndex(config.INDEX_TYPE, hash_bits=config.HASH_SIZE ** 2, cascade=cascade)
+
+    segment_index = None
+    if config.SEGMENT_MATCHING:
+        segment_index = SegmentIndex(config.INDEX_TYPE, hash_bits=config.HASH_SIZE ** 2,
+                                     threshold=hasher.scale_threshold(config.SEGMENT_THRESHOLD),
+                                     min_votes=config.SEGMENT_MIN_VOTES)
+
+    outbox = None
+    if config.OUTBOX_ENABLED:
+        outbox = UploadOutbox(
+            db, storage,
+            spool_dir=config.OUTBOX_SPOOL_DIR or None,
+            workers=config.OUTBOX_WORKERS,
+            max_attempts=config.OUTBOX_MAX_ATTEMPTS,
+            backoff_base=config.OUTBOX_BACKOFF_BASE,
+            backoff_max=config.OUTBOX_BACKOFF_MAX
+        ).start()
+
+    return ImageDeduplicator(storage, db, hasher, index, config.SIMILARITY_THRESHOLD, segment_index, outbox)
+
+
+def serve():
+    """常驻服务：索引只加载一次，通过 HTTP / Unix 套接字提供 check、upload、find_similar、scan"""
+    service = DedupService(build_deduplicator(), max_batch=config.SERVICE_MAX_BATCH,
+                           max_wait=config.SERVICE_MAX_WAIT_MS / 1000)
+    server = make_server(service, config.SERVICE_HOST, config.SERVICE_PORT, config.SERVICE_SOCKET or None)
+    print(f"Dedup service listening on {config.SERVICE_SOCKET or f'{config.SERVICE_HOST}:{config.SERVICE_PORT}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if service.dedup.outbox is not None:
+            service.dedup.outbox.close()
+        if service.dedup.hasher.cache is not None:
+            service.dedup.hasher.cache.close()
+
+
+def main():
+    deduplicator = build_deduplicator()
 
     # 上传新图片
     image_path = "resources/img/bg1.png"
     result, message = deduplicator.upload_image(image_path)
 
-    if result:
+    if result and deduplicator.outbox is not None:
+        status = deduplicator.outbox.wait(result)
+        print(f"Image queued as {result}: {status['status']}")
+    elif result:
         print(f"Image uploaded successfully: {result}")
     else:
         print(f"Upload failed: {message}")
 
     # 检查OSS重复
-    duplicates = deduplicator.find_duplicates()
-    if duplicates:
-        print("\nDuplicate images found:")
-        for img1, img2, distance in duplicates:
-            print(f"- {img1} and {img2} (distance: {distance})")
-    else:
+    found = False
+    for group in deduplicator.find_duplicates(incremental=config.INCREMENTAL_SCAN):
+        if not found:
+            print("\nDuplicate images found:")
+            found = True
+        others = ', '.join(path for path in group.members if path != group.representative)
+        print(f"- {group.representative}: {others}")
+    if not found:
         print("\nNo duplicate images found")
 
+    if deduplicator.outbox is not None:
+        deduplicator.outbox.close()
+    if deduplicator.hasher.cache is not None:
+        deduplicator.hasher.cache.close()
+
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:] == ["serve"]:
+        serve()
+    else:
+        main()